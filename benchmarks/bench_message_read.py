@@ -0,0 +1,172 @@
+"""
+So sánh đường nhận block cũ (recv + extend + cắt lát) với Message.read mới (recv_into + memoryview)
+và MessageReader (nhận khối lớn vào buffer vòng, giải mã nhiều thông điệp mỗi syscall).
+
+Chạy: python benchmarks/bench_message_read.py [số block]
+
+Với mỗi đường nhận, in thông lượng và số byte được cấp phát tạm (đỉnh tracemalloc) cho mỗi block 16 KiB.
+Mỗi bản sao dữ liệu của block tạo một object mới, nên số này thể hiện số lần chép:
+đường cũ chép block khoảng 4 lần (recv, extend, Payload = buf[1:], Payload[8:])
+trước khi ghi vào buffer mảnh; đường mới nhận thẳng vào buffer tái sử dụng.
+Phần cuối đếm số lần gọi recv cho mỗi thông điệp khi peer gửi dồn nhiều Have.
+"""
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+import tracemalloc
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging
+logging.disable(logging.CRITICAL)
+from p2p.message import Message
+from p2p.message_reader import MessageReader
+from p2p.request_pipeline import MAX_BLOCK_SIZE
+
+BLOCKS = 4096
+
+
+def legacy_read(r):
+    """Message.read trước khi đổi sang recv_into (giữ lại để so sánh)."""
+    logging.debug("Reading message")
+    length_buf = r.recv(4)
+    logging.debug(f"Received message length buffer: {length_buf}")
+    length = struct.unpack('>I', length_buf)[0]
+    logging.debug(f"Received message length: {length}")
+    message_buf = bytearray()
+    while len(message_buf) < length:
+        part = r.recv(length - len(message_buf))
+        if not part:
+            raise ConnectionError("Socket connection closed by peer")
+        message_buf.extend(part)
+    message_id = message_buf[0]
+    payload = message_buf[1:]
+    logging.debug(f"Received {Message(message_id).name()} with ID {message_id} and payload length {len(payload)}")
+    return Message(message_id=message_id, payload=payload)
+
+
+def legacy_parse_piece(buf, msg):
+    """Message.parse_piece trước khi dùng memoryview."""
+    parsed_index = struct.unpack('>I', msg.Payload[0:4])[0]
+    begin = struct.unpack('>I', msg.Payload[4:8])[0]
+    data = msg.Payload[8:]
+    buf[begin:begin + len(data)] = data
+    return len(data)
+
+
+def send_blocks(sock, blocks):
+    # Thông điệp được tạo sẵn để luồng gửi không cấp phát trong lúc đo
+    messages = [Message.format_piece(0, i * MAX_BLOCK_SIZE, os.urandom(MAX_BLOCK_SIZE)).serialize() for i in range(16)]
+    for i in range(blocks):
+        sock.sendall(messages[i % 16])
+
+
+def receive(read_block, blocks, trace=False):
+    """Nhận `blocks` block; trả về (thời gian, số byte cấp phát tạm trung bình mỗi block)."""
+    sender, receiver = socket.socketpair()
+    piece_buffer = bytearray(16 * MAX_BLOCK_SIZE)
+    writer = threading.Thread(target=send_blocks, args=(sender, blocks))
+    writer.start()
+    time.sleep(0.1)
+
+    peak_total = 0
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(blocks):
+        if trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        read_block(receiver, piece_buffer)
+        if trace:
+            peak_total += tracemalloc.get_traced_memory()[1] - baseline
+    elapsed = time.perf_counter() - start
+    if trace:
+        tracemalloc.stop()
+
+    writer.join()
+    sender.close()
+    receiver.close()
+    return elapsed, peak_total / blocks
+
+
+def run(name, read_block, blocks):
+    elapsed, _ = receive(read_block, blocks)
+    _, allocated = receive(read_block, min(blocks, 512), trace=True)
+    print(f"{name:<10} {blocks * MAX_BLOCK_SIZE / elapsed / 1e6:8.1f} MB/s   "
+          f"{allocated:10.0f} bytes allocated per block")
+
+
+class CountingSocket:
+    """Bọc socket để đếm số lần gọi recv/recv_into."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def recv(self, size):
+        self.calls += 1
+        return self.sock.recv(size)
+
+    def recv_into(self, view):
+        self.calls += 1
+        return self.sock.recv_into(view)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+def have_flood(name, make_read, count):
+    """Đếm số syscall nhận cho mỗi thông điệp khi peer gửi dồn `count` thông điệp Have."""
+    sender, receiver = socket.socketpair()
+    counting = CountingSocket(receiver)
+    read = make_read(counting)
+    data = b''.join(bytes(Message.format_have(i).serialize()) for i in range(count))
+    writer = threading.Thread(target=sender.sendall, args=(data,))
+    writer.start()
+    for _ in range(count):
+        read()
+    writer.join()
+    sender.close()
+    receiver.close()
+    print(f"{name:<10} {counting.calls / count:8.4f} recv calls per Have message")
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else BLOCKS
+
+    def legacy(sock, piece_buffer):
+        legacy_parse_piece(piece_buffer, legacy_read(sock))
+
+    block_buffer = bytearray(MAX_BLOCK_SIZE + 8)
+
+    def zero_copy(sock, piece_buffer):
+        msg, err = Message.read(sock, block_buffer)
+        if err:
+            raise err
+        Message.parse_piece(0, piece_buffer, msg)
+
+    readers = {}
+
+    def buffered(sock, piece_buffer):
+        if sock not in readers:
+            readers[sock] = MessageReader(sock)
+        msg, err = readers[sock].read()
+        if err:
+            raise err
+        Message.parse_piece(0, piece_buffer, msg)
+
+    print(f"{blocks} blocks of {MAX_BLOCK_SIZE} bytes")
+    run('legacy', legacy, blocks)
+    run('recv_into', zero_copy, blocks)
+    run('reader', buffered, blocks)
+
+    print()
+    have_flood('legacy', lambda sock: lambda: legacy_read(sock), blocks)
+    have_flood('recv_into', lambda sock: lambda: Message.read(sock), blocks)
+    have_flood('reader', lambda sock: MessageReader(sock).read, blocks)
+
+
+if __name__ == '__main__':
+    main()
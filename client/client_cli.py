@@ -19,15 +19,36 @@ def main():
                 torrent_file (str): Path to the torrent file.
                 --port (int): Port to use for downloading (default: 6881).
                 --download-dir (str): Directory to save the downloaded file.
+                --engine (str): Download engine, 'thread' or 'asyncio' (default: 'thread').
+                --max-download (int): Download rate limit for this torrent in KiB/s (0: unlimited).
         download_magnet: Download a torrent using a magnet link.
             Arguments:
                 magnet_link (str): Magnet link to download the torrent.
                 --download-dir (str): Directory to save the downloaded file.
+                --engine (str): Download engine, 'thread' or 'asyncio' (default: 'thread').
+                --reannounce (bool): Ask the tracker for peers again after fetching metadata.
+                --max-download (int): Download rate limit for this torrent in KiB/s (0: unlimited).
         seed: Seed a torrent file.
             Arguments:
                 torrent_file (str): Path to the torrent file.
                 complete_file (str): Path to the complete file to seed.
                 --port (int): Port to use for seeding (default: 6882).
+                --cache-mb (int): Memory budget for the seeding piece cache in MiB (default: 64; used with --no-sendfile).
+                --no-sendfile: Read blocks through the piece cache instead of sending them with os.sendfile.
+                --upload-slots (int): Number of peers unchoked at once, including the optimistic unchoke (default: 4).
+                --choke-interval (int): Seconds between choke rounds (default: 10).
+                --optimistic-interval (int): Seconds between optimistic unchoke rotations (default: 30).
+                --max-upload (int): Upload rate limit for this torrent in KiB/s (0: unlimited).
+                --engine (str): Seeding server, 'asyncio' (one event loop) or 'thread' (one thread per peer) (default: 'asyncio').
+                --backlog (int): Listen backlog of the seeding socket (default: 128).
+                --max-connections (int): Maximum number of peers served at once (default: 1000).
+                --max-handshakes (int): Maximum number of incoming handshakes run at once (default: 32).
+                --read-ahead (int): Number of following pieces read ahead when a peer starts a piece (default: 1).
+        limit: Change rate limits while the client is running.
+            Arguments:
+                --max-upload (int): Upload rate limit in KiB/s (0: unlimited).
+                --max-download (int): Download rate limit in KiB/s (0: unlimited).
+                --torrent (str): Torrent file to limit; without it the limits apply to all torrents together.
         status: Show the status of the torrent client.
         peers: Manage peers for a torrent file.
             Arguments:
@@ -65,17 +86,39 @@ def main():
     download_parser.add_argument('torrent_file', help='Path to the torrent file')
     download_parser.add_argument('--port', type=int, default=6881, help='Port to use for downloading')
     download_parser.add_argument('--download-dir', help='Directory to save the downloaded file')
+    download_parser.add_argument('--engine', choices=['thread', 'asyncio'], default='thread', help='Download engine: one thread per peer, or one asyncio event loop for all peers')
+    download_parser.add_argument('--max-download', type=int, help='Download rate limit for this torrent in KiB/s (0: unlimited)')
 
     # Command download magnet
     download_magnet_parser = subparsers.add_parser('download_magnet')
     download_magnet_parser.add_argument('magnet_link', help='Magnet link to download the torrent')
     download_magnet_parser.add_argument('--download-dir', help='Directory to save the downloaded file')
+    download_magnet_parser.add_argument('--engine', choices=['thread', 'asyncio'], default='thread', help='Download engine: one thread per peer, or one asyncio event loop for all peers')
+    download_magnet_parser.add_argument('--reannounce', action='store_true', help='Ask the tracker for peers again after fetching metadata instead of reusing the metadata connections')
+    download_magnet_parser.add_argument('--max-download', type=int, help='Download rate limit for this torrent in KiB/s (0: unlimited)')
 
     # Command seed
     seed_parser = subparsers.add_parser('seed')
     seed_parser.add_argument('torrent_file', help='Path to the torrent file')
     seed_parser.add_argument('complete_file', help='Path to the complete file to seed')
     seed_parser.add_argument('--port', type=int, default=6882, help='Port to use for seeding')
+    seed_parser.add_argument('--cache-mb', type=int, default=64, help='Memory budget for the seeding piece cache in MiB (0 disables it); only used with --no-sendfile')
+    seed_parser.add_argument('--no-sendfile', action='store_true', help='Read blocks through the piece cache instead of sending them with os.sendfile')
+    seed_parser.add_argument('--upload-slots', type=int, default=4, help='Number of peers unchoked at once, including the optimistic unchoke')
+    seed_parser.add_argument('--choke-interval', type=int, default=10, help='Seconds between choke rounds')
+    seed_parser.add_argument('--optimistic-interval', type=int, default=30, help='Seconds between optimistic unchoke rotations')
+    seed_parser.add_argument('--max-upload', type=int, help='Upload rate limit for this torrent in KiB/s (0: unlimited)')
+    seed_parser.add_argument('--engine', choices=['asyncio', 'thread'], default='asyncio', help='Seeding server: one asyncio event loop for all peers, or one thread per peer')
+    seed_parser.add_argument('--backlog', type=int, default=128, help='Listen backlog of the seeding socket')
+    seed_parser.add_argument('--max-connections', type=int, default=1000, help='Maximum number of peers served at once')
+    seed_parser.add_argument('--read-ahead', type=int, default=1, help='Number of following pieces read ahead when a peer starts requesting a piece')
+    seed_parser.add_argument('--max-handshakes', type=int, default=32, help='Maximum number of incoming handshakes run at once; each must finish within 10 seconds')
+
+    # Command limit
+    limit_parser = subparsers.add_parser('limit')
+    limit_parser.add_argument('--max-upload', type=int, help='Upload rate limit in KiB/s (0: unlimited)')
+    limit_parser.add_argument('--max-download', type=int, help='Download rate limit in KiB/s (0: unlimited)')
+    limit_parser.add_argument('--torrent', help='Torrent file to limit; all torrents together if omitted')
 
     # Command status
     status_parser = subparsers.add_parser('status')
@@ -109,11 +152,15 @@ def main():
     if args.command:
         try:
             if args.command == 'download':
-                client.download_torrent(args.torrent_file, port=args.port, download_dir=args.download_dir)
+                client.download_torrent(args.torrent_file, port=args.port, download_dir=args.download_dir, engine=args.engine, max_download=args.max_download)
             elif args.command == 'download_magnet':
-                client.download_magnet(args.magnet_link, download_dir=args.download_dir)
+                client.download_magnet(args.magnet_link, download_dir=args.download_dir, engine=args.engine, reannounce=args.reannounce, max_download=args.max_download)
             elif args.command == 'seed':
-                client.seed_torrent(args.torrent_file, args.complete_file, port=args.port)
+                client.seed_torrent(args.torrent_file, args.complete_file, port=args.port, upload_rate=args.max_upload, cache_mb=args.cache_mb, use_sendfile=not args.no_sendfile,
+                                    upload_slots=args.upload_slots, choke_interval=args.choke_interval, optimistic_interval=args.optimistic_interval,
+                                    engine=args.engine, backlog=args.backlog, max_connections=args.max_connections, max_handshakes=args.max_handshakes, read_ahead=args.read_ahead)
+            elif args.command == 'limit':
+                client.set_rate_limits(args.max_upload, args.max_download, args.torrent)
             elif args.command == 'status':
                 client.show_status()
             elif args.command == 'peers':
@@ -153,11 +200,15 @@ def main():
                 continue
 
             if args.command == 'download':
-                client.download_torrent(args.torrent_file, port=args.port, download_dir=args.download_dir)
+                client.download_torrent(args.torrent_file, port=args.port, download_dir=args.download_dir, engine=args.engine, max_download=args.max_download)
             elif args.command == 'download_magnet':
-                client.download_magnet(args.magnet_link, download_dir=args.download_dir)
+                client.download_magnet(args.magnet_link, download_dir=args.download_dir, engine=args.engine, reannounce=args.reannounce, max_download=args.max_download)
             elif args.command == 'seed':
-                client.seed_torrent(args.torrent_file, args.complete_file, port=args.port)
+                client.seed_torrent(args.torrent_file, args.complete_file, port=args.port, upload_rate=args.max_upload, cache_mb=args.cache_mb, use_sendfile=not args.no_sendfile,
+                                    upload_slots=args.upload_slots, choke_interval=args.choke_interval, optimistic_interval=args.optimistic_interval,
+                                    engine=args.engine, backlog=args.backlog, max_connections=args.max_connections, max_handshakes=args.max_handshakes, read_ahead=args.read_ahead)
+            elif args.command == 'limit':
+                client.set_rate_limits(args.max_upload, args.max_download, args.torrent)
             elif args.command == 'status':
                 client.show_status()
             elif args.command == 'peers':
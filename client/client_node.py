@@ -7,6 +7,8 @@ import os
 import sys
 import socket
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -16,13 +18,30 @@ import logging
 import urllib
 from tabulate import tabulate
 from p2p.download_manager import DownloadingManager
+from p2p.async_download_manager import AsyncDownloadingManager
 from p2p.peer import Peer
 from p2p.upload_manager import UploadingManager
+from p2p.fast_resume import FastResume, RESUME_DIR
+from p2p.connection_pool import ConnectionPool
+from p2p.piece_cache import DEFAULT_PIECE_CACHE_MB
+from p2p.prefetcher import READ_AHEAD_PIECES, PREFETCH_WORKERS
+from metainfo.file_pool import FilePool
+from p2p.choker import ChokeTimer, UPLOAD_SLOTS, CHOKE_INTERVAL, OPTIMISTIC_INTERVAL
+from p2p.rate_limiter import TokenBucket
+from p2p.seeding_server import SeedingServer, LISTEN_BACKLOG, MAX_CONNECTIONS
+from p2p.handshake_stage import HandshakeStage, MAX_HANDSHAKES
 from p2p.piece import Piece
 from p2p.peer_communication import Communicator
 # Configure logging
 import logging_config
 
+DOWNLOAD_ENGINES = {
+    'thread': DownloadingManager,
+    'asyncio': AsyncDownloadingManager,
+}
+DEFAULT_ANNOUNCE_INTERVAL = 1800  # Chu kỳ announce lại (giây) khi tracker không trả về `interval`
+REANNOUNCE_POLL = 60  # Luồng announce lại thức dậy ít nhất mỗi chừng này giây
+
 def _generate_peer_id(length=20):
     """Generate a random peer ID."""
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
@@ -40,12 +59,35 @@ class ClientNode:
         self.announce_port = 6883
         self.ping_port = 6884
         self.downloadding_manager = None
-        self.uploading_manager = None
-        self.stop_event = threading.Event()  # Event to signal the server thread to stop
+        self.uploading_managers = {}  # info_hash -> UploadingManager của mọi torrent đang seed
+        self.seeding_server = None
+        self.seeding_thread = None  # Luồng server seed, dùng chung cho mọi torrent trên một port
+        self.seeding_port = None
+        self.seeding_stop = None  # Event dừng server seed đang chạy; mỗi server có event riêng
+        self.handshake_stage = None  # Handshake của server seed dùng luồng
+        self.stop_event = threading.Event()  # Event to signal the ping server thread to stop
         self.seeding_files = {}  # Dictionary to store seeding files info
         self.announced_trackers = set()  # Set to store announced trackers
+        self.resume_dir = RESUME_DIR  # Nơi lưu trạng thái fast-resume của từng torrent
+        self.connection_pool = ConnectionPool()  # Kết nối đã handshake, dùng lại giữa lấy metadata và tải
+        self.file_pools = {}  # info_hash -> FilePool, file mở sẵn dùng chung giữa tải và seed
+        self.file_pool_users = {}  # info_hash -> số lượt tải/seed đang giữ FilePool đó
+        self.file_pools_lock = threading.Lock()
+        # Giới hạn tốc độ chung của client; mỗi torrent có bucket riêng lấy token từ bucket chung
+        self.upload_limiter = TokenBucket()
+        self.download_limiter = TokenBucket()
+        self.torrent_limiters = {}  # info_hash -> {'upload': TokenBucket, 'download': TokenBucket}
+        # Một luồng choke và một pool đọc trước cho mọi torrent đang seed, không tăng theo số torrent
+        self.choke_timer = ChokeTimer()
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
         self.ping_thread = threading.Thread(target=self.start_ping_server)
         self.ping_thread.start()
+        # Torrent đang tải hoặc seed được announce lại theo `interval` của tracker, nếu không tracker xoá peer
+        self.reannounces = {}  # info_hash -> {'tracker_url', 'port', 'left', 'next'}
+        self.announce_intervals = {}  # info_hash -> `interval` tracker trả về ở lần announce gần nhất
+        self.reannounce_lock = threading.Lock()
+        self.reannounce_thread = threading.Thread(target=self._reannounce_loop, daemon=True)
+        self.reannounce_thread.start()
         self.info = None
     def _load_torrent_file(self, torrent_file):
         """Load and parse the .torrent file."""
@@ -82,8 +124,13 @@ class ClientNode:
         trackers = params.get('tr', [])
         self.tracker_url = trackers[0] if trackers else None
         return bytes.fromhex(info_hash), trackers
-    def announce(self, info_hash, port, event='started', useMagnets=False):
-        """Send announce request to tracker and update client state."""
+    def announce(self, info_hash, port, event='started', useMagnets=False, left=None, tracker_url=None):
+        """
+        Send announce request to tracker and update client state.
+        `left` defaults to the size of the loaded torrent and `tracker_url` to its tracker;
+        `event=None` is a regular re-announce.
+        """
+        tracker_url = tracker_url or self.tracker_url
         if useMagnets:
             params = {
                 'info_hash': info_hash,
@@ -93,13 +140,14 @@ class ClientNode:
                 'compact': 1
             }
         else:
-            info = self.info
-            if 'length' in info:
-                file_length = info['length']
-            elif 'files' in info:
-                file_length = sum(file['length'] for file in info['files'])
-            else:
-                raise KeyError("Neither 'length' nor 'files' key found in torrent info dictionary.")
+            if left is None:
+                info = self.info
+                if 'length' in info:
+                    left = info['length']
+                elif 'files' in info:
+                    left = sum(file['length'] for file in info['files'])
+                else:
+                    raise KeyError("Neither 'length' nor 'files' key found in torrent info dictionary.")
 
             params = {
                 'info_hash': info_hash,
@@ -107,7 +155,7 @@ class ClientNode:
                 'port': port,
                 'uploaded': 0,
                 'downloaded': 0,
-                'left': file_length,  # Set the length of the file from the torrent data
+                'left': left,  # Set the length of the file from the torrent data
                 'event': event,
                 'compact': 1
             }
@@ -115,14 +163,15 @@ class ClientNode:
             params['trackerid'] = self.tracker_id
 
         try:
-            response = requests.get(self.tracker_url, params=params)
+            response = requests.get(tracker_url, params=params)
             response.raise_for_status()
             response_data = bencodepy.decode(response.content)
             self.has_announced = True  # Confirm that the client has announced to the tracker
-            self.announced_trackers.add(self.tracker_url)  # Add the tracker to the announced trackers set
+            self.announced_trackers.add(tracker_url)  # Add the tracker to the announced trackers set
             if b'failure reason' in response_data:
                 logging.error(f"Tracker error: {response_data[b'failure reason'].decode()}")
                 return []
+            self.announce_intervals[info_hash] = response_data.get(b'interval', DEFAULT_ANNOUNCE_INTERVAL)
             if b'warning message' in response_data:
                 logging.warning(f"Tracker warning: {response_data[b'warning message'].decode()}")
             if b'tracker id' in response_data:
@@ -136,8 +185,90 @@ class ClientNode:
             logging.error(f"Error during announce request: {e}")
             return []
 
-    def download_torrent(self, torrent_file, port=None, download_dir=None):
-        """Handle the download process of a torrent."""
+    def keep_announcing(self, info_hash, port, left):
+        """Announce lại `info_hash` mỗi `interval` giây của tracker cho đến khi stop_announcing."""
+        with self.reannounce_lock:
+            self.reannounces[info_hash] = {
+                'tracker_url': self.tracker_url,
+                'port': port,
+                'left': left,
+                'next': time.monotonic() + self.announce_intervals.get(info_hash, DEFAULT_ANNOUNCE_INTERVAL),
+            }
+
+    def set_announce_left(self, info_hash, left):
+        """Cập nhật `left` gửi ở các lần announce lại, ví dụ về 0 khi tải xong."""
+        with self.reannounce_lock:
+            if info_hash in self.reannounces:
+                self.reannounces[info_hash]['left'] = left
+
+    def stop_announcing(self, info_hash):
+        with self.reannounce_lock:
+            self.reannounces.pop(info_hash, None)
+
+    def _reannounce_loop(self):
+        timeout = REANNOUNCE_POLL
+        while not self.stop_event.wait(timeout):
+            now = time.monotonic()
+            with self.reannounce_lock:
+                due = [(info_hash, dict(entry)) for info_hash, entry in self.reannounces.items() if entry['next'] <= now]
+            for info_hash, entry in due:
+                try:
+                    self.announce(info_hash, entry['port'], event=None, left=entry['left'], tracker_url=entry['tracker_url'])
+                except Exception as e:
+                    logging.error(f"Re-announce of {info_hash.hex()} failed: {e}")
+                interval = self.announce_intervals.get(info_hash, DEFAULT_ANNOUNCE_INTERVAL)
+                with self.reannounce_lock:
+                    if info_hash in self.reannounces:
+                        self.reannounces[info_hash]['next'] = time.monotonic() + interval
+            with self.reannounce_lock:
+                timeout = min([REANNOUNCE_POLL] + [entry['next'] - time.monotonic() for entry in self.reannounces.values()])
+            timeout = max(timeout, 0)
+
+    def file_pool(self, info_hash):
+        """FilePool của torrent `info_hash`, tạo mới nếu chưa có; mỗi lần lấy phải trả lại bằng release_file_pool."""
+        with self.file_pools_lock:
+            if info_hash not in self.file_pools:
+                self.file_pools[info_hash] = FilePool()
+                self.file_pool_users[info_hash] = 0
+            self.file_pool_users[info_hash] += 1
+            return self.file_pools[info_hash]
+
+    def release_file_pool(self, info_hash):
+        """Trả lại FilePool của `info_hash`; đóng các file khi không còn lượt tải hay seed nào dùng."""
+        with self.file_pools_lock:
+            self.file_pool_users[info_hash] -= 1
+            if self.file_pool_users[info_hash] == 0:
+                del self.file_pool_users[info_hash]
+                self.file_pools.pop(info_hash).close_all()
+
+    def torrent_limiter(self, info_hash, direction):
+        """TokenBucket 'upload' hoặc 'download' của torrent `info_hash`, tạo mới nếu chưa có."""
+        if info_hash not in self.torrent_limiters:
+            self.torrent_limiters[info_hash] = {
+                'upload': TokenBucket(parent=self.upload_limiter),
+                'download': TokenBucket(parent=self.download_limiter),
+            }
+        return self.torrent_limiters[info_hash][direction]
+
+    def set_rate_limits(self, max_upload=None, max_download=None, torrent_file=None):
+        """
+        Đổi giới hạn tốc độ (KiB/s, 0 = không giới hạn) khi đang chạy, cho cả client
+        hoặc chỉ cho `torrent_file`. Giá trị None giữ nguyên giới hạn hiện tại.
+        """
+        if torrent_file:
+            torrent_data, info = self._load_torrent_file(torrent_file)
+            info_hash = hashlib.sha1(bencodepy.encode(info)).digest()
+            upload, download = self.torrent_limiter(info_hash, 'upload'), self.torrent_limiter(info_hash, 'download')
+        else:
+            upload, download = self.upload_limiter, self.download_limiter
+        if max_upload is not None:
+            upload.set_rate(max_upload * 1024)
+        if max_download is not None:
+            download.set_rate(max_download * 1024)
+        logging.info(f"Rate limits for {torrent_file or 'all torrents'}: upload {upload.rate // 1024 or 'unlimited'} KiB/s, download {download.rate // 1024 or 'unlimited'} KiB/s")
+
+    def download_torrent(self, torrent_file, port=None, download_dir=None, engine='thread', max_download=None):
+        """Handle the download process of a torrent; `max_download` caps it in KiB/s."""
         torrent_data, info = self._load_torrent_file(torrent_file)
         info_hash = hashlib.sha1(bencodepy.encode(info)).digest()
         logging.info(f"Starting download from {self.tracker_url} on port {port or self.download_port}...")
@@ -177,26 +308,58 @@ class ClientNode:
         peer_id_encoded = self.peer_id.encode("utf-8")
         # Start the download process
         
-        self.downloading_manager = DownloadingManager()  # Pass progress bar
-        if self.downloading_manager.start_download(peers, pieces, info_hash, peer_id_encoded, file_path, info['files'] if 'files' in info else None):
-            self.announce(info_hash, port or self.download_port, event='completed')
-            logging.info(f"Download completed. Files saved to {file_path}")
-            print(f"Download completed. Files saved to {file_path}")
-        else:
-            logging.error("Download failed.")
-            print("Download failed.")
-
-    def seed_torrent(self, torrent_file, complete_file, port=None, upload_rate=None):
-        """Handle the seeding process of a torrent."""
+        self.downloading_manager = DOWNLOAD_ENGINES[engine]()
+        fast_resume = FastResume(info_hash, self.resume_dir)
+        if max_download is not None:
+            self.torrent_limiter(info_hash, 'download').set_rate(max_download * 1024)
+        if info_hash not in self.uploading_managers:
+            self.keep_announcing(info_hash, port or self.download_port, total_length)
+        file_pool = self.file_pool(info_hash)
+        try:
+            if self.downloading_manager.start_download(peers, pieces, info_hash, peer_id_encoded, file_path, info['files'] if 'files' in info else None, fast_resume,
+                                                      file_pool=file_pool, download_limiter=self.torrent_limiter(info_hash, 'download')):
+                self.set_announce_left(info_hash, 0)
+                self.announce(info_hash, port or self.download_port, event='completed', left=0)
+                logging.info(f"Download completed. Files saved to {file_path}")
+                print(f"Download completed. Files saved to {file_path}")
+            else:
+                logging.error("Download failed.")
+                print("Download failed.")
+        finally:
+            self.release_file_pool(info_hash)
+            if info_hash not in self.uploading_managers:
+                self.stop_announcing(info_hash)
+
+    def seed_torrent(self, torrent_file, complete_file, port=None, upload_rate=None, cache_mb=DEFAULT_PIECE_CACHE_MB, use_sendfile=True,
+                     upload_slots=UPLOAD_SLOTS, choke_interval=CHOKE_INTERVAL, optimistic_interval=OPTIMISTIC_INTERVAL,
+                     engine='asyncio', backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS, max_handshakes=MAX_HANDSHAKES, read_ahead=READ_AHEAD_PIECES):
+        """
+        Handle the seeding process of a torrent; `upload_rate` caps it in KiB/s and `cache_mb` bounds the
+        in-memory piece cache used when `use_sendfile` is off.
+        `upload_slots`, `choke_interval` and `optimistic_interval` configure the choker.
+        `read_ahead` is the number of following pieces read ahead when a peer starts requesting a piece.
+        `engine` picks the seeding server: one asyncio event loop for all peers, or one thread per peer.
+        At most `max_handshakes` incoming handshakes run at once, each with a deadline.
+        Every seeded torrent shares one server and port; the server options only apply to the first seed.
+        """
         torrent_data, info = self._load_torrent_file(torrent_file)
+        if self.seeding_thread is not None and self.seeding_stop.is_set():
+            # Server cũ đang dừng vì torrent cuối vừa bị stop: chờ nó nhả port rồi mở server mới
+            self.seeding_thread.join()
+        if self.seeding_port is not None and port not in (None, self.seeding_port):
+            logging.warning(f"Seeding server already listens on port {self.seeding_port}, ignoring port {port}")
+        port = self.seeding_port or port or self.upload_port
 
         piece_size=16384
         metadata_bytes = bencodepy.encode(info)
         metadata_pieces = [metadata_bytes[i:i + piece_size] for i in range(0, len(metadata_bytes), piece_size)]
 
         info_hash = hashlib.sha1(bencodepy.encode(info)).digest()
-        logging.info(f"Starting seeding to {self.tracker_url} on port {port or self.upload_port} with upload rate {upload_rate}...")
-        peers = self.announce(info_hash, port or self.upload_port, event='completed')
+        logging.info(f"Starting seeding to {self.tracker_url} on port {port} with upload rate {upload_rate}...")
+        if upload_rate is not None:
+            self.torrent_limiter(info_hash, 'upload').set_rate(upload_rate * 1024)
+        left = 0  # Seed có đủ dữ liệu; announce lại dùng cùng giá trị
+        peers = self.announce(info_hash, port, event='completed', left=left)
         logging.info(f"Seeding to peers: {peers}")
         peers = [Peer(peer['ip'], peer['port']) for peer in peers]
         
@@ -222,28 +385,57 @@ class ClientNode:
             total_lengths = [total_length]
         
 
-        self.uploading_manager = UploadingManager(pieces, self.peer_id.encode("utf-8"), info_hash, file_paths, total_lengths, metadata=metadata_pieces)
+        old_manager = self.uploading_managers.get(info_hash)
+        self.uploading_managers[info_hash] = UploadingManager(pieces, self.peer_id.encode("utf-8"), info_hash, file_paths, total_lengths, metadata=metadata_pieces, cache_mb=cache_mb, use_sendfile=use_sendfile, file_pool=self.file_pool(info_hash),
+                                                  upload_slots=upload_slots, choke_interval=choke_interval, optimistic_interval=optimistic_interval,
+                                                  upload_limiter=self.torrent_limiter(info_hash, 'upload'), read_ahead=read_ahead,
+                                                  choke_timer=self.choke_timer, prefetch_executor=self.prefetch_executor)
+        if old_manager is not None:
+            # Seed lại torrent đang seed: thay manager cũ, sau khi manager mới đã giữ FilePool
+            old_manager.stop()
+            self.release_file_pool(info_hash)
+        self.keep_announcing(info_hash, port, left)
         
-        # Start a server to accept incoming connections from peers
-        server_thread = threading.Thread(target=self._start_seeding_server, args=(port or self.upload_port,))
-        server_thread.start()
+        # Start a server to accept incoming connections from peers, unless one already serves the other torrents
+        if self.seeding_thread is None or not self.seeding_thread.is_alive():
+            self.seeding_port = port
+            self.seeding_stop = threading.Event()
+            self.seeding_thread = threading.Thread(target=self._start_seeding_server, args=(port, self.seeding_stop, engine, backlog, max_connections, max_handshakes))
+            self.seeding_thread.start()
         self.seeding_files[torrent_file] = (file_paths, self.tracker_url)  # Add to seeding files
 
-    def _start_seeding_server(self, port):
-        """Start a server to accept incoming connections from peers."""
+    def _start_seeding_server(self, port, stop_event, engine='asyncio', backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS, max_handshakes=MAX_HANDSHAKES):
+        """Start a server to accept incoming connections from peers, until `stop_event` is set."""
+        if engine == 'asyncio':
+            # Một event loop cho accept, handshake và phục vụ mọi peer
+            self.seeding_server = SeedingServer(self.uploading_managers, port, backlog, max_connections, max_handshakes=max_handshakes)
+            try:
+                self.seeding_server.run(stop_event)
+            finally:
+                self.seeding_server = None
+                self.seeding_port = None
+            return
+
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Set the SO_REUSEADDR option
         server_socket.bind(('0.0.0.0', port))
-        server_socket.listen(5)
+        server_socket.listen(backlog)
         logging.info(f"Seeding server started on port {port}")
+        # Handshake chạy trong stage riêng có deadline, vòng accept không bao giờ chờ peer
+        self.handshake_stage = HandshakeStage(self.uploading_managers, max_handshakes)
 
-        while not self.stop_event.is_set():  # Check the stop event
+        while not stop_event.is_set():  # Check the stop event
             try:
                 server_socket.settimeout(1)  # Set a timeout to periodically check the stop event
                 client_socket, client_address = server_socket.accept()
+                connected = sum(len(manager.peers) for manager in list(self.uploading_managers.values()))
+                if connected + self.handshake_stage.pending >= max_connections:
+                    logging.warning(f"Rejecting connection from {client_address}: {max_connections} peers connected")
+                    client_socket.close()
+                    continue
                 logging.info(f"Accepted connection from {client_address}")
                 peer = Peer(client_address[0], client_address[1])
-                self.uploading_manager.add_peer(peer, client_socket)
+                self.handshake_stage.submit(peer, client_socket)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -251,6 +443,8 @@ class ClientNode:
                 break
 
         server_socket.close()
+        self.handshake_stage.stop()
+        self.seeding_port = None
         logging.info("Seeding server stopped.")
 
     def show_status(self):
@@ -261,6 +455,44 @@ class ClientNode:
             logging.info("\nSeeding Torrents:\n" + tabulate(seeding_table, headers=["Torrent File", "Path", "Tracker"], tablefmt="grid"))
         else:
             logging.info("No seeding torrents.")
+        if self.uploading_managers:
+            cache_table = []
+            choker_table = []
+            for info_hash, manager in list(self.uploading_managers.items()):
+                stats = manager.piece_cache.stats()
+                prefetch = manager.prefetcher.stats()
+                if manager.use_sendfile:
+                    # Block gửi bằng sendfile không qua cache mảnh: không có số liệu cache để hiện
+                    cache_stats = ["sendfile"] + ["-"] * 6
+                else:
+                    cache_stats = ["piece cache", stats['hits'], stats['misses'], f"{stats['hit_rate']:.1%}", stats['evictions'],
+                                   stats['cached_pieces'], f"{stats['size_mb']:.1f} / {stats['capacity_mb']:.0f} MiB"]
+                cache_table.append([info_hash.hex()[:16]] + cache_stats +
+                                   [prefetch['read_ahead'], prefetch['triggered'], prefetch['prefetched'], prefetch['advised']])
+                choker = manager.choker.stats()
+                choker_table.append([info_hash.hex()[:16], choker['upload_slots'], choker['rounds'], choker['interested'],
+                                     ", ".join(choker['unchoked']) or "-", choker['optimistic'] or "-"])
+            logging.info("\nPiece Cache:\n" + tabulate(cache_table, headers=["Torrent", "Serving", "Hits", "Misses", "Hit Rate", "Evictions", "Pieces", "Size",
+                                                                                 "Read-ahead", "Prefetch Triggers", "Prefetched", "Kernel Read-ahead"], tablefmt="grid"))
+            if self.seeding_server is not None:
+                server = self.seeding_server.stats()
+                server_table = [[self.seeding_port, server['torrents'], server['connections'], server['max_connections'], server['backlog'], server['rejected'],
+                                 f"{server['handshaking']} / {server['max_handshakes']}", server['handshake_timeouts'], server['unknown_torrents']]]
+                logging.info("\nSeeding Server:\n" + tabulate(server_table, headers=["Port", "Torrents", "Connections", "Max Connections", "Backlog", "Rejected",
+                                                                                    "Handshaking", "Handshake Timeouts", "Unknown Torrents"], tablefmt="grid"))
+            elif self.handshake_stage is not None:
+                stage = self.handshake_stage.stats()
+                stage_table = [[self.seeding_port, f"{stage['handshaking']} / {stage['max_handshakes']}", stage['completed'], stage['failed'], stage['timeouts'],
+                                stage['rejected'], stage['unknown_torrents']]]
+                logging.info("\nHandshake Stage:\n" + tabulate(stage_table, headers=["Port", "Handshaking", "Completed", "Failed", "Timeouts", "Rejected", "Unknown Torrents"], tablefmt="grid"))
+            logging.info("\nChoker:\n" + tabulate(choker_table, headers=["Torrent", "Slots", "Rounds", "Interested", "Unchoked", "Optimistic"], tablefmt="grid"))
+        limit = lambda bucket: f"{bucket.rate // 1024} KiB/s" if bucket.rate else "unlimited"
+        rate_table = [["all", limit(self.upload_limiter), limit(self.download_limiter),
+                       f"{self.upload_limiter.consumed / (1024 * 1024):.1f} MiB", f"{self.download_limiter.consumed / (1024 * 1024):.1f} MiB"]]
+        for info_hash, buckets in self.torrent_limiters.items():
+            rate_table.append([info_hash.hex()[:16], limit(buckets['upload']), limit(buckets['download']),
+                               f"{buckets['upload'].consumed / (1024 * 1024):.1f} MiB", f"{buckets['download'].consumed / (1024 * 1024):.1f} MiB"])
+        logging.info("\nRate Limits:\n" + tabulate(rate_table, headers=["Torrent", "Max Upload", "Max Download", "Uploaded", "Downloaded"], tablefmt="grid"))
     def show_peers(self, torrent_file):
         """Show the list of peers for a torrent."""
         torrent_data, info = self._load_torrent_file(torrent_file)
@@ -279,8 +511,15 @@ class ClientNode:
         logging.info(f"Stopping torrent {torrent_file}...")
 
         # Notify tracker that we're stopping
+        self.stop_announcing(info_hash)
         self.announce(info_hash, port=self.announce_port, event='stopped')
-        self.stop_event.set()  # Signal the server thread to stop
+        manager = self.uploading_managers.pop(info_hash, None)
+        if manager is not None:
+            manager.stop()  # Peer mới bị từ chối ở handshake, peer đang kết nối thôi được phục vụ
+            self.release_file_pool(info_hash)  # Lượt tải cùng torrent (nếu có) vẫn giữ pool
+            self.seeding_files.pop(torrent_file, None)
+        if not self.uploading_managers and self.seeding_stop is not None:
+            self.seeding_stop.set()  # Signal the server thread to stop
         logging.info("Torrent stopped.")
 
     def remove_torrent(self, torrent_file):
@@ -355,7 +594,9 @@ class ClientNode:
     def sign_out(self):
         """Notify tracker that the client is offline if an event was announced."""
         if not self.has_announced:
-            self.stop_event.set()  # Signal the server thread to stop
+            self.stop_event.set()  # Signal the ping server thread to stop
+            if self.seeding_stop is not None:
+                self.seeding_stop.set()  # Signal the seeding server thread to stop
             self.ping_thread.join()  # Wait for the ping server thread to stop
             logging.info("No event announced, skipping sign out.")
 
@@ -376,12 +617,19 @@ class ClientNode:
         except requests.RequestException as e:
             logging.error(f"Error during sign out request: {e}")
         finally:
-            self.stop_event.set()  # Signal the server thread to stop
+            self.stop_event.set()  # Signal the ping server thread to stop
+            if self.seeding_stop is not None:
+                self.seeding_stop.set()  # Signal the seeding server thread to stop
             self.ping_thread.join()  # Wait for the ping server thread to stop
 
 
-    def download_magnet(self, magnet_link, download_dir=None):
-        """Download a torrent using a magnet link and return metadata."""
+    def download_magnet(self, magnet_link, download_dir=None, engine='thread', reannounce=False, max_download=None):
+        """
+        Download a torrent using a magnet link and return metadata.
+        The connection used to fetch metadata is kept and reused for the download;
+        the tracker is only asked for peers again when `reannounce` is set or no connection was kept.
+        `max_download` caps the download in KiB/s.
+        """
         info_hash, trackers = self.parse_magnet_link(magnet_link)
         peers = self.announce(info_hash, port=self.download_port, useMagnets=True)
         if not peers:
@@ -412,7 +660,11 @@ class ClientNode:
                         communicator.send_have_metadata(len(communicator.metadata))
                     
 
-                communicator.close_connection()  # Close the connection before breaking
+                if communicator.check_complete_metadata():
+                    # Giữ kết nối đã handshake để engine tải dùng lại
+                    self.connection_pool.put(communicator)
+                else:
+                    communicator.close_connection()  # Close the connection before breaking
                 break
             
             except Exception as e:
@@ -439,10 +691,14 @@ class ClientNode:
         logging.info(f"Metadata: {self.info}")
         if (info_hash != hashlib.sha1(bencodepy.encode(info)).digest()):
             logging.error("Metadata hash mismatch")
+            self.connection_pool.close_all(info_hash)
             return None
-        peers = self.announce(info_hash, self.download_port)
-        logging.info(f"Found peers: {peers}")
-        peers = [Peer(peer['ip'], peer['port']) for peer in peers]
+        if reannounce or not self.connection_pool.peers(info_hash):
+            peers = self.announce(info_hash, self.download_port)
+            logging.info(f"Found peers: {peers}")
+            peers = [Peer(peer['ip'], peer['port']) for peer in peers]
+        else:
+            logging.info(f"Reusing {len(self.connection_pool.peers(info_hash))} metadata connection(s); skipping second announce")
 
         # Create the download directory if it doesn't exist
         if download_dir and not os.path.exists(download_dir):
@@ -474,9 +730,25 @@ class ClientNode:
 
         peer_id_encoded = self.peer_id.encode("utf-8")
         # Start the download process
-        self.downloading_manager = DownloadingManager()  # Pass progress bar
-        if self.downloading_manager.start_download(peers, pieces, info_hash, peer_id_encoded, file_path, info['files'] if 'files' in info else None):
-            self.announce(info_hash, self.download_port, event='completed')
+        self.downloading_manager = DOWNLOAD_ENGINES[engine]()
+        fast_resume = FastResume(info_hash, self.resume_dir)
+        if max_download is not None:
+            self.torrent_limiter(info_hash, 'download').set_rate(max_download * 1024)
+        if info_hash not in self.uploading_managers:
+            self.keep_announcing(info_hash, self.download_port, total_length)
+        file_pool = self.file_pool(info_hash)
+        try:
+            download_ok = self.downloading_manager.start_download(peers, pieces, info_hash, peer_id_encoded, file_path, info['files'] if 'files' in info else None, fast_resume, self.connection_pool, file_pool,
+                                                                    self.torrent_limiter(info_hash, 'download'))
+            if download_ok:
+                self.set_announce_left(info_hash, 0)
+        finally:
+            self.release_file_pool(info_hash)
+            if info_hash not in self.uploading_managers:
+                self.stop_announcing(info_hash)
+        self.connection_pool.close_all(info_hash)  # Đóng các kết nối trong pool không được dùng tới
+        if download_ok:
+            self.announce(info_hash, self.download_port, event='completed', left=0)
             logging.info(f"Download completed. Files saved to {file_path}")
             print(f"Download completed. Files saved to {file_path}")
         else:
@@ -1,25 +1,95 @@
 import os
+import bisect
 import hashlib
+from metainfo.file_pool import FilePool
 
 class FileManager:
-    def __init__(self, file_path, piece_length):
+    def __init__(self, file_path, piece_length, files=None, file_pool=None):
+        """
+        :param file_path: Đường dẫn tệp (single-file) hoặc thư mục gốc khi có `files`.
+        :param piece_length: Kích thước chuẩn của một mảnh.
+        :param files: Danh sách file của torrent multi-file (mỗi phần tử có 'path' và 'length').
+        :param file_pool: FilePool dùng chung cho torrent (ví dụ với seeder); mặc định tạo pool riêng.
+        """
         self.file_path = file_path
         self.piece_length = piece_length
+        self.file_pool = file_pool if file_pool is not None else FilePool()
+        if files is None:
+            # Single-file: một tệp, không giới hạn độ dài
+            self.file_paths = [file_path]
+            self.file_lengths = [None]
+        else:
+            self.file_paths = [
+                os.path.join(file_path, *[part.decode('utf-8') if isinstance(part, bytes) else part for part in file_info['path']])
+                for file_info in files
+            ]
+            self.file_lengths = [file_info['length'] for file_info in files]
+        # Offset bắt đầu của từng file trong luồng dữ liệu liên tục của torrent
+        self.file_starts = []
+        offset = 0
+        for length in self.file_lengths:
+            self.file_starts.append(offset)
+            offset += length or 0
+        self.total_length = offset if files is not None else None
+
+    def segments(self, piece_index, begin, length):
+        """Trả về danh sách (file_idx, file_offset, segment_length) của một đoạn trong mảnh."""
+        start = piece_index * self.piece_length + begin
+        if self.total_length is None:
+            return [(0, start, length)]
+        end = min(start + length, self.total_length)
+        file_idx = bisect.bisect_right(self.file_starts, start) - 1
+        result = []
+        while start < end and file_idx < len(self.file_paths):
+            file_end = self.file_starts[file_idx] + self.file_lengths[file_idx]
+            segment_length = min(end, file_end) - start
+            if segment_length > 0:
+                result.append((file_idx, start - self.file_starts[file_idx], segment_length))
+                start += segment_length
+            file_idx += 1
+        return result
+
+    def piece_size(self, piece_index):
+        """Độ dài thật của mảnh (mảnh cuối có thể ngắn hơn)."""
+        if self.total_length is None:
+            return self.piece_length
+        return max(0, min(self.piece_length, self.total_length - piece_index * self.piece_length))
+
+    def write_block(self, piece_index, begin, data):
+        """Ghi một đoạn dữ liệu của mảnh vào đúng vị trí trong (các) tệp."""
+        data = memoryview(data)
+        data_offset = 0
+        for file_idx, file_offset, segment_length in self.segments(piece_index, begin, len(data)):
+            self.file_pool.pwrite(self.file_paths[file_idx], data[data_offset:data_offset + segment_length], file_offset)
+            data_offset += segment_length
+        return data_offset
+
+    def read_block(self, piece_index, begin, length):
+        """Đọc một đoạn dữ liệu của mảnh từ (các) tệp."""
+        segments = self.segments(piece_index, begin, length)
+        if len(segments) == 1:
+            file_idx, file_offset, segment_length = segments[0]
+            return self.file_pool.pread(self.file_paths[file_idx], segment_length, file_offset)
+        data = bytearray()
+        for file_idx, file_offset, segment_length in segments:
+            data.extend(self.file_pool.pread(self.file_paths[file_idx], segment_length, file_offset))
+        return bytes(data)
 
     def write_piece(self, piece_index, data):
         """Ghi mảnh tệp vào đúng vị trí trong tệp chính."""
-        with open(self.file_path, 'r+b') as f:
-            f.seek(piece_index * self.piece_length)
-            f.write(data)
+        return self.write_block(piece_index, 0, data)
 
     def read_piece(self, piece_index):
         """Đọc mảnh tệp từ tệp chính để chia sẻ với peer khác."""
-        with open(self.file_path, 'rb') as f:
-            f.seek(piece_index * self.piece_length)
-            return f.read(self.piece_length)
+        return self.read_block(piece_index, 0, self.piece_size(piece_index))
 
     def verify_piece(self, piece_index, expected_hash):
-        """Kiểm tra tính toàn vẹn của mảnh tệp thông qua SHA-1 hash."""
-        piece_data = self.read_piece(piece_index)
+        """Kiểm tra tính toàn vẹn của mảnh tệp thông qua SHA-1 hash (bytes hoặc chuỗi hex)."""
+        try:
+            piece_data = self.read_piece(piece_index)
+        except OSError:
+            return False
+        if isinstance(expected_hash, (bytes, bytearray)):
+            return hashlib.sha1(piece_data).digest() == expected_hash
         piece_hash = hashlib.sha1(piece_data).hexdigest()
-        return piece_hash == expected_hash
\ No newline at end of file
+        return piece_hash == expected_hash
@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+MAX_OPEN_FILES = 64  # Số file descriptor tối đa giữ mở cho mỗi torrent
+
+# Windows không có os.pread/os.pwrite: dùng lseek + read/write dưới một khoá chung
+_seek_lock = threading.Lock()
+
+
+def _pread(fd, length, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+
+
+def _pwrite(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+
+class _Entry:
+    def __init__(self, fd):
+        self.fd = fd
+        self.users = 0  # Số luồng đang dùng fd, chỉ đóng khi về 0
+        self.retired = False  # Đã bị bỏ khỏi pool, đóng khi luồng cuối trả lại
+
+
+class FilePool:
+    """
+    Giữ các file của một torrent mở sẵn giữa các lần đọc/ghi, đóng file ít dùng nhất khi
+    vượt quá `max_open`. Đọc/ghi dùng os.pread/os.pwrite theo vị trí tuyệt đối nên nhiều
+    luồng (ghi của downloader, đọc của seeder) dùng chung một fd mà không cần seek hay khoá.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_FILES):
+        self.max_open = max_open
+        self.entries = OrderedDict()  # (path, writable) -> _Entry, dùng gần nhất ở cuối
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.evictions = 0
+
+    def _acquire(self, path, writable):
+        key = (path, writable)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                fd = os.open(path, (os.O_RDWR if writable else os.O_RDONLY) | getattr(os, 'O_BINARY', 0))
+                entry = _Entry(fd)
+                self.entries[key] = entry
+                self.opened += 1
+            else:
+                self.entries.move_to_end(key)
+            entry.users += 1
+            self._evict()
+            return entry
+
+    def _release(self, entry):
+        with self.lock:
+            entry.users -= 1
+            if entry.users == 0:
+                if entry.retired:
+                    os.close(entry.fd)
+                elif len(self.entries) > self.max_open:
+                    self._evict()
+
+    def _evict(self):
+        # Đóng các fd cũ nhất không có luồng nào đang dùng; fd đang dùng được giữ lại
+        for key in list(self.entries):
+            if len(self.entries) <= self.max_open:
+                break
+            if self.entries[key].users == 0:
+                os.close(self.entries.pop(key).fd)
+                self.evictions += 1
+
+    @contextmanager
+    def open(self, path, writable=False):
+        """Mượn fd của `path` (mở nếu chưa có) trong khối with; fd không bị đóng khi đang mượn."""
+        entry = self._acquire(path, writable)
+        try:
+            yield entry.fd
+        finally:
+            self._release(entry)
+
+    def pread(self, path, length, offset):
+        """Đọc tối đa `length` byte tại `offset`; trả về ít hơn nếu gặp cuối file."""
+        with self.open(path) as fd:
+            data = _pread(fd, length, offset)
+            if len(data) == length or not data:
+                return data
+            chunks = [data]
+            read = len(data)
+            while read < length:
+                chunk = _pread(fd, length - read, offset + read)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                read += len(chunk)
+            return b''.join(chunks)
+
+    def pwrite(self, path, data, offset):
+        """Ghi toàn bộ `data` tại `offset`."""
+        data = memoryview(data)
+        with self.open(path, writable=True) as fd:
+            written = 0
+            while written < len(data):
+                written += _pwrite(fd, data[written:], offset + written)
+            return written
+
+    def close_all(self):
+        """Đóng mọi fd không dùng; fd đang dùng sẽ được đóng khi luồng cuối trả lại."""
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+            for entry in entries:
+                if entry.users == 0:
+                    os.close(entry.fd)
+                else:
+                    entry.retired = True
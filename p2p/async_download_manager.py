@@ -0,0 +1,223 @@
+import asyncio
+import struct
+import logging
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.async_peer_communication import AsyncCommunicator
+from p2p.download_manager import DownloadingManager, MAX_PEER_FAILURES, READ_TIMEOUT
+from p2p.message import Message, MessageID
+from p2p.request_pipeline import RequestPipeline
+
+# Constants
+MAX_PEER_CONNECTIONS = 1000  # Số kết nối peer tối đa mở đồng thời trên một event loop
+
+
+class AsyncDownloadingManager(DownloadingManager):
+    """
+    Engine tải dùng asyncio: một event loop, mỗi peer là một coroutine thay vì một thread.
+    Giữ nguyên hợp đồng `start_download(...)` và các bước kiểm tra/ghép file của DownloadingManager.
+    """
+
+    def __init__(self, max_connections=MAX_PEER_CONNECTIONS):
+        super().__init__()
+        self.max_connections = max_connections
+        self.piece_available = None
+        self.done = None
+
+    def run_workers(self, peers, piece_writer, info_hash, peer_id, total_pieces):
+        """Chạy tất cả coroutine peer trên một event loop cho đến khi xong."""
+        asyncio.run(self._run_peers(peers, piece_writer, info_hash, peer_id, total_pieces))
+
+    async def _run_peers(self, peers, piece_writer, info_hash, peer_id, total_pieces):
+        self.piece_available = asyncio.Condition()
+        self.done = asyncio.Event()
+        if self.piece_picker.is_finished():
+            self.done.set()
+        slots = asyncio.Semaphore(self.max_connections)
+        await asyncio.gather(*(self.peer_worker(peer, slots, piece_writer, info_hash, peer_id, total_pieces) for peer in peers))
+
+    async def peer_worker(self, peer, slots, piece_writer, info_hash, peer_id, total_pieces):
+        """Coroutine tải các mảnh từ một peer."""
+        async with slots:
+            client = AsyncCommunicator(peer, peer_id, info_hash)
+            pooled = self.connection_pool.take(peer, info_hash) if self.connection_pool else None
+            try:
+                if pooled is not None and not pooled.reader.buffered():
+                    # Kết nối đã handshake từ bước lấy metadata
+                    await client.adopt(pooled.conn)
+                    client.reqq = pooled.reqq
+                    logging.info(f"Reusing pooled connection to peer {peer}")
+                else:
+                    if pooled is not None:
+                        pooled.close_connection()
+                    await client.connect()
+                    await client.send_handshake(bittorrent_extension=True)
+                    await asyncio.wait_for(client.recv_handshake(), timeout=READ_TIMEOUT)
+                    await asyncio.wait_for(client.negotiate_extended(), timeout=READ_TIMEOUT)
+                await client.send_bitfield()
+                if not await client.recv_bitfield():
+                    raise ValueError(f"No bitfield from peer {peer}")
+                await client.send_interested()
+            except (asyncio.TimeoutError, OSError, ValueError) as e:
+                logging.error(f"Could not start download from peer {peer}: {e}")
+                await client.close_connection()
+                return
+
+            self.peer_clients.append(client)
+            self.piece_picker.add_peer(client.bitfield)
+            logging.info(f"Starting download from peer {peer}")
+
+            # Các mảnh đang tải từ peer này; request được gửi liên tục qua ranh giới giữa các mảnh
+            active = {}
+            pipeline = RequestPipeline(client.reqq)
+            verifying = []  # Task kiểm tra và ghi các mảnh đã nhận đủ từ peer này
+            failures = 0
+            try:
+                while failures < MAX_PEER_FAILURES and not self.done.is_set():
+                    failures = self.check_verified(verifying, failures)
+                    # Cancel ở mỗi vòng, không chỉ khi peer này gửi Piece, để peer chậm cũng nhận được
+                    await self.cancel_received_async(client, pipeline, active)
+                    if not client.choked and not await self.request_blocks(client, pipeline, active):
+                        break  # Peer này không còn mảnh nào để tải
+
+                    try:
+                        message = await client.read(timeout=READ_TIMEOUT)
+                    except TimeoutError:
+                        if client.choked:
+                            continue  # Đang bị choke: chờ unchoke ở lượt choke sau của peer, không tính là lỗi
+                        logging.warning(f"Timeout while reading from peer {peer}, retrying...")
+                        failures += 1
+                        await self.cancel_received_async(client, pipeline, active)
+                        self.requeue_outstanding(pipeline, active)
+                        continue
+                    if message is None:
+                        continue
+
+                    if message.ID == MessageID.MsgPiece:
+                        # Ngủ khi vượt giới hạn tải; peer bị chậm lại qua cửa sổ TCP
+                        await self.download_limiter.consume_async(len(message.Payload) - 8)
+                        index, begin = struct.unpack_from('>II', message.Payload, 0)
+                        progress = active.get(index)
+                        if progress is None or not pipeline.on_block(index, begin, len(message.Payload) - 8):
+                            continue  # Block không còn được chờ (đã bị cancel)
+                        if progress.add_block(message):
+                            del active[index]
+                            await client.send_have(index)
+                            verifying.append(asyncio.create_task(self.finish_piece_async(progress, piece_writer, total_pieces)))
+                    elif message.ID == MessageID.MsgHave:
+                        have_index = Message.parse_have(message)
+                        self.piece_picker.peer_has(client.bitfield, have_index)
+                        logging.info(f"Received have for piece {have_index} from peer")
+                    elif message.ID == MessageID.MsgChoke:
+                        client.choked = True
+                        # Peer bỏ các request đang chờ khi choke; trả mảnh lại cho peer khác tải tiếp
+                        self.requeue_outstanding(pipeline, active)
+                        for progress in active.values():
+                            await self.release_piece(progress)
+                        active.clear()
+                        logging.info("Peer has choked us")
+                    elif message.ID == MessageID.MsgUnchoke:
+                        client.choked = False
+                        logging.info("Peer has unchoked us")
+            except (ConnectionError, OSError, ValueError) as e:
+                logging.error(f"Error downloading from peer {peer}: {e}")
+            finally:
+                self.requeue_outstanding(pipeline, active)
+                for progress in active.values():
+                    await self.release_piece(progress)
+                self.piece_picker.remove_peer(client.bitfield)
+                await client.close_connection()
+                if verifying:
+                    await asyncio.gather(*verifying, return_exceptions=True)
+
+    async def request_blocks(self, client, pipeline, active):
+        """Phiên bản asyncio của `request_blocks`."""
+        while pipeline.can_request():
+            block = self.next_block(pipeline, active)
+            if block is None:
+                # Chỉ chờ mảnh mới khi peer không còn mảnh nào đang tải
+                if active:
+                    progress = self.piece_picker.pick(client.bitfield, block=False, exclude=active)
+                else:
+                    progress = await self.next_piece(client)
+                if progress is None:
+                    break
+                active[progress.piece.index] = progress
+                continue
+            progress, begin, length = block
+            await client.send_request(progress.piece.index, begin, length)
+            pipeline.on_request(progress.piece.index, begin, length)
+        return bool(active)
+
+    async def next_piece(self, client):
+        """Lấy một mảnh mà peer có; trả về None khi không còn mảnh nào peer này có thể tải."""
+        async with self.piece_available:
+            while not self.done.is_set():
+                progress = self.piece_picker.pick(client.bitfield, block=False)
+                if progress is not None:
+                    return progress
+                if not self.piece_picker.in_flight:
+                    # Không có mảnh nào đang tải có thể quay lại hàng đợi
+                    return None
+                await self.piece_available.wait()
+            return None
+
+    async def cancel_received_async(self, client, pipeline, active):
+        """Phiên bản asyncio của `cancel_received`."""
+        holding = len(active)
+        for cancel in self.collect_cancels(pipeline, active):
+            await client.send_cancel(*cancel)
+        if len(active) < holding:
+            # Có mảnh được trả lại bộ chọn, đánh thức các peer đang chờ
+            async with self.piece_available:
+                self.piece_available.notify_all()
+
+    async def release_piece(self, progress):
+        """Thôi tải mảnh và báo cho các peer đang chờ mảnh mới."""
+        self.piece_picker.release(progress)
+        async with self.piece_available:
+            self.piece_available.notify_all()
+
+    async def finish_piece_async(self, progress, piece_writer, total_pieces):
+        """Phiên bản asyncio của `finish_piece`: băm trên pool kiểm tra, không chặn event loop."""
+        piece = progress.piece
+        if not await asyncio.wrap_future(self.verifier.submit(progress)):
+            logging.warning(f"Piece {piece.index} failed integrity check, retrying...")
+            progress.reset()
+            await self.release_piece(progress)
+            return False
+
+        # Ghi đĩa trong thread riêng để không chặn event loop
+        try:
+            await asyncio.to_thread(piece_writer.write_piece, piece.index, progress.buffer)
+        except OSError as e:
+            logging.error(f"Could not write piece {piece.index}: {e}")
+            progress.reset()
+            await self.release_piece(progress)
+            return False
+        self.piece_picker.complete(progress)
+        if self.fast_resume is not None:
+            await asyncio.to_thread(self.fast_resume.maybe_save, piece_writer, self.piece_picker)
+        async with self.piece_available:
+            self.downloaded_pieces += 1
+            self.progress_bar.update(1)
+            self.progress_bar.set_postfix(verify_queue=self.verifier.queue_depth, refresh=False)
+            logging.info(f"DOWLOADED_PIECES: {self.downloaded_pieces} - TOTAL_PIECES: {total_pieces}")
+            if self.downloaded_pieces >= total_pieces:
+                self.done.set()
+            self.piece_available.notify_all()
+        if self.done.is_set():
+            await self.notify_all_peers_not_interested_async()
+            logging.info("All pieces downloaded; notifying peers.")
+        return True
+
+    async def notify_all_peers_not_interested_async(self):
+        for client in self.peer_clients:
+            try:
+                await client.send_not_interested()
+                logging.info(f"Sent NotInterested to peer {client.peer}")
+            except (ConnectionError, OSError) as e:
+                logging.debug(f"Could not send NotInterested to {client.peer}: {e}")
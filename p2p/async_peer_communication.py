@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import sys
+import bencodepy
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.bitfield import Bitfield
+from p2p.peer import Peer
+from p2p.message import Message, MessageID
+from p2p.handshake import Handshake
+
+CONNECT_TIMEOUT = 1.5  # Giống timeout của Communicator.connect
+
+
+class AsyncCommunicator:
+    """Phiên bản asyncio của Communicator, dùng StreamReader/StreamWriter thay cho socket."""
+
+    def __init__(self, peer: Peer, peer_id: bytes, info_hash: bytes, reader=None, writer=None):
+        self.peer = peer
+        self.peer_id = peer_id
+        self.info_hash = info_hash
+        self.reader = reader
+        self.writer = writer
+        self.bitfield = None
+        self.choked = True
+        self.reqq = None
+        # Lần đọc chưa xong khi hết timeout; được chờ tiếp ở lần đọc sau thay vì bị huỷ giữa một
+        # thông điệp (tiền tố độ dài đã bị đọc), để luồng byte không bị lệch khung
+        self.pending_read = None
+
+    async def connect(self):
+        """Kết nối đến peer."""
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.peer.ip, self.peer.port), timeout=CONNECT_TIMEOUT)
+            logging.debug(f"Connected to peer {self.peer}")
+        except (asyncio.TimeoutError, OSError) as e:
+            logging.error(f"Error connecting to peer {self.peer}: {e}")
+            raise
+
+    async def adopt(self, sock):
+        """Dùng một socket đã kết nối và handshake sẵn (từ ConnectionPool)."""
+        self.reader, self.writer = await asyncio.open_connection(sock=sock)
+        logging.debug(f"Adopted connection to peer {self.peer}")
+
+    async def send(self, msg):
+        """Gửi một Message và chờ buffer ghi được giải phóng."""
+        self.writer.write(msg.serialize())
+        await self.writer.drain()
+
+    async def send_handshake(self, bittorrent_extension=False):
+        """Gửi handshake tới peer."""
+        handshake = Handshake(self.info_hash, self.peer_id, bittorrent_extension)
+        self.writer.write(handshake.serialize())
+        await self.writer.drain()
+        logging.debug("Sent handshake")
+
+    async def recv_handshake(self):
+        """Nhận và kiểm tra handshake từ peer."""
+        msg = await Handshake.read_async(self.reader)
+        if msg.info_hash != self.info_hash:
+            raise ValueError(f"Expected infohash {self.info_hash.hex()} but got {msg.info_hash.hex()}")
+        logging.debug("Received valid handshake response")
+        return msg
+
+    async def negotiate_extended(self):
+        """Phiên bản asyncio của Communicator.negotiate_extended."""
+        await self.send(Message.format_extended_handshake(0))
+        msg = await self.read()
+        if msg is None or msg.ID != MessageID.MsgExtended:
+            raise ValueError(f"Expected extended handshake from {self.peer} but got {msg}")
+        try:
+            handshake = bencodepy.decode(bytes(msg.Payload[1:]))
+            pieces_number = handshake.get(b'pieces_number', 0)
+        except Exception as e:
+            raise ValueError(f"Invalid extended handshake from {self.peer}: {e}")
+        self.reqq = handshake.get(b'reqq')
+        await self.send(Message.format_have_metadata(pieces_number))
+        logging.debug(f"Peer {self.peer} accepts {self.reqq} outstanding requests")
+
+    async def send_bitfield(self, bitfield=None):
+        """Gửi bitfield tới peer."""
+        await self.send(Message(message_id=MessageID.MsgBitfield, payload=bitfield))
+        logging.debug("Sent bitfield")
+
+    async def recv_bitfield(self, timeout=10):
+        """Nhận bitfield từ peer, trả về False nếu lỗi hoặc timeout."""
+        try:
+            msg, err = await self.read_message(timeout)
+        except asyncio.TimeoutError:
+            logging.error("Timeout while waiting for bitfield")
+            return False
+        if err:
+            logging.error(f"Error reading message: {err}")
+            return False
+        if msg is None or msg.ID != MessageID.MsgBitfield:
+            logging.error(f"Expected bitfield message but got {msg}")
+            return False
+        self.bitfield = Bitfield(msg.Payload)
+        logging.debug("Received bitfield")
+        return True
+
+    async def read_message(self, timeout=None):
+        """Message.read_async không bị huỷ giữa chừng; ném asyncio.TimeoutError khi hết thời gian."""
+        if self.pending_read is None:
+            self.pending_read = asyncio.ensure_future(Message.read_async(self.reader))
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.pending_read), timeout=timeout)
+        finally:
+            if self.pending_read is not None and self.pending_read.done():
+                self.pending_read = None
+
+    async def send_interested(self):
+        await self.send(Message(message_id=MessageID.MsgInterested))
+
+    async def send_not_interested(self):
+        await self.send(Message(message_id=MessageID.MsgNotInterested))
+
+    async def send_request(self, index, begin, length):
+        await self.send(Message.format_request(index, begin, length))
+
+    async def send_cancel(self, index, begin, length):
+        await self.send(Message.format_cancel(index, begin, length))
+
+    async def send_have(self, piece_index):
+        await self.send(Message.format_have(piece_index))
+
+    async def read(self, timeout=None):
+        """Đọc một thông điệp; trả về None cho KeepAlive, ném TimeoutError khi hết thời gian."""
+        try:
+            msg, err = await self.read_message(timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out reading from {self.peer}")
+        if err:
+            raise ConnectionError(f"Error reading message from {self.peer}: {err}")
+        return msg
+
+    async def close_connection(self):
+        """Đóng kết nối."""
+        if self.pending_read is not None:
+            self.pending_read.cancel()
+            self.pending_read = None
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        logging.debug(f"Closed connection to {self.peer}")
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+UPLOAD_SLOTS = 4  # Số peer được unchoke cùng lúc, kể cả slot optimistic
+CHOKE_INTERVAL = 10  # Chu kỳ tính lại danh sách unchoke (giây)
+OPTIMISTIC_INTERVAL = 30  # Chu kỳ đổi peer optimistic unchoke (giây)
+
+
+class PeerRate:
+    """Trạng thái và tốc độ đo được của một peer trong choker."""
+
+    def __init__(self):
+        self.interested = False
+        self.unchoked = False
+        self.uploaded = 0  # Byte đã gửi cho peer trong vòng hiện tại
+        self.upload_rate = 0.0  # byte/s của vòng trước
+
+
+class Choker:
+    """
+    Chọn các peer được unchoke theo thuật toán choking của BitTorrent.
+
+    Choker chỉ chạy ở phía seed (engine tải không phục vụ request trên kết nối tải, nên không có
+    gì để tit-for-tat): mỗi `interval` giây, các peer interested được xếp theo tốc độ gửi cho peer
+    trong vòng vừa qua, để peer tải nhanh nhất xong sớm. `upload_slots - 1` peer đầu được unchoke,
+    slot còn lại là optimistic unchoke, đổi sang một peer bị choke ngẫu nhiên mỗi
+    `optimistic_interval` giây để thử peer mới. Slot trống được cấp ngay khi peer báo interested.
+
+    Choker chỉ quyết định trạng thái; luồng của từng peer đọc `is_unchoked` và tự gửi
+    Choke/Unchoke, nên mọi thông điệp trên một kết nối vẫn do một luồng gửi. Các vòng choke
+    được một ChokeTimer gọi.
+    """
+
+    def __init__(self, upload_slots=UPLOAD_SLOTS, interval=CHOKE_INTERVAL, optimistic_interval=OPTIMISTIC_INTERVAL):
+        self.upload_slots = max(1, upload_slots)
+        self.interval = interval
+        self.optimistic_interval = optimistic_interval
+        self.peers = {}  # peer -> PeerRate
+        self.optimistic = None
+        self.rounds = 0
+        self.last_round = time.monotonic()
+        self.last_optimistic = 0.0
+        self.lock = threading.Lock()
+
+    def add_peer(self, peer):
+        with self.lock:
+            self.peers.setdefault(peer, PeerRate())
+
+    def remove_peer(self, peer):
+        with self.lock:
+            self.peers.pop(peer, None)
+            if self.optimistic == peer:
+                self.optimistic = None
+
+    def set_interested(self, peer, interested):
+        """Cập nhật trạng thái interested; peer mới interested được unchoke ngay nếu còn slot."""
+        with self.lock:
+            state = self.peers.setdefault(peer, PeerRate())
+            state.interested = interested
+            if not interested:
+                state.unchoked = False
+            elif not state.unchoked and sum(s.unchoked for s in self.peers.values()) < self.upload_slots:
+                state.unchoked = True
+
+    def record_upload(self, peer, length):
+        with self.lock:
+            state = self.peers.get(peer)
+            if state is not None:
+                state.uploaded += length
+
+    def is_unchoked(self, peer):
+        with self.lock:
+            state = self.peers.get(peer)
+            return state is not None and state.unchoked
+
+    def rechoke(self):
+        """Tính lại danh sách unchoke từ tốc độ của vòng vừa qua."""
+        now = time.monotonic()
+        with self.lock:
+            elapsed = max(now - self.last_round, 1e-6)
+            self.last_round = now
+            self.rounds += 1
+            for state in self.peers.values():
+                state.upload_rate = state.uploaded / elapsed
+                state.uploaded = 0
+
+            interested = [peer for peer, state in self.peers.items() if state.interested]
+            interested.sort(key=lambda peer: self.peers[peer].upload_rate, reverse=True)
+            regular = set(interested[:self.upload_slots - 1]) if self.upload_slots > 1 else set()
+
+            # Đổi peer optimistic theo chu kỳ, hoặc khi peer cũ đã rời đi/không còn interested
+            candidates = [peer for peer in interested if peer not in regular]
+            if (self.optimistic not in candidates or now - self.last_optimistic >= self.optimistic_interval) and candidates:
+                self.optimistic = random.choice(candidates)
+                self.last_optimistic = now
+            elif not candidates:
+                self.optimistic = None
+
+            for peer, state in self.peers.items():
+                state.unchoked = peer in regular or peer == self.optimistic
+            unchoked = len(regular) + (self.optimistic is not None)
+        logging.debug(f"Choker round {self.rounds}: {unchoked} unchoked of {len(interested)} interested peers")
+
+    def stats(self):
+        with self.lock:
+            return {
+                'upload_slots': self.upload_slots,
+                'rounds': self.rounds,
+                'interested': sum(state.interested for state in self.peers.values()),
+                'unchoked': [str(peer) for peer, state in self.peers.items() if state.unchoked],
+                'optimistic': str(self.optimistic) if self.optimistic is not None else None,
+                'upload_rates': {str(peer): state.upload_rate for peer, state in self.peers.items()},
+            }
+
+
+class ChokeTimer:
+    """
+    Một luồng gọi rechoke cho mọi Choker đã đăng ký (mọi torrent đang seed của client), thay cho
+    một luồng cho mỗi torrent; mỗi choker vẫn giữ chu kỳ `interval` của riêng nó.
+    """
+
+    def __init__(self):
+        self.chokers = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None  # Chỉ được tạo khi có choker đầu tiên
+
+    def add(self, choker):
+        with self.lock:
+            self.chokers.add(choker)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='choker', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def remove(self, choker):
+        with self.lock:
+            self.chokers.discard(choker)
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.clear()
+            with self.lock:
+                chokers = list(self.chokers)
+            timeout = None  # Không có choker nào: chờ đến khi add() đánh thức
+            for choker in chokers:
+                if time.monotonic() - choker.last_round >= choker.interval:
+                    choker.rechoke()
+                due = choker.last_round + choker.interval - time.monotonic()
+                timeout = due if timeout is None else min(timeout, due)
+            self.wakeup.wait(None if timeout is None else max(timeout, 0))
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
@@ -0,0 +1,48 @@
+import os
+import sys
+import logging
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+
+class ConnectionPool:
+    """
+    Giữ các kết nối đã handshake xong, theo khoá (ip, port, info_hash), để engine tải
+    dùng lại thay vì kết nối và handshake lại (ví dụ kết nối vừa lấy metadata từ magnet).
+    """
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(peer, info_hash):
+        return peer.ip, peer.port, info_hash
+
+    def put(self, communicator):
+        """Đưa một Communicator đã handshake vào pool; kết nối cũ cùng khoá bị đóng."""
+        with self.lock:
+            old = self.connections.get(self.key(communicator.peer, communicator.info_hash))
+            self.connections[self.key(communicator.peer, communicator.info_hash)] = communicator
+        if old is not None and old is not communicator:
+            old.close_connection()
+        logging.debug(f"Pooled connection to {communicator.peer}")
+
+    def take(self, peer, info_hash):
+        """Lấy (và bỏ khỏi pool) kết nối tới `peer` cho torrent `info_hash`, hoặc None."""
+        with self.lock:
+            return self.connections.pop(self.key(peer, info_hash), None)
+
+    def peers(self, info_hash):
+        """Các peer đang có kết nối trong pool cho torrent `info_hash`."""
+        with self.lock:
+            return [communicator.peer for (_, _, key_hash), communicator in self.connections.items() if key_hash == info_hash]
+
+    def close_all(self, info_hash=None):
+        """Đóng các kết nối chưa được dùng (của một torrent, hoặc tất cả)."""
+        with self.lock:
+            keys = [key for key in self.connections if info_hash is None or key[2] == info_hash]
+            communicators = [self.connections.pop(key) for key in keys]
+        for communicator in communicators:
+            communicator.close_connection()
@@ -1,23 +1,27 @@
 import os
 import sys
 import time
+import struct
 import logging
-import queue
 import threading
-import hashlib
 import time
 from tqdm import tqdm
 from p2p.peer_communication import Communicator
 from p2p.peer import Peer
 from p2p.message import Message, MessageID
 from p2p.piece import Piece
+from p2p.piece_writer import PieceWriter
+from p2p.piece_picker import PiecePicker
+from p2p.request_pipeline import RequestPipeline
+from p2p.piece_verifier import PieceVerifier
+from p2p.rate_limiter import TokenBucket
 
 # Configure logging to write to a file
 import logging_config
 
 # Constants
-MAX_BLOCK_SIZE = 16384  # 16 KB
-MAX_BACKLOG = 5  # Number of unfulfilled requests
+MAX_PEER_FAILURES = 3  # Số lần lỗi liên tiếp trước khi bỏ peer
+READ_TIMEOUT = 5  # Timeout đọc từ peer (giây)
 
 class DownloadingManager:
     def __init__(self):
@@ -25,159 +29,222 @@ class DownloadingManager:
         self.peer_clients = []
         self.downloaded_pieces_lock = threading.Lock()
         self.progress_bar = None
+        self.piece_picker = None
+        self.fast_resume = None
+        self.verifier = None
+        self.connection_pool = None
         # Thông báo `NotInterested` cho tất cả các peer
     def notify_all_peers_not_interested(self):
-        for client in self.peer_clients:
-            client.send_not_interested()
-            logging.info(f"Sent NotInterested to peer {client.peer}")
+        for client in list(self.peer_clients):  # Worker có thể bỏ peer khỏi danh sách cùng lúc
+            try:
+                client.send_not_interested()
+                logging.info(f"Sent NotInterested to peer {client.peer}")
+            except OSError as e:
+                logging.warning(f"Could not send NotInterested to peer {client.peer}: {e}")
 
     # Worker to download pieces from peers
-    def download_worker(self, peer, work_queue, results_queue, info_hash, peer_id, total_pieces):
-        client = Communicator(peer, peer_id, info_hash)
-        client.send_handshake()
-        client.recv_handshake()
-        self.peer_clients.append(client)
-        logging.info(f"Starting download from peer {peer}")
-        client.send_bitfield()
-        client.recv_bitfield()
-        # gửi ngay sau khi kết nối
-        client.send_interested()
-        # client.send_unchoke()
-
-        while not work_queue.empty():
-            piece = work_queue.get()
-            logging.debug(f"Downloading piece {piece.index} from peer {peer}")
-            logging.debug(f"Client bitfield: {client.bitfield}")
-            if client.bitfield.has_piece(piece.index):
-                logging.debug(f"Peer {peer} has piece {piece.index}")
-                try:
-                    data = self.download_piece(client, piece)
-                    if data:
-                        logging.debug(f"HAS DATA")
-                    else:
-                        logging.debug(f"NO DATA")
-                    if self.check_piece_integrity(piece, data):
-                        results_queue.put((piece.index, data))
-                        with self.downloaded_pieces_lock:
-                            self.downloaded_pieces += 1
-                            logging.info(f"DOWLOADED_PIECES: {self.downloaded_pieces} - TOTAL_PIECES: {total_pieces}")  
-                            if self.downloaded_pieces >= total_pieces:
-                                self.notify_all_peers_not_interested()
-                                logging.info("All pieces downloaded; notifying peers.")
-                    else:
-                        logging.info(f"Piece {piece.index} failed integrity check")
-                        # Log the pieces that have been successfully downloaded and passed integrity check
-                        with self.downloaded_pieces_lock:
-                            logging.info(f"Downloaded pieces so far: {self.downloaded_pieces}")
-                        logging.warning(f"Piece {piece.index} failed integrity check, retrying...")
-                        work_queue.put(piece)
-                except TimeoutError:
-                    logging.warning("Timeout while downloading piece, retrying...")
-                    work_queue.put(piece)
-                    time.sleep(1)
-                except ValueError as e:
-                    logging.error(f"Error: {e}")
-                    work_queue.put(piece)
-                    time.sleep(1)
+    def download_worker(self, peer, piece_writer, info_hash, peer_id, total_pieces):
+        client = None
+        registered = False  # Peer đã được đưa vào bộ chọn mảnh và peer_clients chưa
+        # Các mảnh đang tải từ peer này; request được gửi liên tục qua ranh giới giữa các mảnh
+        active = {}
+        pipeline = None
+        try:
+            # Dùng lại kết nối đã handshake (ví dụ từ bước lấy metadata) nếu có
+            client = self.connection_pool.take(peer, info_hash) if self.connection_pool else None
+            if client is None:
+                client = Communicator(peer, peer_id, info_hash)
+                client.send_handshake(bittorrent_extension=True)
+                client.recv_handshake()
+                client.negotiate_extended()
             else:
-                work_queue.put(piece)
-
-    # Function to download a specific piece from a peer
-    def download_piece(self, client, piece):
-        downloaded = 0
-        requested = 0
-        backlog = 0
-        buffer = bytearray(piece.length)
-
-        while downloaded < piece.length:
-            logging.debug(f"Downloaded {downloaded} bytes out of {piece.length} bytes")
-            logging.debug(f"client.choked: {client.choked}, backlog: {backlog}, requested: {requested}")
-            if not client.choked and backlog < MAX_BACKLOG:
-                block_size = min(piece.length - requested, MAX_BLOCK_SIZE)
-                logging.debug(f"Before request")
-                client.send_request(piece.index, requested, block_size)
-                logging.debug(f"Requested block {requested} - {requested + block_size} from peer {client.peer}")
-                backlog += 1
-                requested += block_size
-
-            client.conn.settimeout(5)  # Set a timeout for reads
+                logging.info(f"Reusing pooled connection to peer {peer}")
+            client.send_bitfield()
+            if not client.recv_bitfield():
+                logging.error(f"No bitfield from peer {peer}, skipping")
+                return
+            self.peer_clients.append(client)
+            self.piece_picker.add_peer(client.bitfield)
+            registered = True
+            logging.info(f"Starting download from peer {peer}")
+            # gửi ngay sau khi kết nối
+            client.send_interested()
+            # client.send_unchoke()
 
-            try:
-                message = client.read()
+            pipeline = RequestPipeline(client.reqq)
+            verifying = []  # Future kiểm tra SHA-1 của các mảnh đã nhận đủ từ peer này
+            failures = 0
+            client.conn.settimeout(READ_TIMEOUT)  # Set a timeout for reads
+            while failures < MAX_PEER_FAILURES and not self.piece_picker.is_finished():
+                failures = self.check_verified(verifying, failures)
+                # Cancel ở mỗi vòng, không chỉ khi peer này gửi Piece, để peer chậm cũng nhận được
+                self.cancel_received(client, pipeline, active)
+                if not client.choked and not self.request_blocks(client, pipeline, active):
+                    break  # Peer này không còn mảnh nào để tải
+
+                message, err = client.reader.read()
+                if isinstance(err, TimeoutError):
+                    if client.choked:
+                        continue  # Đang bị choke: chờ unchoke ở lượt choke sau của peer, không tính là lỗi
+                    logging.warning(f"Timeout while reading from peer {peer}, retrying...")
+                    failures += 1
+                    self.cancel_received(client, pipeline, active)
+                    self.requeue_outstanding(pipeline, active)
+                    continue
+                if err:
+                    raise ConnectionError(f"Error reading from peer {peer}: {err}")
                 if message is None:
-                    logging.warning("Received None message, retrying...")
                     continue
 
                 if message.ID == MessageID.MsgPiece:
-                    block_length = Message.parse_piece(piece.index, buffer, message)
-                    downloaded += block_length
-                    backlog -= 1
+                    # Ngủ khi vượt giới hạn tải; peer bị chậm lại qua cửa sổ TCP
+                    self.download_limiter.consume(len(message.Payload) - 8)
+                    index, begin = struct.unpack_from('>II', message.Payload, 0)
+                    progress = active.get(index)
+                    if progress is None or not pipeline.on_block(index, begin, len(message.Payload) - 8):
+                        continue  # Block không còn được chờ (đã bị cancel)
+                    if progress.add_block(message):
+                        del active[index]
+                        client.send_have(index)
+                        verifying.append(self.finish_piece(progress, piece_writer, total_pieces))
                 elif message.ID == MessageID.MsgHave:
-                    logging.info(f"Received have for piece {message.index} from peer")
+                    have_index = Message.parse_have(message)
+                    self.piece_picker.peer_has(client.bitfield, have_index)
+                    logging.info(f"Received have for piece {have_index} from peer")
                 elif message.ID == MessageID.MsgChoke:
                     client.choked = True
+                    # Peer bỏ các request đang chờ khi choke; trả mảnh lại cho peer khác tải tiếp
+                    self.requeue_outstanding(pipeline, active)
+                    for progress in active.values():
+                        self.piece_picker.release(progress)
+                    active.clear()
                     logging.info("Peer has choked us")
                 elif message.ID == MessageID.MsgUnchoke:
                     client.choked = False
                     logging.info("Peer has unchoked us")
-            except TimeoutError:
-                logging.warning("Timeout while reading message, retrying...")
+        except (ConnectionError, OSError, ValueError) as e:
+            logging.error(f"Error with peer {peer}: {e}")
+        finally:
+            if pipeline is not None:
+                self.requeue_outstanding(pipeline, active)
+            for progress in active.values():
+                self.piece_picker.release(progress)
+            if registered:
+                self.piece_picker.remove_peer(client.bitfield)
+                self.peer_clients.remove(client)
+            if client is not None:
+                client.close_connection()
+
+    def request_blocks(self, client, pipeline, active):
+        """
+        Gửi request cho đến khi đầy hàng đợi của peer, lấy thêm mảnh mới khi các mảnh đang tải
+        đã được request hết. Trả về False nếu peer không còn gì để tải.
+        """
+        while pipeline.can_request():
+            block = self.next_block(pipeline, active)
+            if block is None:
+                # Chỉ chờ bộ chọn mảnh khi peer không còn mảnh nào đang tải
+                progress = self.piece_picker.pick(client.bitfield, block=not active, exclude=active)
+                if progress is None:
+                    break
+                active[progress.piece.index] = progress
                 continue
-            
-        client.send_have(piece.index)
-        return buffer
-
-    # Check the integrity of a downloaded piece
-    def check_piece_integrity(self, piece, data):
-        # Hash the data and compare with the expected hash
-        piece_hash = hashlib.sha1(data).digest()
-        expected_hash = piece.hash
-        logging.debug(f"Calculated hash: {piece_hash.hex()}, Expected hash: {expected_hash.hex()}")
-        return piece_hash == expected_hash
-
-    # Assemble all downloaded pieces into the final files
-    def assemble_file(self, results_queue, download_dir, files, piece_length):
-        if not os.path.exists(download_dir):
-            os.makedirs(download_dir)
+            progress, begin, length = block
+            client.send_request(progress.piece.index, begin, length)
+            pipeline.on_request(progress.piece.index, begin, length)
+            logging.debug(f"Requested block {begin} - {begin + length} of piece {progress.piece.index} from peer {client.peer}")
+        return bool(active)
+
+    def next_block(self, pipeline, active):
+        """
+        Chọn block kế tiếp trong các mảnh đang tải. Ở endgame, khi mọi block đã được request,
+        request lại các block đang chờ ở peer khác mà peer này chưa request.
+        """
+        for progress in active.values():
+            block = progress.next_block()
+            if block is not None:
+                return (progress,) + block
+        if self.piece_picker.in_endgame():
+            for index, progress in active.items():
+                block = progress.endgame_block(pipeline.requested_blocks(index))
+                if block is not None:
+                    return (progress,) + block
+        return None
 
-        file_data = {}
-        while not results_queue.empty():
-            index, piece_data = results_queue.get()
-            file_data[index] = piece_data
-
-        global_piece_index = 0
-        remaining_piece_data = b''  # Biến lưu trữ dữ liệu còn lại của mảnh trước
-
-        for file_info in files:
-            file_path = os.path.join(download_dir, *[part.decode('utf-8') if isinstance(part, bytes) else part for part in file_info['path']])
-            file_dir = os.path.dirname(file_path)
-
-            # Ensure the directory exists, but avoid creating a directory with the same name as the file
-            if file_dir and not os.path.exists(file_dir):
-                os.makedirs(file_dir)
-
-            total_file_length = file_info['length']
-            with open(file_path, 'wb') as f:
-                file_offset = 0
-                while file_offset < total_file_length:
-                    # Kiểm tra nếu có dữ liệu mảnh còn lại từ lần ghi trước
-                    if remaining_piece_data:
-                        piece_data = remaining_piece_data
-                        remaining_piece_data = b''
-                    elif global_piece_index in file_data:
-                        piece_data = file_data[global_piece_index]
-                        global_piece_index += 1
-                        self.progress_bar.update(1)
-                    else:
-                        break  # Không còn dữ liệu để ghi
-
-                    piece_size = min(len(piece_data), total_file_length - file_offset)
-                    f.write(piece_data[:piece_size])
-                    file_offset += piece_size
-
-                    # Lưu dữ liệu dư nếu mảnh lớn hơn phần cần ghi
-                    if piece_size < len(piece_data):
-                        remaining_piece_data = piece_data[piece_size:]
+    def cancel_received(self, client, pipeline, active):
+        """Gửi Cancel cho các request mà block đã nhận từ peer khác."""
+        for index, begin, length in self.collect_cancels(pipeline, active):
+            client.send_cancel(index, begin, length)
+            logging.debug(f"Cancelled block {begin} of piece {index} at peer {client.peer}")
+
+    def collect_cancels(self, pipeline, active):
+        """
+        Bỏ khỏi `active` các mảnh đã hoàn tất hoặc đang được kiểm tra (peer khác nhận block cuối)
+        và trả về các request cần Cancel: request của các mảnh đó, và ở endgame các block
+        đã nhận từ peer khác.
+        """
+        cancels = []
+        for index in [index for index, progress in active.items() if progress.done or self.piece_picker.has_piece(index)]:
+            self.piece_picker.release(active.pop(index))
+        if not active and not pipeline.outstanding:
+            return cancels
+        endgame = self.piece_picker.in_endgame()
+        for index, begin in list(pipeline.outstanding):
+            progress = active.get(index)
+            if progress is None or (endgame and progress.has_block(begin)):
+                cancels.append((index, begin, pipeline.cancel(index, begin)))
+        return cancels
+
+    def requeue_outstanding(self, pipeline, active):
+        """Đưa các block đã request nhưng chưa nhận về lại mảnh tương ứng."""
+        for index, begin, length in pipeline.take_outstanding():
+            if index in active:
+                active[index].requeue_block(begin, length)
+
+    def check_verified(self, verifying, failures):
+        """Lấy kết quả các mảnh đã kiểm tra xong và cập nhật số lỗi liên tiếp của peer."""
+        for future in [future for future in verifying if future.done()]:
+            verifying.remove(future)
+            failures = 0 if future.result() else failures + 1
+        return failures
+
+    def finish_piece(self, progress, piece_writer, total_pieces):
+        """
+        Đưa mảnh đã nhận đủ vào tầng kiểm tra SHA-1 để luồng peer tiếp tục đọc socket.
+        Trả về Future, cho kết quả False nếu mảnh hỏng.
+        """
+        return self.verifier.submit(progress, lambda progress, ok: self.store_piece(progress, ok, piece_writer, total_pieces))
+
+    def store_piece(self, progress, ok, piece_writer, total_pieces):
+        """Ghi mảnh đã kiểm tra và cập nhật tiến độ (chạy trên luồng kiểm tra); trả về `ok`."""
+        piece = progress.piece
+        if not ok:
+            logging.warning(f"Piece {piece.index} failed integrity check, retrying...")
+            progress.reset()
+            self.piece_picker.release(progress)
+            return False
+
+        # Ghi ngay xuống đĩa thay vì giữ trong bộ nhớ
+        try:
+            piece_writer.write_piece(piece.index, progress.buffer)
+        except OSError as e:
+            # Ví dụ đĩa đầy hoặc không có quyền ghi: trả mảnh lại bộ chọn để tải và ghi lại sau
+            logging.error(f"Could not write piece {piece.index}: {e}")
+            progress.reset()
+            self.piece_picker.release(progress)
+            return False
+        self.piece_picker.complete(progress)
+        if self.fast_resume is not None:
+            self.fast_resume.maybe_save(piece_writer, self.piece_picker)
+        with self.downloaded_pieces_lock:
+            self.downloaded_pieces += 1
+            self.progress_bar.update(1)
+            self.progress_bar.set_postfix(verify_queue=self.verifier.queue_depth, refresh=False)
+            logging.info(f"DOWLOADED_PIECES: {self.downloaded_pieces} - TOTAL_PIECES: {total_pieces}")
+            if self.downloaded_pieces >= total_pieces:
+                self.notify_all_peers_not_interested()
+                logging.info("All pieces downloaded; notifying peers.")
+        return True
 
     def prepare_download_file(self, download_dir):
         if not os.path.exists(download_dir):
@@ -193,52 +260,70 @@ class DownloadingManager:
 
     #             if threading.active_count() == 1 and self.progress_queue.empty():
     #                 break
-    def start_download(self, peers, pieces, info_hash, peer_id, download_dir, files):
-        logging.info(f"download_dir: {download_dir}")
-        if files is not None:
-            self.prepare_download_file(download_dir)
-
-        # Tạo hàng đợi công việc và hàng đợi kết quả
-        work_queue = queue.Queue()
-        results_queue = queue.Queue()
-        
-        # Thêm tất cả các mảnh vào hàng đợi công việc
-        for piece in pieces:
-            work_queue.put(piece)
-        
-    
-
+    def run_workers(self, peers, piece_writer, info_hash, peer_id, total_pieces):
+        """Chạy các worker tải cho đến khi xong; engine thread dùng một luồng cho mỗi peer."""
         # Khởi động một luồng cho mỗi peer
         threads = []
-        download_successful = True  # Cờ để kiểm tra xem quá trình tải có hoàn tất không
-        total_pieces = len(pieces)
-
         for peer in peers:
-            t = threading.Thread(target=self.download_worker, args=(peer, work_queue, results_queue, info_hash, peer_id, total_pieces))
+            t = threading.Thread(target=self.download_worker, args=(peer, piece_writer, info_hash, peer_id, total_pieces))
             t.start()
             threads.append(t)
 
-        # # Luồng để cập nhật thanh tiến độ
-        # progress_thread = threading.Thread(target=self.update_progress)
-        # progress_thread.start()
-        self.progress_bar = tqdm(total=total_pieces, desc='Assembling Files', unit='piece')
         # Chờ tất cả luồng hoàn tất
         for t in threads:
             t.join()
-        # self.stop_progress_thread.set()
-        # progress_thread.join()
-        
+
+    def start_download(self, peers, pieces, info_hash, peer_id, download_dir, files, fast_resume=None, connection_pool=None, file_pool=None, download_limiter=None):
+        logging.info(f"download_dir: {download_dir}")
+        self.connection_pool = connection_pool
+        self.download_limiter = download_limiter if download_limiter is not None else TokenBucket()
+        if files is not None:
+            self.prepare_download_file(download_dir)
+        else:
+            # Nếu files là None, tạo một danh sách chứa thông tin về tệp duy nhất
+            total_length = sum(piece.length for piece in pieces)
+            files = [{'path': [os.path.basename(download_dir)], 'length': total_length}]
+            download_dir = os.path.dirname(download_dir)
+            logging.info(f"files is None. Creating a single file entry. {files} on {download_dir}")
+
+        # Các mảnh được ghi thẳng vào vị trí cuối cùng trong file ngay khi kiểm tra xong
+        piece_writer = PieceWriter(download_dir, files, pieces[0].length, file_pool)
+        # Đọc fast-resume trước khi prepare_files thay đổi kích thước file
+        completed, partial = fast_resume.load(piece_writer, pieces) if fast_resume is not None else (set(), [])
+        piece_writer.prepare_files()
+
+        # Bộ chọn mảnh thay cho hàng đợi công việc dùng chung
+        self.piece_picker = PiecePicker(pieces)
+        self.piece_picker.restore(completed, partial)
+        self.fast_resume = fast_resume
+        self.downloaded_pieces = len(self.piece_picker.completed)
+
+        download_successful = True  # Cờ để kiểm tra xem quá trình tải có hoàn tất không
+        total_pieces = len(pieces)
+
+        self.progress_bar = tqdm(total=total_pieces, initial=self.downloaded_pieces, desc='Downloading', unit='piece')
+        self.verifier = PieceVerifier()
+        try:
+            if fast_resume is not None:
+                fast_resume.start(piece_writer, self.piece_picker)
+            if not self.piece_picker.is_finished():
+                self.run_workers(peers, piece_writer, info_hash, peer_id, total_pieces)
+        finally:
+            # Chờ các mảnh còn trong hàng đợi kiểm tra được ghi xong; lưu tiến độ cả khi bị ngắt (Ctrl+C) hoặc lỗi
+            self.verifier.shutdown()
+            logging.info(f"Piece verification stats: {self.verifier.stats()}")
+            if fast_resume is not None:
+                fast_resume.stop()
+                try:
+                    fast_resume.save(piece_writer, self.piece_picker)
+                except OSError as e:
+                    logging.warning(f"Could not save resume data: {e}")
+            if file_pool is None:
+                # Pool riêng của lần tải này; pool dùng chung do người tạo đóng
+                piece_writer.file_pool.close_all()
 
         # Kiểm tra xem tất cả các mảnh đã tải thành công chưa
-        downloaded_pieces = results_queue.qsize()
-        if downloaded_pieces == total_pieces:
-            if files is None:
-                # Nếu files là None, tạo một danh sách chứa thông tin về tệp duy nhất
-                total_length = sum(piece.length for piece in pieces)
-                files = [{'path': [os.path.basename(download_dir)], 'length': total_length}]
-                download_dir = os.path.dirname(download_dir)
-                logging.info(f"files is None. Creating a single file entry. {files} on {download_dir}")
-            self.assemble_file(results_queue, download_dir, files, pieces[0].length)
+        if self.downloaded_pieces == total_pieces:
             logging.info(f"Download completed. Files saved to {download_dir}")
         else:
             download_successful = False
@@ -248,4 +333,3 @@ class DownloadingManager:
         if not download_successful:
             logging.info("Download was incomplete. Please check network and retry.")
         return download_successful
-    
@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+import bencodepy
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.bitfield import Bitfield
+from p2p.request_pipeline import PieceProgress
+
+# Constants
+RESUME_DIR = os.path.join(os.path.expanduser('~'), '.p2p_resume')  # Thư mục mặc định chứa file fast-resume
+RESUME_SAVE_INTERVAL = 10  # Chu kỳ (giây) lưu trong lúc tải, cả khi không có mảnh nào vừa xong
+
+
+class FastResume:
+    """
+    Lưu trạng thái tải của một torrent vào `<resume_dir>/<info_hash>.resume` (bencode):
+    bitfield các mảnh đã kiểm tra, kích thước và mtime của từng file, và các block
+    đã nhận của những mảnh đang tải dở. Khi khởi động lại, nếu file trên đĩa không đổi
+    thì bỏ qua các mảnh đã xong mà không cần băm lại; nếu chỉ mtime đổi (có dữ liệu ghi
+    sau lần lưu cuối, ví dụ client bị tắt đột ngột) thì chỉ băm lại các mảnh đã ghi nhận
+    là xong; nếu kích thước đổi thì băm lại toàn bộ bằng FileManager.verify_piece.
+    """
+
+    def __init__(self, info_hash, resume_dir=RESUME_DIR, save_interval=RESUME_SAVE_INTERVAL):
+        self.info_hash = info_hash
+        self.resume_dir = resume_dir
+        self.save_interval = save_interval
+        self.path = os.path.join(resume_dir, f"{info_hash.hex()}.resume")
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.timer = None  # Luồng lưu định kỳ, chạy giữa start() và stop()
+
+    def load(self, file_manager, pieces):
+        """
+        Đọc trạng thái đã lưu. Trả về (tập index các mảnh đã xong, danh sách PieceProgress tải dở).
+        Phải gọi trước khi `prepare_files` thay đổi kích thước file.
+        """
+        if not os.path.exists(self.path):
+            return set(), []
+        try:
+            with open(self.path, 'rb') as f:
+                state = bencodepy.decode(f.read())
+        except (OSError, bencodepy.DecodingError) as e:
+            logging.warning(f"Could not read resume file {self.path}: {e}")
+            return self.recheck(file_manager, pieces)
+
+        files_unchanged = self.files_match(file_manager, state.get(b'files', []))
+        if (state.get(b'info_hash') != self.info_hash
+                or state.get(b'piece length') != file_manager.piece_length
+                or state.get(b'pieces count') != len(pieces)
+                or not (files_unchanged or self.files_match(file_manager, state.get(b'files', []), check_mtime=False))):
+            logging.warning("Resume data does not match files on disk, rechecking pieces")
+            return self.recheck(file_manager, pieces)
+
+        bitfield = Bitfield(state[b'bitfield'])
+        completed = {piece.index for piece in pieces if bitfield.has_piece(piece.index)}
+        partial = []
+        pieces_by_index = {piece.index: piece for piece in pieces}
+        if not files_unchanged:
+            # Mảnh ghi sau lần lưu cuối làm đổi mtime: chỉ kiểm tra lại các mảnh đã ghi nhận là xong
+            logging.info(f"Files changed since {self.path} was saved, rechecking {len(completed)} recorded pieces")
+            completed = {index for index in completed if file_manager.verify_piece(index, pieces_by_index[index].hash)}
+        for key, begins in state.get(b'partial', {}).items():
+            piece = pieces_by_index.get(int(key))
+            if piece is None or piece.index in completed:
+                continue
+            progress = PieceProgress(piece)
+            lengths = dict(progress.blocks)
+            for begin in begins:
+                if begin in lengths:
+                    progress.restore_block(begin, file_manager.read_block(piece.index, begin, lengths[begin]))
+            if progress.downloaded >= piece.length:
+                # Dừng sau block cuối nhưng trước khi kiểm tra mảnh
+                if hashlib.sha1(progress.buffer).digest() == piece.hash:
+                    completed.add(piece.index)
+                continue
+            partial.append(progress)
+        logging.info(f"Resumed {len(completed)} verified pieces and {len(partial)} partial pieces from {self.path}")
+        return completed, partial
+
+    def recheck(self, file_manager, pieces):
+        """Băm lại từng mảnh trên đĩa khi không tin được dữ liệu resume."""
+        completed = {piece.index for piece in pieces if file_manager.verify_piece(piece.index, piece.hash)}
+        logging.info(f"Recheck found {len(completed)}/{len(pieces)} valid pieces")
+        return completed, []
+
+    def files_match(self, file_manager, saved_files, check_mtime=True):
+        if len(saved_files) != len(file_manager.file_paths):
+            return False
+        for file_path, saved in zip(file_manager.file_paths, saved_files):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return False
+            if stat.st_size != saved.get(b'size') or (check_mtime and stat.st_mtime_ns != saved.get(b'mtime')):
+                return False
+        return True
+
+    def save(self, file_manager, piece_picker):
+        """
+        Ghi trạng thái hiện tại. Các block của mảnh tải dở được ghi xuống đúng vị trí
+        trong file trước, sau đó mới chụp kích thước/mtime để lần sau đối chiếu.
+        """
+        with self.lock:
+            completed, in_progress = piece_picker.snapshot()
+            pieces_count = len(piece_picker.pieces)
+            bitfield = bytearray((pieces_count + 7) // 8)
+            for index in completed:
+                Bitfield(bitfield).set_piece(index)
+
+            partial = {}
+            for progress in in_progress:
+                blocks = progress.received_blocks()
+                for begin, data in blocks:
+                    file_manager.write_block(progress.piece.index, begin, data)
+                if blocks:
+                    partial[str(progress.piece.index)] = [begin for begin, _ in blocks]
+
+            files = []
+            for file_path in file_manager.file_paths:
+                stat = os.stat(file_path)
+                files.append({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+
+            state = {
+                'info_hash': self.info_hash,
+                'piece length': file_manager.piece_length,
+                'pieces count': pieces_count,
+                'bitfield': bytes(bitfield),
+                'files': files,
+                'partial': partial,
+            }
+            os.makedirs(self.resume_dir, exist_ok=True)
+            # Ghi ra file tạm rồi đổi tên để không để lại file resume dở dang
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(bencodepy.encode(state))
+            os.replace(tmp_path, self.path)
+            self.last_save = time.monotonic()
+            logging.debug(f"Saved resume data ({len(completed)} pieces, {len(partial)} partial) to {self.path}")
+
+    def start(self, file_manager, piece_picker):
+        """Lưu mỗi `save_interval` giây trên một luồng nền cho đến khi stop()."""
+        self.stop_event.clear()
+        self.timer = threading.Thread(target=self.run, args=(file_manager, piece_picker), daemon=True)
+        self.timer.start()
+
+    def run(self, file_manager, piece_picker):
+        while not self.stop_event.wait(self.save_interval):
+            self.maybe_save(file_manager, piece_picker)
+
+    def stop(self):
+        """Dừng luồng lưu định kỳ; lần lưu cuối do người gọi thực hiện."""
+        if self.timer is not None:
+            self.stop_event.set()
+            self.timer.join()
+            self.timer = None
+
+    def maybe_save(self, file_manager, piece_picker):
+        """Lưu định kỳ trong lúc tải; bỏ qua nếu chưa đến hạn hoặc đang có luồng khác lưu."""
+        if time.monotonic() - self.last_save < self.save_interval or self.lock.locked():
+            return
+        try:
+            self.save(file_manager, piece_picker)
+        except OSError as e:
+            logging.warning(f"Could not save resume data: {e}")
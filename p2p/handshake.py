@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import logging_config
 class Handshake:
@@ -45,6 +46,29 @@ class Handshake:
                 raise ValueError("Failed to read full handshake")
             handshake_buf.extend(part)
 
+        return cls.parse(pstrlen, bytes(handshake_buf))
+
+    @classmethod
+    async def read_async(cls, reader) -> 'Handshake':
+        """Đọc handshake từ một asyncio.StreamReader."""
+        try:
+            length_buf = await reader.readexactly(1)
+        except asyncio.IncompleteReadError:
+            raise ValueError("Failed to read handshake length")
+
+        pstrlen = length_buf[0]
+        if pstrlen == 0:
+            raise ValueError("Handshake pstrlen is 0")
+
+        try:
+            handshake_buf = await reader.readexactly(48 + pstrlen)
+        except asyncio.IncompleteReadError:
+            raise ValueError("Failed to read full handshake")
+        return cls.parse(pstrlen, handshake_buf)
+
+    @classmethod
+    def parse(cls, pstrlen, handshake_buf) -> 'Handshake':
+        """Giải mã phần handshake nằm sau byte pstrlen."""
         pstr = handshake_buf[:pstrlen].decode('utf-8')
         reserved = handshake_buf[pstrlen:pstrlen + 8]
         info_hash = handshake_buf[pstrlen + 8:pstrlen + 28]
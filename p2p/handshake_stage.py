@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.handshake import Handshake
+from p2p.upload_manager import time_left
+
+HANDSHAKE_TIMEOUT = 10  # Thời gian tối đa (giây) từ lúc accept đến khi xong handshake và bitfield/extended handshake
+MAX_HANDSHAKES = 32  # Số handshake chạy cùng lúc
+MAX_PENDING_HANDSHAKES = 256  # Số kết nối chờ hoặc đang handshake tối đa, kết nối vượt quá bị đóng ngay
+
+
+class HandshakeStage:
+    """
+    Giai đoạn handshake của server seed dùng luồng: vòng accept chỉ giao socket cho stage rồi
+    accept tiếp, `max_handshakes` worker đọc handshake của peer, chọn UploadingManager theo
+    info_hash trong `uploading_managers` (info_hash -> UploadingManager, mọi torrent đang seed
+    trên port này) rồi chạy add_peer của manager đó song song.
+
+    Mỗi kết nối có deadline `timeout` giây tính từ lúc accept (kể cả thời gian chờ worker),
+    nên một peer chậm hoặc im lặng chỉ giữ một worker trong thời gian giới hạn. Khi đã có
+    `max_pending` kết nối trong stage, kết nối mới bị đóng ngay thay vì làm chậm vòng accept.
+    """
+
+    def __init__(self, uploading_managers, max_handshakes=MAX_HANDSHAKES, max_pending=MAX_PENDING_HANDSHAKES, timeout=HANDSHAKE_TIMEOUT):
+        self.uploading_managers = uploading_managers
+        self.max_handshakes = max_handshakes
+        self.max_pending = max(max_pending, max_handshakes)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_handshakes, thread_name_prefix='handshake')
+        self.lock = threading.Lock()
+        self.pending = 0  # Kết nối đang chờ worker hoặc đang handshake
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.unknown_torrents = 0  # Kết nối bị đóng vì info_hash không thuộc torrent nào đang seed
+
+    def submit(self, peer, client_socket):
+        """Giao socket vừa accept cho stage; trả về False (và đóng socket) nếu stage đã đầy."""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                full = True
+            else:
+                self.pending += 1
+                full = False
+        if full:
+            logging.warning(f"Rejecting connection from {peer}: {self.max_pending} handshakes pending")
+            client_socket.close()
+            return False
+        deadline = time.monotonic() + self.timeout
+        self.executor.submit(self.handshake, peer, client_socket, deadline)
+        return True
+
+    def handshake(self, peer, client_socket, deadline):
+        try:
+            client_socket.settimeout(time_left(deadline))
+            # Handshake.read chỉ đọc đúng số byte của handshake, phần sau để lại cho Communicator
+            handshake = Handshake.read(client_socket)
+            manager = self.uploading_managers.get(handshake.info_hash)
+            if manager is None:
+                with self.lock:
+                    self.unknown_torrents += 1
+                raise ValueError(f"Not seeding infohash {handshake.info_hash.hex()}")
+            manager.add_peer(peer, client_socket, deadline, handshake)
+            with self.lock:
+                self.completed += 1
+        except Exception as e:
+            logging.error(f"Handshake with peer {peer} failed: {e}")
+            client_socket.close()
+            with self.lock:
+                if isinstance(e, socket.timeout) or time.monotonic() >= deadline:
+                    self.timeouts += 1
+                else:
+                    self.failed += 1
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'handshaking': self.pending,
+                'max_handshakes': self.max_handshakes,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'unknown_torrents': self.unknown_torrents,
+            }
@@ -1,9 +1,20 @@
+import asyncio
 import struct
 import socket
 import logging
 import bencodepy
 # Cấu hình logging
 import logging_config
+
+REQQ = 250  # Giá trị `reqq` quảng bá trong extended handshake
+# Độ dài tối đa (gồm byte ID) của thông điệp nhận từ peer; độ dài lớn hơn là peer lỗi hoặc tấn công,
+# kết nối bị bỏ trước khi cấp phát buffer theo độ dài đó
+MAX_BLOCK_SIZE = 16384  # 16 KB, block lớn nhất được request
+MAX_PIECE_MESSAGE = 9 + MAX_BLOCK_SIZE  # ID, index, begin và một block
+MAX_BITFIELD_MESSAGE = 1 + (1 << 18)  # Đủ cho torrent khoảng 2 triệu mảnh
+MAX_EXTENDED_MESSAGE = 1 + 1024 + 16384  # Một phần metadata 16 KB kèm dict bencode
+MAX_CONTROL_MESSAGE = 17  # Các thông điệp còn lại (Request, Cancel, Have...) chỉ vài số nguyên
+
 class MessageID:
     MsgChoke = 0
     MsgUnchoke = 1
@@ -25,6 +36,11 @@ class Message:
         payload = struct.pack('>III', index, begin, length)
         return cls(message_id=MessageID.MsgRequest, payload=payload)
 
+    @classmethod
+    def format_cancel(cls, index, begin, length):
+        payload = struct.pack('>III', index, begin, length)
+        return cls(message_id=MessageID.MsgCancel, payload=payload)
+
     @classmethod
     def format_have(cls, index):
         payload = struct.pack('>I', index)
@@ -34,6 +50,11 @@ class Message:
     def format_piece(cls, index, begin, block):
         payload = struct.pack('>II', index, begin) + block
         return cls(message_id=MessageID.MsgPiece, payload=payload)
+
+    @staticmethod
+    def format_piece_header(index, begin, length):
+        """13 byte đầu của thông điệp Piece (độ dài, ID, index, begin); dữ liệu block gửi riêng ngay sau."""
+        return struct.pack('>IBII', 9 + length, MessageID.MsgPiece, index, begin)
     
     @classmethod
     def format_extended(cls, msg_type, payload):
@@ -60,10 +81,11 @@ class Message:
         payload =  bencodepy.encode({'msg_type': 2, 'piece': piece_index})
         return cls.format_extended(msg_type=2, payload=payload)
     @classmethod
-    def format_extended_handshake(cls, pieces_number):
+    def format_extended_handshake(cls, pieces_number, reqq=REQQ):
         extended_handshake = {
             'm': {'ut_metadata': 1},  # Giả định là 1 để chỉ định rằng peer hỗ trợ metadata
-            'pieces_number': pieces_number
+            'pieces_number': pieces_number,
+            'reqq': reqq  # Số request chưa trả lời tối đa mà client chấp nhận
         }
         payload =  bencodepy.encode(extended_handshake)
         return cls.format_extended(msg_type=0, payload=payload)
@@ -81,19 +103,20 @@ class Message:
         if len(msg.Payload) < 8:
             raise ValueError(f"Payload too short. {len(msg.Payload)} < 8")
 
-        parsed_index = struct.unpack('>I', msg.Payload[0:4])[0]
+        parsed_index, begin = struct.unpack_from('>II', msg.Payload, 0)
         if parsed_index != index:
             raise ValueError(f"Expected index {index}, got {parsed_index}")
 
-        begin = struct.unpack('>I', msg.Payload[4:8])[0]
         if begin >= len(buf):
             raise ValueError(f"Begin offset too high. {begin} >= {len(buf)}")
 
-        data = msg.Payload[8:]
+        # memoryview: chép thẳng từ payload vào buffer của mảnh, không tạo bản sao trung gian
+        data = memoryview(msg.Payload)[8:]
         if begin + len(data) > len(buf):
             raise ValueError(f"Data too long [{len(data)}] for offset {begin} with length {len(buf)}")
 
-        buf[begin:begin + len(data)] = data
+        # Gán qua memoryview để chép thẳng; gán vào lát cắt bytearray sẽ tạo thêm một bản sao
+        memoryview(buf)[begin:begin + len(data)] = data
         return len(data)
     
     @staticmethod
@@ -168,6 +191,27 @@ class Message:
         payload = bytes(msg.Payload[1:])  # Convert the rest of the Payload to bytes
         return msg_type, payload
     
+    @staticmethod
+    def parse_request(msg):
+        """(index, begin, length) của một Request hoặc Cancel."""
+        if msg.ID not in (MessageID.MsgRequest, MessageID.MsgCancel):
+            raise ValueError(f"Expected REQUEST or CANCEL, got ID {msg.ID}")
+        if len(msg.Payload) != 12:
+            raise ValueError(f"Expected payload length 12, got length {len(msg.Payload)}")
+
+        return struct.unpack('>III', msg.Payload)
+
+    @staticmethod
+    def parse_metadata_request(payload):
+        """Số thứ tự phần metadata được yêu cầu, từ payload (sau byte msg_type) của yêu cầu metadata."""
+        try:
+            piece_index = bencodepy.decode(payload)[b'piece']
+        except Exception as e:
+            raise ValueError(f"Invalid metadata request: {e!r}")
+        if not isinstance(piece_index, int) or piece_index < 0:
+            raise ValueError(f"Invalid metadata piece index {piece_index!r}")
+        return piece_index
+
     @staticmethod
     def parse_have(msg):
         if msg.ID != MessageID.MsgHave:
@@ -192,36 +236,43 @@ class Message:
         return buf
 
     @staticmethod
-    def read(r):
+    def recv_exactly(r, view):
+        """Đọc đủ len(view) byte từ socket thẳng vào `view` bằng recv_into."""
+        while len(view):
+            received = r.recv_into(view)
+            if not received:
+                raise ConnectionError("Socket connection closed by peer")
+            view = view[received:]
+
+    @staticmethod
+    def read(r, block_buffer=None):
+        """
+        Đọc một thông điệp từ socket. Dữ liệu được nhận bằng recv_into nên chỉ chép một lần
+        từ kernel vào payload. Nếu có `block_buffer` (buffer tái sử dụng của kết nối), payload
+        của Piece là memoryview trên buffer đó và chỉ hợp lệ đến lần đọc kế tiếp.
+        """
         try:
-            logging.debug("Reading message")
             # Kiểm tra nếu socket hợp lệ
             if r.fileno() == -1:
                 logging.error("Socket is closed or invalid")
                 return None, ValueError("Socket is closed or invalid")
 
-            length_buf = r.recv(4)
-            if len(length_buf) < 4:
-                logging.error("Could not read length")
-                return None, ValueError("Could not read length")
-            logging.debug(f"Received message length buffer: {length_buf}")
-            length = struct.unpack('>I', length_buf)[0]
-            logging.debug(f"Received message length: {length}")
+            header = bytearray(5)
+            Message.recv_exactly(r, memoryview(header)[:4])
+            length = struct.unpack_from('>I', header, 0)[0]
 
             if length == 0:
                 logging.debug("Received KeepAlive message")
                 return None, None
 
-            message_buf = bytearray()
-            while len(message_buf) < length:
-                part = r.recv(length - len(message_buf))
-                if not part:
-                    logging.error("Socket connection closed by peer")
-                    return None, ValueError("Socket connection closed by peer")
-                message_buf.extend(part)
-            # logging.debug(f"Received message buffer: {message_buf}")
-            message_id = message_buf[0]
-            payload = message_buf[1:]
+            Message.recv_exactly(r, memoryview(header)[4:])
+            message_id = header[4]
+            Message.check_length(message_id, length)
+            if message_id == MessageID.MsgPiece and block_buffer is not None and length - 1 <= len(block_buffer):
+                payload = memoryview(block_buffer)[:length - 1]
+            else:
+                payload = bytearray(length - 1)
+            Message.recv_exactly(r, memoryview(payload))
             #payload msg_type + payload
             logging.debug(f"Received {Message(message_id).name()} with ID {message_id} and payload length {len(payload)}")
             return Message(message_id=message_id, payload=payload), None
@@ -229,10 +280,57 @@ class Message:
         except socket.timeout:
             logging.error("Socket timed out while reading message")
             return None, TimeoutError("Socket timed out while reading message")
+        except ConnectionError as e:
+            logging.error(str(e))
+            return None, ValueError(str(e))
         except Exception as e:
             logging.error(f"Unexpected error while reading message: {e}")
             return None, e
 
+    @staticmethod
+    async def read_async(reader):
+        """Đọc một thông điệp từ asyncio.StreamReader, cùng định dạng với `read`."""
+        try:
+            length_buf = await reader.readexactly(4)
+            length = struct.unpack('>I', length_buf)[0]
+
+            if length == 0:
+                logging.debug("Received KeepAlive message")
+                return None, None
+
+            message_id = (await reader.readexactly(1))[0]
+            Message.check_length(message_id, length)
+            payload = await reader.readexactly(length - 1)
+            # Piece chỉ được đọc nên giữ nguyên bytes, tránh chép lại block
+            if message_id != MessageID.MsgPiece:
+                payload = bytearray(payload)
+            logging.debug(f"Received {Message(message_id).name()} with ID {message_id} and payload length {len(payload)}")
+            return Message(message_id=message_id, payload=payload), None
+
+        except asyncio.IncompleteReadError:
+            logging.error("Socket connection closed by peer")
+            return None, ValueError("Socket connection closed by peer")
+        except ValueError as e:
+            logging.error(str(e))
+            return None, e
+        except (ConnectionError, OSError) as e:
+            logging.error(f"Unexpected error while reading message: {e}")
+            return None, e
+
+    @staticmethod
+    def check_length(message_id, length):
+        """Ném ValueError nếu `length` (gồm byte ID) vượt giới hạn của loại thông điệp `message_id`."""
+        if message_id == MessageID.MsgPiece:
+            limit = MAX_PIECE_MESSAGE
+        elif message_id == MessageID.MsgBitfield:
+            limit = MAX_BITFIELD_MESSAGE
+        elif message_id == MessageID.MsgExtended:
+            limit = MAX_EXTENDED_MESSAGE
+        else:
+            limit = MAX_CONTROL_MESSAGE
+        if length > limit:
+            raise ValueError(f"Message with ID {message_id} too long: {length} bytes (max {limit})")
+
     def name(self):
         if self.ID is None:
             return "KeepAlive"
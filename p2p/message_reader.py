@@ -0,0 +1,146 @@
+import os
+import sys
+import socket
+import struct
+import logging
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.message import Message, MessageID
+from p2p.handshake import Handshake
+
+RECV_BUFFER_SIZE = 65536  # Số byte tối đa nhận trong một lần recv_into
+
+
+class MessageReader:
+    """
+    Bộ tách thông điệp cho một kết nối: nhận từng khối lớn từ socket vào một buffer
+    dùng vòng (dữ liệu chưa đọc được dời về đầu buffer khi hết chỗ phía sau) và giải mã
+    mọi thông điệp đầy đủ đã có mà không cần thêm syscall.
+
+    Mọi lần đọc trên một kết nối phải đi qua cùng một MessageReader, vì dữ liệu của
+    thông điệp kế tiếp có thể đã nằm trong buffer. Payload của Piece là memoryview trên
+    buffer và chỉ hợp lệ đến lần đọc kế tiếp; các thông điệp khác được chép ra bytearray.
+    """
+
+    def __init__(self, conn, buffer_size=RECV_BUFFER_SIZE):
+        self.conn = conn
+        self.buffer = bytearray(buffer_size)
+        self.start = 0  # Vị trí byte chưa đọc đầu tiên
+        self.end = 0  # Vị trí sau byte đã nhận cuối cùng
+        self.recv_calls = 0
+        self.messages_read = 0
+
+    def buffered(self):
+        """Số byte đã nhận nhưng chưa giải mã."""
+        return self.end - self.start
+
+    def _make_room(self, needed):
+        # Dời dữ liệu chưa đọc về đầu buffer, mở rộng buffer nếu một thông điệp lớn hơn nó
+        size = self.end - self.start
+        if needed > len(self.buffer):
+            buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            buffer[:size] = memoryview(self.buffer)[self.start:self.end]
+            self.buffer = buffer
+        elif size:
+            view = memoryview(self.buffer)
+            view[:size] = view[self.start:self.end]  # memoryview chép chồng lấn bằng memmove, không tạo bản sao tạm
+        self.start = 0
+        self.end = size
+
+    def _fill(self, needed):
+        """Nhận thêm dữ liệu cho đến khi có ít nhất `needed` byte chưa đọc."""
+        while self.end - self.start < needed:
+            if self.start + needed > len(self.buffer) or self.end == len(self.buffer):
+                self._make_room(needed)
+            received = self.conn.recv_into(memoryview(self.buffer)[self.end:])
+            self.recv_calls += 1
+            if not received:
+                raise ConnectionError("Socket connection closed by peer")
+            self.end += received
+
+    def has_message(self):
+        """True nếu buffer đã chứa trọn một thông điệp (đọc được mà không cần recv)."""
+        available = self.end - self.start
+        if available < 4:
+            return False
+        length = struct.unpack_from('>I', self.buffer, self.start)[0]
+        return available >= 4 + length
+
+    def _decode(self):
+        length = struct.unpack_from('>I', self.buffer, self.start)[0]
+        start = self.start + 4
+        if length:
+            Message.check_length(self.buffer[start], length)
+        self.start = start + length
+        if self.start == self.end:
+            self.start = self.end = 0  # Buffer trống: nhận lại từ đầu, không cần dời dữ liệu
+        if length == 0:
+            logging.debug("Received KeepAlive message")
+            return None
+        self.messages_read += 1
+        message_id = self.buffer[start]
+        payload = memoryview(self.buffer)[start + 1:start + length]
+        if message_id != MessageID.MsgPiece:
+            payload = bytearray(payload)
+        return Message(message_id=message_id, payload=payload)
+
+    def read(self):
+        """Đọc một thông điệp, cùng hợp đồng (msg, err) với Message.read."""
+        try:
+            self._fill(4)
+            length = struct.unpack_from('>I', self.buffer, self.start)[0]
+            if length:
+                # Kiểm tra độ dài peer gửi trước khi mở rộng buffer theo nó
+                self._fill(5)
+                Message.check_length(self.buffer[self.start + 4], length)
+            self._fill(4 + length)
+            return self._decode(), None
+        except socket.timeout:
+            # Dữ liệu đã nhận vẫn nằm trong buffer nên luồng byte không bị lệch
+            logging.error("Socket timed out while reading message")
+            return None, TimeoutError("Socket timed out while reading message")
+        except ConnectionError as e:
+            logging.error(str(e))
+            return None, ValueError(str(e))
+        except OSError as e:
+            logging.error(f"Unexpected error while reading message: {e}")
+            return None, e
+        except ValueError as e:
+            logging.error(str(e))
+            return None, e
+
+    def read_messages(self):
+        """
+        Chờ ít nhất một thông điệp rồi trả về (danh sách mọi thông điệp đầy đủ đã có, err).
+        KeepAlive bị bỏ qua nên danh sách có thể rỗng.
+        """
+        msg, err = self.read()
+        if err:
+            return [], err
+        messages = [msg] if msg is not None else []
+        try:
+            while self.has_message():
+                msg = self._decode()
+                if msg is not None:
+                    messages.append(msg)
+        except ValueError as e:
+            logging.error(str(e))
+            return messages, e
+        return messages, None
+
+    def read_handshake(self):
+        """Đọc handshake đầu kết nối; ném ValueError nếu kết nối đóng giữa chừng."""
+        try:
+            self._fill(1)
+        except ConnectionError:
+            raise ValueError("Failed to read handshake length")
+        pstrlen = self.buffer[self.start]
+        if pstrlen == 0:
+            raise ValueError("Handshake pstrlen is 0")
+        try:
+            self._fill(49 + pstrlen)
+        except ConnectionError:
+            raise ValueError("Failed to read full handshake")
+        handshake_buf = bytes(self.buffer[self.start + 1:self.start + 49 + pstrlen])
+        self.start += 49 + pstrlen
+        return Handshake.parse(pstrlen, handshake_buf)
@@ -12,6 +12,7 @@ from p2p.bitfield import Bitfield
 from p2p.peer import Peer
 from p2p.message import Message, MessageID
 from p2p.handshake import Handshake
+from p2p.message_reader import MessageReader
 class Communicator:
     def __init__(self, peer: Peer, peer_id: bytes, info_hash: bytes, bitfield: Bitfield = None, conn=None, expected_pieces=0, metadata=[]):
         self.conn = conn
@@ -22,11 +23,14 @@ class Communicator:
         self.expected_pieces = expected_pieces  # Số lượng phần của metadata cần nhận
         self.metadata = metadata  # Lưu trữ metadata từng phần đã nhận
         self.choked = True
+        self.reqq = None  # Số request tối đa peer chấp nhận (từ extended handshake)
 
         logging.debug(f"Created communicator with peer {peer}")
 
         if self.conn is None:
             self.conn = self.connect(peer)
+        # Mọi thông điệp nhận trên kết nối đều đi qua bộ đệm này
+        self.reader = MessageReader(self.conn)
 
         # self.complete_handshake()
         # if self.bitfield is None:
@@ -81,28 +85,43 @@ class Communicator:
         logging.debug("Sent extended handshake to peer")
 
     def recv_extended_handshake(self):
-        """Nhận và xử lý Extended Handshake Message từ peer."""
-        msg, err = Message.read(self.conn)
+        """Nhận và xử lý Extended Handshake Message từ peer; trả về False nếu không nhận được."""
+        msg, err = self.reader.read()
         if err:
             logging.error(f"Error reading extended handshake message: {err}")
-            return
+            return False
+        if msg is None:
+            logging.error("Expected extended handshake but got None")
+            return False
         if msg.ID == MessageID.MsgExtended:
             logging.info(f"msg.Payload: {msg.Payload[1:0]}")
             
             handshake = bencodepy.decode(bytes(msg.Payload[1:]))
             logging.debug(f"Received extended handshake: {handshake}")
             logging.debug("Received extended handshake")
+            self.reqq = handshake.get(b'reqq')
             if handshake[b'pieces_number'] > 0:
                 self.expected_pieces = handshake[b'pieces_number']
                 logging.debug("Peer supports metadata exchange (ut_metadata)")
             else:
                 logging.debug("Peer does not support metadata exchange")
+        return True
 
-    def recv_bitfield(self):
+    def negotiate_extended(self):
+        """
+        Extended handshake trên kết nối tải thường (handshake đã gửi với bit extension) để biết
+        `reqq` của peer, rồi báo đã có metadata để peer chuyển ngay sang trao đổi bitfield.
+        """
+        self.send_extended_handshake()
+        if not self.recv_extended_handshake():
+            raise ValueError(f"Did not receive extended handshake from {self.peer}")
+        self.send_have_metadata(self.expected_pieces)
+
+    def recv_bitfield(self, timeout=10):
         """Nhận bitfield từ peer và gửi xác nhận 'Interested' nếu có thể download."""
-        self.conn.settimeout(10)
+        self.conn.settimeout(timeout)
         try:
-            msg, err = Message.read(self.conn)
+            msg, err = self.reader.read()
             if err:
                 logging.error(f"Error reading message: {err}")
                 return False  # Trả về False nếu có lỗi
@@ -136,6 +155,10 @@ class Communicator:
         """Gửi một thông điệp Request tới peer."""
         req = Message.format_request(index, begin, length)
         self.conn.send(req.serialize())
+    def send_cancel(self, index, begin, length):
+        """Gửi thông điệp Cancel cho một request đã gửi trước đó."""
+        msg = Message.format_cancel(index, begin, length)
+        self.conn.send(msg.serialize())
     def send_unchoke(self):
         """Gửi thông điệp Unchoke tới peer."""
         msg = Message(message_id=MessageID.MsgUnchoke)
@@ -190,7 +213,7 @@ class Communicator:
     def receive_metadata_piece(self):
         """Nhận một phần metadata từ peer."""
         try:
-            message, error = Message.read(self.conn)
+            message, error = self.reader.read()
             if error:
                 logging.error(f"Error receiving metadata piece: {error}")
             elif message and message.ID == MessageID.MsgExtended:
@@ -223,7 +246,7 @@ class Communicator:
     def receive(self):
         """Nhận và xử lý các thông điệp từ peer."""
         try:
-            message, error = Message.read(self.conn)
+            message, error = self.reader.read()
             if error:
                 logging.error(f"Error receiving message: {error}")
             elif message and message.ID == MessageID.MsgExtended:
@@ -245,7 +268,7 @@ class Communicator:
     def recv_handshake(self):
         """Nhận và xử lý handshake từ peer."""
         try:
-            msg = Handshake.read(self.conn)
+            msg = self.reader.read_handshake()
             if msg.info_hash != self.info_hash:
                 raise ValueError(f"Expected infohash {self.info_hash.hex()} but got {msg.info_hash.hex()}")
             logging.debug("Received valid handshake response")
@@ -255,7 +278,7 @@ class Communicator:
     def read(self):
         """Đọc một thông điệp từ kết nối."""
         try:
-            msg, err = Message.read(self.conn)
+            msg, err = self.reader.read()
             if err:
                 logging.error(f"Error reading message: {err}")
             return msg
@@ -0,0 +1,98 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+DEFAULT_PIECE_CACHE_MB = 64  # Bộ nhớ mặc định cho cache mảnh khi seed
+
+
+class PieceCache:
+    """
+    Cache LRU các mảnh đã đọc từ đĩa, giới hạn theo tổng số byte.
+    Mảnh được nhiều peer yêu cầu chỉ phải đọc một lần rồi phục vụ từ bộ nhớ.
+    """
+
+    def __init__(self, capacity_mb=DEFAULT_PIECE_CACHE_MB):
+        """
+        :param capacity_mb: Dung lượng tối đa (MiB); 0 để tắt cache.
+        """
+        self.capacity = int(capacity_mb * 1024 * 1024)
+        self.pieces = OrderedDict()  # index -> bytes, mảnh dùng gần nhất ở cuối
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0  # Số mảnh được đọc trước vào cache
+        self.loading = {}  # index -> threading.Event của mảnh đang được đọc từ đĩa
+        self.lock = threading.Lock()
+
+    def get(self, index, loader):
+        """Trả về dữ liệu mảnh `index`, gọi `loader(index)` để đọc từ đĩa khi chưa có trong cache."""
+        while True:
+            with self.lock:
+                data = self.pieces.get(index)
+                if data is not None:
+                    self.pieces.move_to_end(index)
+                    self.hits += 1
+                    return data
+                loading = self.loading.get(index)
+                if loading is None:
+                    self.misses += 1
+                    self.loading[index] = threading.Event()
+                    break
+            # Mảnh đang được luồng khác đọc (thường là prefetch): chờ rồi lấy từ cache, không đọc lại
+            loading.wait()
+        return self._load(index, loader)
+
+    def prefetch(self, index, loader):
+        """Đọc trước mảnh `index` vào cache nếu chưa có và chưa có luồng nào đang đọc nó."""
+        with self.lock:
+            if index in self.pieces or index in self.loading:
+                return
+            self.loading[index] = threading.Event()
+        if self._load(index, loader) is not None:
+            with self.lock:
+                self.prefetched += 1
+
+    def _load(self, index, loader):
+        # Đọc đĩa ngoài khoá để các peer khác vẫn lấy được mảnh có sẵn
+        try:
+            data = loader(index)
+            if data is not None:
+                self.put(index, data)
+            return data
+        finally:
+            with self.lock:
+                self.loading.pop(index).set()
+
+    def put(self, index, data):
+        if len(data) > self.capacity:
+            return
+        with self.lock:
+            if index in self.pieces:
+                self.pieces.move_to_end(index)
+                return
+            self.pieces[index] = data
+            self.size += len(data)
+            while self.size > self.capacity:
+                _, evicted = self.pieces.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+                logging.debug(f"Evicted piece from cache ({self.size} / {self.capacity} bytes used)")
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'prefetched': self.prefetched,
+                'cached_pieces': len(self.pieces),
+                'size_mb': self.size / (1024 * 1024),
+                'capacity_mb': self.capacity / (1024 * 1024),
+            }
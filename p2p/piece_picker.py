@@ -0,0 +1,164 @@
+import random
+import logging
+import threading
+import logging_config
+from p2p.request_pipeline import PieceProgress
+
+RANDOM_FIRST_PIECES = 4  # Số mảnh đầu tiên được chọn ngẫu nhiên thay vì hiếm nhất
+
+
+class PiecePicker:
+    """
+    Chọn mảnh cần tải cho từng peer theo chiến lược rarest-first.
+    Giữ số peer sở hữu mỗi mảnh (cập nhật từ bitfield và MsgHave) và chỉ giao cho peer
+    những mảnh mà peer đó thật sự có, nên worker không phải đưa mảnh trở lại hàng đợi.
+
+    Khi mọi mảnh còn lại đều đã được giao (endgame), peer rảnh được cho tham gia tải
+    các mảnh đang được peer khác tải để mảnh cuối không bị kẹt ở một peer chậm.
+    """
+
+    def __init__(self, pieces, random_first=RANDOM_FIRST_PIECES):
+        """
+        :param pieces: Danh sách các Piece cần tải.
+        :param random_first: Số mảnh đầu tiên được chọn ngẫu nhiên.
+        """
+        self.pieces = {piece.index: piece for piece in pieces}
+        self.availability = [0] * (max(self.pieces) + 1 if self.pieces else 0)
+        self.pending = set(self.pieces)  # Các mảnh chưa được giao cho peer nào
+        self.in_flight = {}  # index -> số peer đang tải mảnh
+        self.progress = {}  # index -> PieceProgress dùng chung giữa các peer
+        self.completed = set()  # Các mảnh đã tải và kiểm tra xong
+        self.random_first = random_first
+        self.lock = threading.Lock()
+        self.piece_available = threading.Condition(self.lock)
+
+    def add_peer(self, bitfield):
+        """Cộng số lượng sở hữu cho mọi mảnh có trong bitfield của một peer mới."""
+        with self.lock:
+            for index in range(len(self.availability)):
+                if bitfield.has_piece(index):
+                    self.availability[index] += 1
+            self.piece_available.notify_all()
+
+    def remove_peer(self, bitfield):
+        """Trừ số lượng sở hữu khi một peer ngắt kết nối."""
+        with self.lock:
+            for index in range(len(self.availability)):
+                if bitfield.has_piece(index) and self.availability[index] > 0:
+                    self.availability[index] -= 1
+
+    def peer_has(self, bitfield, index):
+        """Cập nhật bitfield của peer và số lượng sở hữu khi nhận MsgHave."""
+        with self.lock:
+            if index >= len(self.availability) or bitfield.has_piece(index):
+                return
+            bitfield.set_piece(index)
+            self.availability[index] += 1
+            self.piece_available.notify_all()
+
+    def in_endgame(self):
+        """Endgame bắt đầu khi không còn mảnh nào chờ giao nhưng vẫn còn mảnh đang tải."""
+        with self.lock:
+            return not self.pending and bool(self.in_flight)
+
+    def _take_locked(self, index):
+        self.pending.discard(index)
+        self.in_flight[index] = self.in_flight.get(index, 0) + 1
+        if index not in self.progress:
+            self.progress[index] = PieceProgress(self.pieces[index])
+        return self.progress[index]
+
+    def _pick_locked(self, bitfield):
+        candidates = [index for index in self.pending if bitfield.has_piece(index)]
+        if not candidates:
+            return None
+        if len(self.completed) < self.random_first:
+            index = random.choice(candidates)
+        else:
+            # Hiếm nhất trước, chọn ngẫu nhiên giữa các mảnh hiếm ngang nhau
+            rarest = min(self.availability[i] for i in candidates)
+            index = random.choice([i for i in candidates if self.availability[i] == rarest])
+        logging.debug(f"Picked piece {index} (availability {self.availability[index]})")
+        return self._take_locked(index)
+
+    def _join_locked(self, bitfield, exclude):
+        # Endgame: tham gia mảnh đang tải ít peer nhất mà peer này có
+        candidates = [index for index in self.in_flight
+                      if index not in exclude and bitfield.has_piece(index) and not self.progress[index].done]
+        if not candidates:
+            return None
+        index = min(candidates, key=lambda i: self.in_flight[i])
+        logging.debug(f"Endgame: joining piece {index} ({self.in_flight[index]} peers)")
+        return self._take_locked(index)
+
+    def pick(self, bitfield, block=True, timeout=1, exclude=()):
+        """
+        Giao cho peer mảnh hiếm nhất mà peer có (dạng PieceProgress dùng chung).
+        Ở endgame, trả về một mảnh đang được peer khác tải, trừ các mảnh trong `exclude`.
+        Trả về None khi không còn mảnh nào peer này có thể tải (hoặc ngay lập tức nếu block=False).
+        """
+        if bitfield is None:
+            return None
+        with self.lock:
+            while True:
+                progress = self._pick_locked(bitfield)
+                if progress is None and not self.pending:
+                    progress = self._join_locked(bitfield, exclude)
+                if progress is not None or not block:
+                    return progress
+                if not self.in_flight:
+                    # Không còn mảnh đang tải nào có thể quay lại hàng đợi
+                    return None
+                self.piece_available.wait(timeout)
+
+    def release(self, progress):
+        """
+        Peer thôi tải mảnh (mất kết nối hoặc mảnh hỏng). Mảnh chỉ quay lại hàng đợi
+        khi không còn peer nào tải nó; dữ liệu đã nhận được giữ lại cho lần sau.
+        """
+        index = progress.piece.index
+        with self.lock:
+            if self.progress.get(index) is not progress or index not in self.in_flight:
+                return  # Mảnh đã hoàn tất
+            self.in_flight[index] -= 1
+            if self.in_flight[index] <= 0:
+                del self.in_flight[index]
+                self.pending.add(index)
+            self.piece_available.notify_all()
+
+    def complete(self, progress):
+        """Đánh dấu mảnh đã tải và kiểm tra xong."""
+        index = progress.piece.index
+        with self.lock:
+            self.in_flight.pop(index, None)
+            self.progress.pop(index, None)
+            self.pending.discard(index)
+            self.completed.add(index)
+            self.piece_available.notify_all()
+
+    def restore(self, completed, partial=()):
+        """
+        Nạp trạng thái fast-resume: bỏ các mảnh đã xong khỏi hàng đợi và giữ lại
+        PieceProgress của các mảnh đang tải dở để chỉ request những block còn thiếu.
+        """
+        with self.lock:
+            for index in completed:
+                if index in self.pieces:
+                    self.pending.discard(index)
+                    self.completed.add(index)
+            for progress in partial:
+                if progress.piece.index in self.pending:
+                    self.progress[progress.piece.index] = progress
+
+    def snapshot(self):
+        """Trả về (các mảnh đã xong, các PieceProgress đang dở) để lưu fast-resume."""
+        with self.lock:
+            return set(self.completed), list(self.progress.values())
+
+    def has_piece(self, index):
+        with self.lock:
+            return index in self.completed
+
+    def is_finished(self):
+        with self.lock:
+            return not self.pending and not self.in_flight
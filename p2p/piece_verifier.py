@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+# Constants
+VERIFY_WORKERS = min(4, os.cpu_count() or 1)  # Số luồng băm SHA-1
+
+
+class PieceVerifier:
+    """
+    Tầng kiểm tra SHA-1 chạy trên một pool luồng riêng, tách khỏi luồng đọc socket.
+    hashlib nhả GIL khi băm buffer lớn nên các mảnh được kiểm tra song song thật sự,
+    và không phải chép buffer sang process khác như khi dùng process pool.
+    """
+
+    def __init__(self, workers=VERIFY_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='piece-verify')
+        self.lock = threading.Lock()
+        self.queue_depth = 0  # Số mảnh đang chờ hoặc đang được băm
+        self.max_queue_depth = 0
+        self.verified = 0
+        self.failed = 0
+        self.bytes_hashed = 0
+        self.hash_time = 0.0  # Tổng thời gian băm của các luồng (giây)
+
+    def submit(self, progress, callback=None):
+        """
+        Đưa một mảnh đã nhận đủ block vào hàng đợi kiểm tra.
+        Trả về Future chứa kết quả kiểm tra, hoặc kết quả của `callback(progress, ok)` nếu có;
+        callback chạy trên luồng của pool, ví dụ để ghi mảnh xuống đĩa.
+        """
+        with self.lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return self.executor.submit(self._verify, progress, callback)
+
+    def _verify(self, progress, callback):
+        piece = progress.piece
+        start = time.perf_counter()
+        ok = hashlib.sha1(progress.buffer).digest() == piece.hash
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.queue_depth -= 1
+            self.bytes_hashed += len(progress.buffer)
+            self.hash_time += elapsed
+            if ok:
+                self.verified += 1
+            else:
+                self.failed += 1
+        logging.debug(f"Verified piece {piece.index}: {'ok' if ok else 'hash mismatch'} ({elapsed * 1000:.1f} ms)")
+        return callback(progress, ok) if callback else ok
+
+    def throughput(self):
+        """Tốc độ băm trung bình của một luồng (byte/giây)."""
+        with self.lock:
+            return self.bytes_hashed / self.hash_time if self.hash_time else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'verified': self.verified,
+                'failed': self.failed,
+                'bytes_hashed': self.bytes_hashed,
+                'hash_mb_per_s': round(self.bytes_hashed / self.hash_time / 1e6, 1) if self.hash_time else 0.0,
+            }
+
+    def shutdown(self):
+        """Chờ các mảnh trong hàng đợi kiểm tra xong rồi dừng pool."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,45 @@
+import os
+import sys
+import logging
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from metainfo.file_manager import FileManager
+
+
+class PieceWriter(FileManager):
+    """
+    Ghi từng mảnh đã kiểm tra xong vào đúng vị trí trong các file đích,
+    thay vì giữ toàn bộ torrent trong bộ nhớ rồi mới ghép file ở cuối.
+    """
+
+    def __init__(self, download_dir, files, piece_length, file_pool=None):
+        """
+        :param download_dir: Thư mục chứa các file tải về.
+        :param files: Danh sách file của torrent (mỗi phần tử có 'path' và 'length').
+        :param piece_length: Kích thước chuẩn của một mảnh.
+        :param file_pool: FilePool dùng chung với seeder của cùng torrent (nếu có).
+        """
+        super().__init__(download_dir, piece_length, files, file_pool)
+        self.download_dir = download_dir
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def prepare_files(self):
+        """Tạo các file đích với đúng kích thước, giữ nguyên dữ liệu đã ghi trước đó."""
+        for file_path, length in zip(self.file_paths, self.file_lengths):
+            file_dir = os.path.dirname(file_path)
+            if file_dir and not os.path.exists(file_dir):
+                os.makedirs(file_dir)
+            if not os.path.exists(file_path):
+                open(file_path, 'wb').close()
+            if os.path.getsize(file_path) != length:
+                os.truncate(file_path, length)
+
+    def write_piece(self, index, data):
+        """Ghi một mảnh vào (các) file tương ứng."""
+        written = super().write_piece(index, data)
+        with self.lock:
+            self.bytes_written += written
+        logging.debug(f"Wrote piece {index} ({written} bytes) to disk")
+        return written
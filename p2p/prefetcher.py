@@ -0,0 +1,85 @@
+import os
+import sys
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+READ_AHEAD_PIECES = 1  # Số mảnh kế tiếp được đọc trước cùng mảnh đang được yêu cầu
+PREFETCH_WORKERS = 2  # Số luồng đọc trước mảnh vào cache
+RECENT_PIECES = 64  # Số mảnh vừa được đọc trước được nhớ, để không đọc lại ở mỗi block
+# posix_fadvise chỉ có trên Linux/Unix; nơi khác bỏ qua việc đọc trước vào page cache
+USE_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+class Prefetcher:
+    """
+    Đọc trước mảnh cho seeder. Leecher yêu cầu các block của một mảnh lần lượt (0, 16K, 32K...),
+    nên ở request đầu tiên của một mảnh, cả mảnh đó và `read_ahead` mảnh kế tiếp được đọc nền,
+    và các block sau không phải chờ đĩa.
+
+    Khi block được gửi qua cache mảnh, worker đọc các mảnh kế tiếp vào PieceCache (mảnh đang được
+    yêu cầu do chính PieceCache.get đọc cả mảnh). Khi gửi bằng sendfile hoặc không có cache, worker
+    gọi posix_fadvise(WILLNEED) để kernel đọc không đồng bộ vào page cache mà sendfile/pread dùng.
+    """
+
+    def __init__(self, uploading_manager, read_ahead=READ_AHEAD_PIECES, workers=PREFETCH_WORKERS, executor=None):
+        self.uploading_manager = uploading_manager
+        self.read_ahead = max(0, read_ahead)
+        # Pool đọc trước dùng chung giữa các torrent của client; mặc định tạo pool riêng `workers` luồng
+        self.own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self.recent = OrderedDict()  # Mảnh đã kích hoạt đọc trước gần đây
+        self.lock = threading.Lock()
+        self.triggered = 0  # Số mảnh đã kích hoạt đọc trước
+        self.advised = 0  # Số mảnh đã báo kernel đọc trước
+
+    def on_request(self, index):
+        """Gọi khi nhận request một block của mảnh `index`; không chặn, việc đọc chạy nền."""
+        manager = self.uploading_manager
+        with self.lock:
+            if index in self.recent:
+                return
+            self.recent[index] = True
+            if len(self.recent) > RECENT_PIECES:
+                self.recent.popitem(last=False)
+            self.triggered += 1
+
+        if manager.piece_cache.capacity and not manager.use_sendfile:
+            for target in range(index + 1, index + 1 + self.read_ahead):
+                if target in manager.pieces:
+                    self.executor.submit(manager.piece_cache.prefetch, target, manager.read_piece)
+        elif USE_FADVISE:
+            # Mở file và fadvise cũng chạy trên worker, không chặn event loop của SeedingServer
+            for target in range(index, index + 1 + self.read_ahead):
+                if target in manager.pieces:
+                    self.executor.submit(self.advise, target)
+
+    def advise(self, index):
+        """Báo kernel sẽ cần các đoạn file của mảnh `index` (POSIX_FADV_WILLNEED)."""
+        manager = self.uploading_manager
+        try:
+            for file_idx, offset, count in manager.block_segments(index, 0, manager.pieces[index].length):
+                with manager.file_pool.open(manager.file_paths[file_idx]) as fd:
+                    os.posix_fadvise(fd, offset, count, os.POSIX_FADV_WILLNEED)
+        except OSError as e:
+            logging.debug(f"Could not prefetch piece {index}: {e}")
+            return
+        with self.lock:
+            self.advised += 1
+
+    def stop(self):
+        if self.own_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        prefetched = self.uploading_manager.piece_cache.stats()['prefetched']
+        with self.lock:
+            return {
+                'read_ahead': self.read_ahead,
+                'triggered': self.triggered,
+                'advised': self.advised,
+                'prefetched': prefetched,
+            }
@@ -0,0 +1,57 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    Giới hạn tốc độ kiểu token bucket (byte/giây), dùng chung giữa nhiều luồng.
+
+    Mỗi lần gửi/nhận `n` byte lấy `n` token; token được nạp lại theo `rate` và tích luỹ
+    tối đa `burst`. Khi thiếu token, bucket ghi nợ và người gọi ngủ đúng thời gian trả nợ,
+    nên block lớn hơn `burst` vẫn đi qua được và các luồng chờ theo thứ tự lấy token.
+    `parent` là bucket cấp trên (ví dụ giới hạn chung của client): lấy token ở cả hai.
+    `rate` bằng 0 hoặc None nghĩa là không giới hạn.
+    """
+
+    def __init__(self, rate=None, burst=None, parent=None):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.consumed = 0  # Tổng số byte đã đi qua bucket
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """Đổi giới hạn khi đang chạy; mặc định `burst` bằng lượng của một giây."""
+        with self.lock:
+            self.rate = rate or 0
+            self.burst = burst or self.rate
+            self.tokens = self.burst
+            self.last = time.monotonic()
+
+    def reserve(self, n):
+        """Lấy `n` token, trả về số giây phải chờ trước khi dùng chúng."""
+        with self.lock:
+            self.consumed += n
+            delay = 0.0
+            if self.rate:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                self.tokens -= n
+                if self.tokens < 0:
+                    delay = -self.tokens / self.rate
+        if self.parent is not None:
+            delay = max(delay, self.parent.reserve(n))
+        return delay
+
+    def consume(self, n):
+        """Chờ (chặn luồng) cho đến khi được phép gửi/nhận `n` byte."""
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, n):
+        """Như consume nhưng chờ bằng asyncio.sleep, không chặn event loop."""
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
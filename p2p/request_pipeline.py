@@ -0,0 +1,175 @@
+import math
+import time
+import struct
+import logging
+import threading
+from collections import deque
+import logging_config
+from p2p.message import Message
+
+# Constants
+MAX_BLOCK_SIZE = 16384  # 16 KB
+MIN_BACKLOG = 5  # Số request tối thiểu luôn được giữ (giá trị cố định cũ)
+MAX_BACKLOG_LIMIT = 250  # Trần số request chưa được trả lời cho một peer
+REQUEST_QUEUE_TIME = 3  # Số giây dữ liệu cần giữ trong hàng đợi request, ngoài RTT
+RATE_WINDOW = 0.5  # Độ dài cửa sổ đo tốc độ (giây)
+EWMA_ALPHA = 0.3  # Trọng số mẫu mới khi làm mượt tốc độ và RTT
+
+
+class PieceProgress:
+    """
+    Trạng thái tải của một mảnh: các block chưa request, đã nhận và buffer dữ liệu.
+    Ở chế độ endgame nhiều peer cùng tải một mảnh nên mọi thao tác đều được khoá.
+    """
+
+    def __init__(self, piece, block_size=MAX_BLOCK_SIZE):
+        self.piece = piece
+        self.buffer = bytearray(piece.length)
+        self.blocks = [(begin, min(block_size, piece.length - begin)) for begin in range(0, piece.length, block_size)]
+        self.unrequested = deque(self.blocks)
+        self.received = set()
+        self.downloaded = 0
+        self.done = False  # Đã có peer nhận block cuối và đang/đã kiểm tra mảnh
+        self.lock = threading.Lock()
+
+    def next_block(self):
+        """Trả về (begin, length) của block kế tiếp cần request, hoặc None."""
+        with self.lock:
+            while self.unrequested:
+                block = self.unrequested.popleft()
+                if block[0] not in self.received:
+                    return block
+            return None
+
+    def endgame_block(self, requested):
+        """Trả về một block chưa nhận mà peer này chưa request (`requested` là tập begin của peer)."""
+        with self.lock:
+            if self.done:
+                return None
+            for begin, length in self.blocks:
+                if begin not in self.received and begin not in requested:
+                    return begin, length
+            return None
+
+    def requeue_block(self, begin, length):
+        """Đưa block đã request nhưng chưa nhận trở lại để request lại."""
+        with self.lock:
+            if begin not in self.received:
+                self.unrequested.appendleft((begin, length))
+
+    def has_block(self, begin):
+        with self.lock:
+            return self.done or begin in self.received
+
+    def add_block(self, msg):
+        """
+        Chép block nhận được vào buffer; block trùng lặp bị bỏ qua.
+        Trả về True nếu block này hoàn tất mảnh (chỉ đúng với đúng một peer).
+        """
+        begin = struct.unpack_from('>I', msg.Payload, 4)[0]
+        with self.lock:
+            if self.done or begin in self.received:
+                return False
+            block_length = Message.parse_piece(self.piece.index, self.buffer, msg)
+            self.received.add(begin)
+            self.downloaded += block_length
+            if self.downloaded >= self.piece.length:
+                self.done = True
+                return True
+            return False
+
+    def received_blocks(self):
+        """Bản sao (begin, dữ liệu) của các block đã nhận, dùng để lưu fast-resume."""
+        with self.lock:
+            if self.done:
+                return []
+            lengths = dict(self.blocks)
+            return [(begin, bytes(self.buffer[begin:begin + lengths[begin]])) for begin in sorted(self.received)]
+
+    def restore_block(self, begin, data):
+        """Nạp lại một block đã nhận từ lần chạy trước (fast-resume)."""
+        with self.lock:
+            if begin in self.received:
+                return
+            self.buffer[begin:begin + len(data)] = data
+            self.received.add(begin)
+            self.downloaded += len(data)
+            self.unrequested = deque(block for block in self.unrequested if block[0] != begin)
+
+    def reset(self):
+        """Bỏ toàn bộ dữ liệu đã nhận, ví dụ khi mảnh không qua kiểm tra SHA-1."""
+        with self.lock:
+            self.unrequested = deque(self.blocks)
+            self.received.clear()
+            self.downloaded = 0
+            self.done = False
+
+
+class RequestPipeline:
+    """
+    Độ sâu hàng đợi request thích nghi cho một peer.
+    Số request được giữ đủ để phủ RTT nhỏ nhất đo được cộng REQUEST_QUEUE_TIME giây
+    ở tốc độ hiện tại của peer, trong khoảng [MIN_BACKLOG, min(reqq, MAX_BACKLOG_LIMIT)].
+    """
+
+    def __init__(self, reqq=None):
+        """
+        :param reqq: Số request tối đa peer quảng bá trong extended handshake (nếu có).
+        """
+        self.max_depth = min(reqq, MAX_BACKLOG_LIMIT) if reqq else MAX_BACKLOG_LIMIT
+        self.max_depth = max(self.max_depth, 1)
+        self.depth = min(MIN_BACKLOG, self.max_depth)
+        self.outstanding = {}  # (index, begin) -> (length, thời điểm gửi)
+        self.rate = 0.0  # byte/giây, đã làm mượt
+        self.rtt = None
+        self.min_rtt = None
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def can_request(self):
+        return len(self.outstanding) < self.depth
+
+    def on_request(self, index, begin, length):
+        self.outstanding[(index, begin)] = (length, time.monotonic())
+
+    def on_block(self, index, begin, length):
+        """Ghi nhận một block đến; trả về False nếu block không nằm trong các request đang chờ."""
+        request = self.outstanding.pop((index, begin), None)
+        if request is None:
+            return False
+        now = time.monotonic()
+        sample = now - request[1]
+        self.rtt = sample if self.rtt is None else (1 - EWMA_ALPHA) * self.rtt + EWMA_ALPHA * sample
+        self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+
+        self.window_bytes += length
+        elapsed = now - self.window_start
+        if elapsed >= RATE_WINDOW:
+            sample_rate = self.window_bytes / elapsed
+            self.rate = sample_rate if self.rate == 0 else (1 - EWMA_ALPHA) * self.rate + EWMA_ALPHA * sample_rate
+            self.window_start = now
+            self.window_bytes = 0
+            self.update_depth()
+        return True
+
+    def update_depth(self):
+        target = math.ceil(self.rate * ((self.min_rtt or 0) + REQUEST_QUEUE_TIME) / MAX_BLOCK_SIZE)
+        depth = min(max(MIN_BACKLOG, target), self.max_depth)
+        if depth != self.depth:
+            logging.debug(f"Request queue depth {self.depth} -> {depth} (rate {self.rate:.0f} B/s, min rtt {self.min_rtt:.3f} s)")
+            self.depth = depth
+
+    def requested_blocks(self, index):
+        """Tập các begin của mảnh `index` mà peer này đang chờ."""
+        return {begin for (piece_index, begin) in self.outstanding if piece_index == index}
+
+    def cancel(self, index, begin):
+        """Bỏ một request đang chờ; trả về length của nó hoặc None."""
+        request = self.outstanding.pop((index, begin), None)
+        return request[0] if request else None
+
+    def take_outstanding(self):
+        """Xoá và trả về tất cả request đang chờ, ví dụ khi bị choke hoặc timeout."""
+        outstanding = [(index, begin, length) for (index, begin), (length, _) in self.outstanding.items()]
+        self.outstanding.clear()
+        return outstanding
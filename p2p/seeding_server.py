@@ -0,0 +1,281 @@
+import os
+import sys
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import ExitStack
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from p2p.peer import Peer
+from p2p.message import Message, MessageID, REQQ
+from p2p.handshake import Handshake
+from p2p.upload_manager import CHOKE_POLL
+from p2p.handshake_stage import HANDSHAKE_TIMEOUT, MAX_HANDSHAKES
+
+LISTEN_BACKLOG = 128  # Số kết nối chờ accept tối đa trong hàng đợi của kernel
+MAX_CONNECTIONS = 1000  # Số peer phục vụ cùng lúc tối đa, kết nối vượt quá bị đóng ngay
+STOP_POLL = 0.5  # Chu kỳ kiểm tra stop_event (giây)
+
+
+class SeedingServer:
+    """
+    Server seed chạy trên một event loop asyncio: accept, handshake, trao đổi metadata và
+    phục vụ request của mọi peer trong cùng một luồng, thay cho accept có timeout và một
+    luồng cho mỗi peer. Dữ liệu mảnh, choker, giới hạn tốc độ và cache lấy từ UploadingManager.
+
+    Một server phục vụ mọi torrent đang seed trên cùng một port: `uploading_managers` ánh xạ
+    info_hash -> UploadingManager (dùng chung với client, torrent thêm/bớt khi server đang chạy)
+    và mỗi kết nối được chuyển cho manager theo info_hash trong handshake của peer.
+    """
+
+    def __init__(self, uploading_managers, port, backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS, host='0.0.0.0',
+                 max_handshakes=MAX_HANDSHAKES, handshake_timeout=HANDSHAKE_TIMEOUT):
+        self.uploading_managers = uploading_managers
+        self.port = port
+        self.host = host
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.max_handshakes = max_handshakes
+        self.handshake_timeout = handshake_timeout
+        self.handshake_slots = asyncio.Semaphore(max_handshakes)
+        self.connections = 0
+        self.rejected = 0
+        self.handshaking = 0  # Kết nối đang chờ slot hoặc đang handshake
+        self.handshake_timeouts = 0
+        self.unknown_torrents = 0  # Kết nối bị đóng vì info_hash không thuộc torrent nào đang seed
+        self.writers = set()  # Kết nối đang mở, đóng hết khi dừng server
+        self.ready = threading.Event()  # Được set khi server đã listen
+
+    def run(self, stop_event):
+        """Chạy server (chặn luồng gọi) cho đến khi `stop_event` được set."""
+        asyncio.run(self.serve(stop_event))
+
+    async def serve(self, stop_event):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port, backlog=self.backlog, reuse_address=True)
+        logging.info(f"Seeding server started on port {self.port} (backlog {self.backlog}, max {self.max_connections} connections)")
+        self.ready.set()
+        try:
+            while not stop_event.is_set():
+                await asyncio.sleep(STOP_POLL)
+        finally:
+            server.close()
+            for writer in list(self.writers):
+                writer.close()
+            logging.info("Seeding server stopped.")
+
+    async def handle_connection(self, reader, writer):
+        peername = writer.get_extra_info('peername')
+        peer = Peer(peername[0], peername[1])
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            logging.warning(f"Rejecting connection from {peer}: {self.connections} connections open")
+            writer.close()
+            return
+        logging.info(f"Accepted connection from {peer}")
+        self.connections += 1
+        self.writers.add(writer)
+        try:
+            await self.serve_peer(peer, reader, writer)
+        except (asyncio.TimeoutError, ConnectionError, OSError, ValueError) as e:
+            logging.error(f"Error serving peer {peer}: {e}")
+        finally:
+            self.connections -= 1
+            self.writers.discard(writer)
+            writer.close()
+
+    async def serve_peer(self, peer, reader, writer):
+        """Handshake, trao đổi metadata (nếu peer dùng extension) rồi phục vụ request."""
+        manager, extension = await self.handshake(peer, reader, writer)
+        if extension and not await self.exchange_metadata(manager, peer, reader, writer):
+            return
+
+        msg, err = await asyncio.wait_for(Message.read_async(reader), timeout=HANDSHAKE_TIMEOUT)
+        if err or msg is None or msg.ID != MessageID.MsgBitfield:
+            logging.error(f"Expected bitfield from {peer} but got {err or msg}")
+            return
+        writer.write(Message(message_id=MessageID.MsgBitfield, payload=manager.make_bitfield()).serialize())
+        await writer.drain()
+        logging.info(f"Received bitfield from {peer}")
+        await self.serve_requests(manager, peer, reader, writer)
+
+    async def handshake(self, peer, reader, writer):
+        """
+        Trao đổi handshake (và extended handshake) với tối đa `max_handshakes` peer cùng lúc, trong
+        `handshake_timeout` giây tính từ lúc accept kể cả thời gian chờ slot.
+        Trả về (UploadingManager của torrent peer muốn tải, True nếu peer dùng extension).
+        """
+        self.handshaking += 1
+        try:
+            async with asyncio.timeout(self.handshake_timeout), self.handshake_slots:
+                handshake = await Handshake.read_async(reader)
+                manager = self.uploading_managers.get(handshake.info_hash)
+                if manager is None:
+                    self.unknown_torrents += 1
+                    raise ValueError(f"Not seeding infohash {handshake.info_hash.hex()}")
+                writer.write(Handshake(manager.info_hash, manager.peer_id).serialize())
+                if not handshake.extension_bittorrent:
+                    await writer.drain()
+                    return manager, False
+
+                logging.debug(f"Peer {peer} supports the extension protocol")
+                writer.write(Message.format_extended_handshake(len(manager.metadata)).serialize())
+                await writer.drain()
+                msg, err = await Message.read_async(reader)
+                if err or msg is None or msg.ID != MessageID.MsgExtended:
+                    raise ValueError(f"Expected extended handshake from {peer} but got {err or msg}")
+                return manager, True
+        except TimeoutError:
+            self.handshake_timeouts += 1
+            raise
+        finally:
+            self.handshaking -= 1
+
+    async def exchange_metadata(self, manager, peer, reader, writer):
+        """Gửi metadata theo yêu cầu; trả về True khi peer báo đã đủ metadata và muốn tải tiếp."""
+        logging.info(f"Received extended handshake from {peer}")
+        while not manager.stopped.is_set():
+            msg, err = await Message.read_async(reader)
+            if err:
+                return False
+            if msg is None:
+                continue
+            msg_type, payload = Message.parse_extended(msg)
+            if msg_type == 0:  # Metadata request
+                piece_index = Message.parse_metadata_request(payload)
+                if piece_index < len(manager.metadata):
+                    writer.write(Message.format_metadata_data(piece_index, manager.metadata[piece_index]).serialize())
+                    logging.debug(f"Sent metadata piece {piece_index} to {peer}")
+                else:
+                    writer.write(Message.format_metadata_reject(piece_index).serialize())
+                await writer.drain()
+            elif msg_type == 3:
+                logging.info(f"Peer {peer} has all metadata")
+                return True
+        return False
+
+    async def serve_requests(self, manager, peer, reader, writer):
+        """
+        Đọc thông điệp của peer trong khi một task riêng gửi các block đã xếp hàng,
+        nên Cancel đến lúc đang gửi vẫn xoá được block chưa gửi.
+        """
+        requests = deque()  # Các request (index, begin, length) chưa gửi, theo thứ tự nhận
+        wakeup = asyncio.Event()
+        manager.track_peer(peer, writer, requests)
+        sender = asyncio.create_task(self.send_blocks(manager, peer, writer, requests, wakeup))
+        try:
+            while not sender.done():
+                msg, err = await Message.read_async(reader)
+                if err:
+                    break
+                if msg is None:
+                    continue
+                # Payload sai định dạng ném ValueError và kết nối bị đóng
+                if msg.ID == MessageID.MsgRequest:
+                    request = Message.parse_request(msg)
+                    if not manager.choker.is_unchoked(peer):
+                        logging.debug(f"Ignoring request from choked peer {peer}")
+                    elif len(requests) >= REQQ:
+                        logging.warning(f"Dropping request for piece {request[0]} from {peer}: queue full")
+                    else:
+                        requests.append(request)
+                        manager.prefetcher.on_request(request[0])
+                        wakeup.set()
+                elif msg.ID == MessageID.MsgCancel:
+                    request = Message.parse_request(msg)
+                    try:
+                        requests.remove(request)
+                        logging.debug(f"Cancelled request {request} from {peer}")
+                    except ValueError:
+                        pass  # Block đã được gửi
+                elif msg.ID == MessageID.MsgInterested:
+                    manager.choker.set_interested(peer, True)
+                    wakeup.set()
+                elif msg.ID == MessageID.MsgNotInterested:
+                    logging.info(f"Peer {peer} is not interested")
+                    manager.choker.set_interested(peer, False)
+                    break
+                elif msg.ID == MessageID.MsgHave:
+                    logging.info(f"Peer {peer} has piece {Message.parse_have(msg)}")
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            manager.untrack_peer(peer, writer)
+
+    async def send_blocks(self, manager, peer, writer, requests, wakeup):
+        """Gửi Choke/Unchoke theo choker và gửi lần lượt các block trong hàng đợi."""
+        unchoked = False  # Trạng thái đã báo cho peer; peer bắt đầu ở trạng thái bị choke
+        while not manager.stopped.is_set():
+            if manager.choker.is_unchoked(peer) != unchoked:
+                unchoked = not unchoked
+                writer.write(Message(message_id=MessageID.MsgUnchoke if unchoked else MessageID.MsgChoke).serialize())
+                if not unchoked:
+                    requests.clear()  # Choke huỷ mọi request đang chờ
+                await writer.drain()
+            if not requests:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=CHOKE_POLL)
+                except asyncio.TimeoutError:
+                    pass  # Xem lại trạng thái choke
+                continue
+            index, begin, length = requests.popleft()
+            if not manager.check_request(index, begin, length):
+                continue
+            await manager.upload_limiter.consume_async(length)
+            if await self.send_block(manager, writer, index, begin, length):
+                manager.choker.record_upload(peer, length)
+                logging.debug(f"Uploaded block {begin}-{begin + length} of piece {index} to {peer}")
+        # Torrent đã dừng seed: đóng kết nối để vòng đọc của serve_requests cũng kết thúc
+        writer.close()
+
+    async def send_block(self, manager, writer, index, begin, length):
+        """Gửi header 13 byte rồi dữ liệu block, bằng loop.sendfile hoặc qua cache mảnh."""
+        header = Message.format_piece_header(index, begin, length)
+        if manager.use_sendfile:
+            segments = manager.block_segments(index, begin, length)
+            if sum(segment[2] for segment in segments) != length:
+                logging.error(f"Piece {index} not found in piece_to_file_map.")
+                return False
+            loop = asyncio.get_running_loop()
+            with ExitStack() as stack:
+                try:
+                    fds = [stack.enter_context(manager.file_pool.open(manager.file_paths[file_idx])) for file_idx, _, _ in segments]
+                except OSError as e:
+                    logging.error(f"I/O error occurred while opening piece {index}: {e}")
+                    return False
+                writer.write(header)
+                for fd, (file_idx, offset, count) in zip(fds, segments):
+                    # loop.sendfile chờ header được gửi xong rồi dùng os.sendfile (hoặc đọc/gửi thường)
+                    with os.fdopen(fd, 'rb', buffering=0, closefd=False) as f:
+                        sent = await loop.sendfile(writer.transport, f, offset, count)
+                    if sent != count:
+                        raise OSError(f"Short sendfile for piece {index}: sent {sent} of {count} bytes from {manager.file_paths[file_idx]}")
+            return True
+
+        # Đọc đĩa trong thread pool để không chặn event loop
+        if manager.piece_cache.capacity:
+            piece_data = await asyncio.to_thread(manager.piece_cache.get, index, manager.read_piece)
+            data = memoryview(piece_data)[begin:begin + length] if piece_data is not None else None
+        else:
+            data = await asyncio.to_thread(manager.read_block, index, begin, length)
+        if data is None or len(data) != length:
+            logging.error(f"Could not read block {begin}-{begin + length} of piece {index}.")
+            return False
+        writer.write(header)
+        writer.write(data)
+        await writer.drain()
+        return True
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'max_connections': self.max_connections,
+            'backlog': self.backlog,
+            'rejected': self.rejected,
+            'handshaking': self.handshaking,
+            'max_handshakes': self.max_handshakes,
+            'handshake_timeouts': self.handshake_timeouts,
+            'torrents': len(self.uploading_managers),
+            'unknown_torrents': self.unknown_torrents,
+        }
@@ -1,23 +1,46 @@
 import logging
 import threading
-import struct
 import sys
 import os
 import hashlib
-import bencodepy
 import socket
+import select
+import time
+from collections import deque
+from contextlib import ExitStack
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from p2p.message import Message, MessageID
+from p2p.message import Message, MessageID, REQQ, MAX_BLOCK_SIZE
 from p2p.peer_communication import Communicator
 from p2p.piece import Piece
 from p2p.bitfield import Bitfield
-from p2p.handshake import Handshake
+from p2p.piece_cache import PieceCache, DEFAULT_PIECE_CACHE_MB
+from metainfo.file_pool import FilePool
+from p2p.choker import Choker, ChokeTimer, UPLOAD_SLOTS, CHOKE_INTERVAL, OPTIMISTIC_INTERVAL
+from p2p.rate_limiter import TokenBucket
+from p2p.prefetcher import Prefetcher, READ_AHEAD_PIECES
 import logging_config
 # Số lượng tối đa các yêu cầu tải lên có thể xử lý đồng thời
 MAX_UPLOAD_QUEUE = 5
+# Gửi dữ liệu block thẳng từ file xuống socket bằng os.sendfile nếu hệ điều hành hỗ trợ
+USE_SENDFILE = hasattr(os, 'sendfile')
+CHOKE_POLL = 1  # Thời gian tối đa (giây) luồng peer chờ dữ liệu trước khi xem lại trạng thái choke
+PEER_TIMEOUT = 10  # Timeout (giây) của mỗi lần đọc/gửi trên kết nối peer
+
+
+def time_left(deadline):
+    """Thời gian (giây) còn lại tới `deadline` để đặt timeout cho socket; ném socket.timeout nếu đã quá hạn."""
+    if deadline is None:
+        return PEER_TIMEOUT
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout("Handshake deadline exceeded")
+    return remaining
+
 
 class UploadingManager:
-    def __init__(self, pieces, peer_id, info_hash, file_paths, total_lengths, metadata=[]):
+    def __init__(self, pieces, peer_id, info_hash, file_paths, total_lengths, metadata=[], cache_mb=DEFAULT_PIECE_CACHE_MB, use_sendfile=USE_SENDFILE, file_pool=None,
+                 upload_slots=UPLOAD_SLOTS, choke_interval=CHOKE_INTERVAL, optimistic_interval=OPTIMISTIC_INTERVAL, upload_limiter=None,
+                 read_ahead=READ_AHEAD_PIECES, choke_timer=None, prefetch_executor=None):
         """
         Khởi tạo UploadingManager với các mảnh mà client sở hữu.
         :param pieces: Danh sách các mảnh mà client có.
@@ -26,6 +49,17 @@ class UploadingManager:
         :param file_paths: Danh sách đường dẫn tới các file chứa dữ liệu.
         :param total_lengths: Danh sách chiều dài của từng file.
         :param metadata: Metadata để seeding (nếu có).
+        :param cache_mb: Dung lượng cache mảnh (MiB), 0 để đọc đĩa cho từng block.
+        :param use_sendfile: Gửi block bằng os.sendfile (không chép qua Python); khi tắt hoặc
+                             không được hỗ trợ thì đọc block qua cache mảnh.
+        :param file_pool: FilePool dùng chung với downloader của cùng torrent; mặc định tạo pool riêng.
+        :param upload_slots: Số peer được unchoke cùng lúc (kể cả optimistic unchoke).
+        :param choke_interval: Chu kỳ (giây) tính lại danh sách unchoke.
+        :param optimistic_interval: Chu kỳ (giây) đổi peer optimistic unchoke.
+        :param upload_limiter: TokenBucket giới hạn tốc độ gửi của torrent; mặc định không giới hạn.
+        :param read_ahead: Số mảnh kế tiếp được đọc trước khi peer bắt đầu yêu cầu một mảnh.
+        :param choke_timer: ChokeTimer dùng chung giữa các torrent; mặc định tạo timer riêng.
+        :param prefetch_executor: ThreadPoolExecutor đọc trước dùng chung giữa các torrent; mặc định tạo pool riêng.
         """
         self.pieces = {piece.index: piece for piece in pieces}  # Lưu trữ mảnh theo index để truy xuất nhanh
         self.peer_id = peer_id
@@ -34,9 +68,21 @@ class UploadingManager:
         self.total_lengths = total_lengths  # Danh sách chiều dài của từng file
         self.upload_queue = []
         self.peers = {}
-        self.lock = threading.Lock()
+        self.request_queues = {}  # peer -> deque các request chưa gửi của peer đó
+        self.lock = threading.Lock()  # Chỉ bảo vệ self.peers/self.request_queues, không giữ khi đọc đĩa hay gửi
         self.piece_to_file_map = self.build_piece_to_file_map()
         self.metadata = metadata  # Metadata để seeding (nếu có)
+        self.piece_cache = PieceCache(cache_mb)
+        self.use_sendfile = use_sendfile and USE_SENDFILE
+        self.file_pool = file_pool if file_pool is not None else FilePool()  # Các file giữ mở giữa các block
+        # Choker ưu tiên peer nhận nhanh nhất
+        self.choker = Choker(upload_slots, choke_interval, optimistic_interval)
+        self.upload_limiter = upload_limiter if upload_limiter is not None else TokenBucket()
+        self.own_choke_timer = choke_timer is None
+        self.choke_timer = choke_timer if choke_timer is not None else ChokeTimer()
+        self.choke_timer.add(self.choker)
+        self.prefetcher = Prefetcher(self, read_ahead, executor=prefetch_executor)
+        self.stopped = threading.Event()  # Torrent đã dừng seed: vòng phục vụ của mọi peer kết thúc
 
     def build_piece_to_file_map(self):
         """
@@ -79,72 +125,147 @@ class UploadingManager:
         :param begin: Vị trí bắt đầu của block.
         :param length: Độ dài của block.
         """
-        if index not in self.pieces:
-            logging.error(f"Requested piece {index} not available.")
+        if not self.check_request(index, begin, length):
             return
+        # Chờ đủ token trước khi gửi; chỉ luồng của peer này bị chặn
+        self.upload_limiter.consume(length)
 
-        piece_segments = self.piece_to_file_map.get(index)
-        if not piece_segments:
-            logging.error(f"Piece {index} not found in piece_to_file_map.")
+        if self.use_sendfile:
+            # Chỉ 13 byte header đi qua Python, dữ liệu block do kernel chép từ file xuống socket
+            if self.send_block(communicator, index, begin, length):
+                self.choker.record_upload(communicator.peer, length)
+                logging.debug(f"Uploaded block {begin}-{begin + length} of piece {index} to {communicator.peer} via sendfile")
             return
 
-        data = bytearray()  # Để lưu dữ liệu block cần gửi
+        if self.piece_cache.capacity:
+            # Đọc cả mảnh một lần vào cache, các block sau (và các peer khác) lấy từ bộ nhớ
+            piece_data = self.piece_cache.get(index, self.read_piece)
+            if piece_data is None:
+                return
+            data = memoryview(piece_data)[begin:begin + length]
+        else:
+            data = self.read_block(index, begin, length)
+            if data is None:
+                return
+
+        # Kiểm tra đủ dữ liệu đọc được
+        if len(data) != length:
+            logging.error(f"Expected to read {length} bytes, but read {len(data)} bytes for piece {index}.")
+            return
+
+        # Gửi header rồi gửi thẳng dữ liệu block, không ghép thành payload mới
+        communicator.conn.sendall(Message.format_piece_header(index, begin, length))
+        communicator.conn.sendall(data)
+        self.choker.record_upload(communicator.peer, length)
+        logging.debug(f"Uploaded block {begin}-{begin + length} of piece {index} to {communicator.peer}")
+
+    def check_request(self, index, begin, length):
+        """Kiểm tra block được yêu cầu nằm trong một mảnh mà client có."""
+        if index not in self.pieces:
+            logging.error(f"Requested piece {index} not available.")
+            return False
+        if not 0 < length <= MAX_BLOCK_SIZE:
+            # Block lớn hơn 16 KiB vượt qua burst của bucket và giới hạn reqq
+            logging.error(f"Requested block length {length} for piece {index} is not in 1-{MAX_BLOCK_SIZE}.")
+            return False
+        if begin + length > self.pieces[index].length:
+            logging.error(f"Requested block {begin}-{begin + length} is outside piece {index}.")
+            return False
+        return True
+
+    def read_piece(self, index):
+        """Đọc toàn bộ một mảnh từ (các) file; trả về None nếu lỗi."""
+        data = self.read_block(index, 0, self.pieces[index].length)
+        if data is None or len(data) != self.pieces[index].length:
+            logging.error(f"Could not read full piece {index} from disk.")
+            return None
+        return bytes(data)
+
+    def block_segments(self, index, begin, length):
+        """
+        Chia block (index, begin, length) thành các đoạn (file_idx, offset trong file, độ dài)
+        theo piece_to_file_map, vì một block có thể nằm vắt qua hai file.
+        """
+        segments = []
         remaining_length = length
         read_offset = begin
 
         # Duyệt qua các segment của piece để đọc dữ liệu từ nhiều file nếu cần thiết
-        for file_idx, file_offset, segment_length in piece_segments:
+        for file_idx, file_offset, segment_length in self.piece_to_file_map.get(index, []):
             if read_offset >= segment_length:
                 # Bỏ qua phần đã vượt qua
                 read_offset -= segment_length
                 continue
 
-            segment_offset = file_offset + read_offset
             segment_read_length = min(remaining_length, segment_length - read_offset)
+            segments.append((file_idx, file_offset + read_offset, segment_read_length))
             read_offset = 0  # Reset sau khi lấy được offset đọc ban đầu
+            remaining_length -= segment_read_length
+            if remaining_length <= 0:
+                break  # Đã đủ dữ liệu
+        return segments
 
+    def send_block(self, communicator, index, begin, length):
+        """
+        Gửi một block bằng sendfile: header 13 byte rồi dữ liệu từng đoạn file.
+        socket.sendfile tự chuyển sang đọc/gửi thường nếu không dùng được os.sendfile.
+        Header đã gửi thì phải gửi đủ block, nếu thiếu luồng byte bị lệch nên ném OSError để đóng kết nối.
+        """
+        segments = self.block_segments(index, begin, length)
+        if sum(segment[2] for segment in segments) != length:
+            logging.error(f"Piece {index} not found in piece_to_file_map.")
+            return
+        # Mượn fd của mọi file trước khi gửi header để lỗi file không làm lệch luồng byte
+        with ExitStack() as stack:
             try:
-                with open(self.file_paths[file_idx], 'rb') as f:
-                    f.seek(segment_offset)
-                    data.extend(f.read(segment_read_length))
-                    remaining_length -= segment_read_length
-                    if remaining_length <= 0:
-                        break  # Đã đọc đủ dữ liệu
+                fds = [stack.enter_context(self.file_pool.open(self.file_paths[file_idx])) for file_idx, _, _ in segments]
+            except OSError as e:
+                logging.error(f"I/O error occurred while opening piece {index}: {e}")
+                return
+            communicator.conn.sendall(Message.format_piece_header(index, begin, length))
+            for fd, (file_idx, offset, count) in zip(fds, segments):
+                # File object bọc fd dùng chung, không đóng fd khi bị huỷ
+                with os.fdopen(fd, 'rb', buffering=0, closefd=False) as f:
+                    sent = communicator.conn.sendfile(f, offset, count)
+                if sent != count:
+                    raise OSError(f"Short sendfile for piece {index}: sent {sent} of {count} bytes from {self.file_paths[file_idx]}")
+        return True
+
+    def read_block(self, index, begin, length):
+        """Đọc một block của mảnh từ (các) file; trả về None nếu lỗi."""
+        segments = self.block_segments(index, begin, length)
+        if not segments:
+            logging.error(f"Piece {index} not found in piece_to_file_map.")
+            return None
+
+        data = bytearray()  # Để lưu dữ liệu block cần gửi
+        for file_idx, segment_offset, segment_read_length in segments:
+            try:
+                data.extend(self.file_pool.pread(self.file_paths[file_idx], segment_read_length, segment_offset))
             except FileNotFoundError:
                 logging.error(f"File not found: {self.file_paths[file_idx]}")
-                return
+                return None
             except IOError as e:
                 logging.error(f"I/O error occurred while reading piece {index}: {e}")
-                return
+                return None
+        return data
 
-        # Kiểm tra đủ dữ liệu đọc được
-        if len(data) != length:
-            logging.error(f"Expected to read {length} bytes, but read {len(data)} bytes for piece {index}.")
-            return
-
-        # Gửi block đã hoàn thành cho peer
-        msg = Message.format_piece(index, begin, data)
-        communicator.conn.send(msg.serialize())
-        logging.debug(f"Uploaded block {begin}-{begin + length} of piece {index} to {communicator.peer}")
-
-    def add_peer(self, peer, client_socket):
+    def add_peer(self, peer, client_socket, deadline=None, handshake=None):
         """
         Thêm một peer vào danh sách và bắt đầu thread để xử lý tải lên cho peer này.
         :param peer: Đối tượng Peer muốn kết nối.
         :param client_socket: Socket đã được chấp nhận từ peer.
+        :param deadline: Mốc time.monotonic() phải xong handshake và bitfield/extended handshake;
+                         quá hạn thì ném socket.timeout. None: mỗi lần đọc chờ tối đa PEER_TIMEOUT.
+        :param handshake: Handshake peer đã gửi, nếu server đã đọc để chọn torrent; None thì đọc ở đây.
         """
         flag_extension = False
-        max_index = max(self.pieces.keys()) + 1
-        bitfield_array = bytearray((max_index + 7) // 8)  # Create a bytearray to hold the bitfield
-        bitfield = Bitfield(bitfield_array)
-
-        for i in self.pieces.keys():
-            bitfield.set_piece(i)
-        communicator = Communicator(peer, self.peer_id, self.info_hash, bitfield.bitfield, client_socket,expected_pieces=len(self.metadata), metadata=self.metadata)
+        communicator = Communicator(peer, self.peer_id, self.info_hash, self.make_bitfield(), client_socket,expected_pieces=len(self.metadata), metadata=self.metadata)
+        client_socket.settimeout(time_left(deadline))
         communicator.send_handshake()  # Gửi handshake tới peer
         # manual recieve handshake, check extension bittorrent
         try:
-            msg = Handshake.read(communicator.conn)
+            msg = handshake if handshake is not None else communicator.reader.read_handshake()
             if msg.info_hash != self.info_hash:
                 raise ValueError(f"Expected infohash {self.info_hash.hex()} but got {msg.info_hash.hex()}")
             logging.debug("Received valid handshake response")
@@ -161,41 +282,139 @@ class UploadingManager:
             logging.error(f"Error during handshake with peer {peer}: {e}")
             raise e
         if flag_extension is False:
-            communicator.recv_bitfield()
+            if not communicator.recv_bitfield(timeout=time_left(deadline)):
+                raise ValueError(f"Did not receive bitfield from {peer}")
             communicator.send_bitfield()  # Gửi bitfield của client tới peer
             logging.info(f"Received bitfield from {communicator.peer}")
-            threading.Thread(target=self.handle_peer_requests, args=(communicator,)).start()
+            target = self.handle_peer_requests
         else:
             communicator.send_extended_handshake()
-            communicator.recv_extended_handshake()  # Nhận extended handshake từ peer
+            client_socket.settimeout(time_left(deadline))
+            if not communicator.recv_extended_handshake():  # Nhận extended handshake từ peer
+                raise ValueError(f"Did not receive extended handshake from {peer}")
             logging.info(f"Received extended handshake from {communicator.peer}")
-            threading.Thread(target=self.handle_peer_request_metadata, args=(communicator,)).start()
-        self.peers[peer] = communicator
+            target = self.handle_peer_request_metadata
+        client_socket.settimeout(PEER_TIMEOUT)
+        with self.lock:
+            self.peers[peer] = communicator
+        threading.Thread(target=target, args=(communicator,)).start()
+
+    def make_bitfield(self):
+        """Bitfield các mảnh client có, để gửi cho peer."""
+        max_index = max(self.pieces.keys()) + 1
+        bitfield = Bitfield(bytearray((max_index + 7) // 8))
+        for i in self.pieces.keys():
+            bitfield.set_piece(i)
+        return bitfield.bitfield
+
+    def track_peer(self, peer, connection, requests):
+        """Ghi nhận kết nối `connection` của peer cùng hàng đợi request của nó và báo cho choker."""
+        with self.lock:
+            self.peers[peer] = connection
+            self.request_queues[peer] = requests
+        self.choker.add_peer(peer)
+
+    def untrack_peer(self, peer, connection):
+        with self.lock:
+            if self.peers.get(peer) is connection:
+                del self.peers[peer]
+            self.request_queues.pop(peer, None)
+        self.choker.remove_peer(peer)
+
+    def remove_peer(self, communicator):
+        """Bỏ peer khỏi danh sách và đóng kết nối."""
+        self.untrack_peer(communicator.peer, communicator)
+        communicator.close_connection()
+
+    def stop(self):
+        """Dừng các vòng choke, việc đọc trước và việc phục vụ các peer đang kết nối của torrent này."""
+        self.stopped.set()
+        self.choke_timer.remove(self.choker)
+        if self.own_choke_timer:
+            self.choke_timer.stop()
+        self.prefetcher.stop()
+
+    def pending_requests(self):
+        """Số request đang chờ gửi của từng peer."""
+        with self.lock:
+            return {peer: len(requests) for peer, requests in self.request_queues.items()}
 
     def handle_peer_requests(self, communicator):
         """
         Xử lý yêu cầu tải lên từ một peer cụ thể.
+        Request được xếp hàng và mọi thông điệp đã đến được đọc trước khi gửi block kế tiếp,
+        nhờ vậy Cancel (ví dụ từ endgame của leecher) xoá được block chưa gửi.
+        Mỗi peer có luồng và hàng đợi riêng, đọc đĩa và gửi không qua khoá chung, nên một
+        leecher chậm chỉ làm chậm luồng của chính nó.
         """
-        while True:
+        requests = deque()  # Các request (index, begin, length) chưa gửi, theo thứ tự nhận
+        self.track_peer(communicator.peer, communicator, requests)
+        try:
+            self.serve_requests(communicator, requests)
+        finally:
+            self.remove_peer(communicator)
+
+    def serve_requests(self, communicator, requests):
+        """
+        Vòng lặp đọc thông điệp của peer và gửi các block trong hàng đợi `requests`.
+        Trạng thái choke do choker quyết định được gửi từ chính luồng này.
+        """
+        unchoked = False  # Trạng thái đã báo cho peer; peer bắt đầu ở trạng thái bị choke
+        while not self.stopped.is_set():
             try:
-                message = communicator.read()  # Đọc thông điệp từ peer
+                if self.choker.is_unchoked(communicator.peer) != unchoked:
+                    unchoked = not unchoked
+                    if unchoked:
+                        communicator.send_unchoke()
+                        logging.debug(f"Unchoked {communicator.peer}")
+                    else:
+                        communicator.send_choke()
+                        requests.clear()  # Choke huỷ mọi request đang chờ
+                        logging.debug(f"Choked {communicator.peer}")
+
+                if requests and not communicator.reader.has_message() and not select.select([communicator.conn], [], [], 0)[0]:
+                    index, begin, length = requests.popleft()
+                    # Gửi mảnh nếu client có mảnh được yêu cầu
+                    if index in self.pieces:
+                        self.upload_piece(communicator, index, begin, length)
+                        logging.debug(f"Uploaded piece {index} to {communicator.peer}")
+                    else:
+                        logging.warning(f"Requested piece {index} not available for upload")
+                    continue
+                if not requests and not communicator.reader.has_message() and not select.select([communicator.conn], [], [], CHOKE_POLL)[0]:
+                    continue  # Chưa có gì để đọc, xem lại trạng thái choke
+
+                message, err = communicator.reader.read()  # Đọc thông điệp từ peer
+                if isinstance(err, TimeoutError):
+                    continue
+                if err:
+                    logging.error(f"Error reading from {communicator.peer}: {err}")
+                    break
                 if message is None:
                     continue
 
                 # Nếu nhận được yêu cầu tải lên
                 if message.ID == MessageID.MsgRequest:
-                    index, begin, length = struct.unpack('>III', message.Payload)
+                    index, begin, length = Message.parse_request(message)
                     logging.debug(f"Received request for piece {index} from {communicator.peer}")
-
-                    # Gửi mảnh nếu client có mảnh được yêu cầu
-                    with self.lock:
-                        if index in self.pieces:
-                            self.upload_piece(communicator, index, begin, length)
-                            logging.debug(f"Uploaded piece {index} to {communicator.peer}")
-                        else:
-                            logging.warning(f"Requested piece {index} not available for upload")
+                    if not unchoked:
+                        logging.debug(f"Ignoring request from choked peer {communicator.peer}")
+                        continue
+                    if len(requests) >= REQQ:
+                        # Peer gửi quá số request đã quảng bá trong extended handshake
+                        logging.warning(f"Dropping request for piece {index} from {communicator.peer}: queue full")
+                        continue
+                    requests.append((index, begin, length))
+                    self.prefetcher.on_request(index)
+                elif message.ID == MessageID.MsgCancel:
+                    request = Message.parse_request(message)
+                    try:
+                        requests.remove(request)
+                        logging.debug(f"Cancelled request {request} from {communicator.peer}")
+                    except ValueError:
+                        pass  # Block đã được gửi
                 elif message.ID == MessageID.MsgInterested:
-                    communicator.send_unchoke()  # Gửi thông điệp Unchoke
+                    self.choker.set_interested(communicator.peer, True)  # Unchoke ngay nếu còn slot
                 elif message.ID == MessageID.MsgChoke:
                     logging.info(f"Peer {communicator.peer} has choked us")
                     break  # Dừng khi bị choked
@@ -204,11 +423,12 @@ class UploadingManager:
                     logging.info(f"Peer {communicator.peer} has unchoked us")
 
                 elif message.ID == MessageID.MsgHave:
-                    piece_index = struct.unpack('>I', message.Payload)[0]
+                    piece_index = Message.parse_have(message)
                     logging.info(f"Peer {communicator.peer} has piece {piece_index}")
 
                 elif message.ID == MessageID.MsgNotInterested:
                     logging.info(f"Peer {communicator.peer} is not interested")
+                    self.choker.set_interested(communicator.peer, False)
                     communicator.send_choke()  # Gửi lại thông điệp Unchoke
                     break
             except Exception as e:
@@ -220,15 +440,21 @@ class UploadingManager:
         Xử lý yêu cầu metadata từ một peer cụ thể.
         """
         logging.info(f"Handling metadata request from {communicator.peer}")
-        while True:
+        metadata_done = False
+        while not self.stopped.is_set():
             try:
-                message = communicator.read()  # Đọc thông điệp từ peer
+                message, err = communicator.reader.read()  # Đọc thông điệp từ peer
+                if isinstance(err, TimeoutError):
+                    continue
+                if err:
+                    logging.error(f"Error reading from {communicator.peer}: {err}")
+                    break
                 if message is None:
-                    continue    
+                    continue
                 msg_type, payload = Message.parse_extended(message)
                 # logging.debug(f"msg_type: {msg_type} with payload: {payload}")
                 if msg_type == 0:  # Metadata request
-                    piece_index = bencodepy.decode(payload)[b'piece']
+                    piece_index = Message.parse_metadata_request(payload)
                     if piece_index < len(self.metadata):
                         communicator.send_metadata_piece(piece_index)
                     else:
@@ -245,9 +471,18 @@ class UploadingManager:
                     logging.warning(f"Metadata request for piece {piece_index} was rejected")
                 elif msg_type == 3:
                     logging.info("Peer has all metadata")
+                    metadata_done = True
                     if Message.parse_metadata_response_type_3(message) == len(self.metadata):
                         break
                     break
             except Exception as e:
                 logging.error(f"Error handling peer request: {e}")
                 break
+
+        # Peer có thể giữ kết nối này để tải dữ liệu luôn, thay vì kết nối lại
+        if metadata_done and not self.stopped.is_set() and communicator.recv_bitfield():
+            communicator.send_bitfield()
+            logging.info(f"Continuing with piece requests from {communicator.peer} on the metadata connection")
+            self.handle_peer_requests(communicator)
+        else:
+            self.remove_peer(communicator)
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tracker')))
+from client_list import ClientList, compact_peer
+
+INFO_HASH = b'a' * 20
+OTHER_HASH = b'b' * 20
+
+
+class ClientListTest(unittest.TestCase):
+    def setUp(self):
+        self.clients = ClientList(peer_ttl=100, tick=10)
+
+    def announce(self, peer_id, port, left, event='started', info_hash=INFO_HASH):
+        self.clients.update_peer(info_hash, peer_id, '10.0.0.1', port, 0, 0, left, event)
+
+    def assert_compact_matches_peers(self, info_hash=INFO_HASH):
+        peers = self.clients.peers.get(info_hash, {})
+        ids = self.clients.compact_ids.get(info_hash, [])
+        blob = self.clients.compact.get(info_hash, b'')
+        self.assertEqual(sorted(ids), sorted(peers))
+        for peer_id, info in peers.items():
+            slot = info['slot']
+            self.assertEqual(ids[slot], peer_id)
+            self.assertEqual(bytes(blob[slot * 6:slot * 6 + 6]), compact_peer(info['ip'], info['port']))
+
+    def test_counters_follow_state_changes(self):
+        self.announce('p1', 6881, 100)
+        self.announce('p2', 6882, 0, 'completed')
+        self.assertEqual((self.clients.get_complete_count(INFO_HASH), self.clients.get_incomplete_count(INFO_HASH)), (1, 1))
+        self.announce('p1', 6881, 0, 'completed')
+        self.announce('p1', 6881, 0, None)  # Announce định kỳ không đếm lại lượt tải
+        self.assertEqual(self.clients.get_scrape_info(INFO_HASH)[INFO_HASH],
+                         {b'complete': 2, b'incomplete': 0, b'downloaded': 2})
+        self.clients.remove_peer(INFO_HASH, 'p2')
+        self.clients.remove_peer(INFO_HASH, 'p1')
+        # Swarm trống nhưng số lượt tải vẫn được giữ
+        self.assertEqual(self.clients.get_scrape_info(INFO_HASH)[INFO_HASH],
+                         {b'complete': 0, b'incomplete': 0, b'downloaded': 2})
+
+    def test_invalid_port_leaves_state_unchanged(self):
+        self.announce('p1', 6881, 0)
+        with self.assertRaises(OverflowError):
+            self.announce('p2', 70000, 0)
+        self.assertEqual(self.clients.get_complete_count(INFO_HASH), 1)
+        self.assertEqual(list(self.clients.peers[INFO_HASH]), ['p1'])
+
+    def test_remove_swaps_last_peer_into_slot(self):
+        for i in range(5):
+            self.announce(f'p{i}', 7000 + i, 10)
+        self.clients.remove_peer(INFO_HASH, 'p1')
+        self.assertEqual(self.clients.peers[INFO_HASH]['p4']['slot'], 1)
+        self.assert_compact_matches_peers()
+        self.clients.remove_peer(INFO_HASH, 'p4')  # Peer cuối buffer
+        self.announce('p0', 7100, 10)  # Đổi port giữ nguyên slot
+        self.assert_compact_matches_peers()
+        self.assertEqual(len(self.clients.get_peers(INFO_HASH)), 3 * 6)
+
+    def test_get_peers_excludes_caller_and_honours_numwant(self):
+        for i in range(10):
+            self.announce(f'p{i}', 7000 + i, 10)
+        peers = self.clients.get_peers(INFO_HASH, 'p3')
+        self.assertEqual(len(peers), 9 * 6)
+        self.assertNotIn(compact_peer('10.0.0.1', 7003), [peers[i:i + 6] for i in range(0, len(peers), 6)])
+        self.assertEqual(len(self.clients.get_peers(INFO_HASH, 'p3', numwant=4)), 4 * 6)
+
+    def test_remove_peer_from_all_only_touches_its_swarms(self):
+        self.announce('p1', 6881, 0)
+        self.announce('p1', 6881, 10, info_hash=OTHER_HASH)
+        self.announce('p2', 6882, 10, info_hash=OTHER_HASH)
+        self.clients.remove_peer_from_all('p1')
+        self.assertNotIn(INFO_HASH, self.clients.peers)
+        self.assertEqual(list(self.clients.peers[OTHER_HASH]), ['p2'])
+        self.assertNotIn('p1', self.clients.swarms)
+        self.assert_compact_matches_peers(OTHER_HASH)
+
+    def test_reap_expires_silent_peers(self):
+        now = time.monotonic()
+        self.announce('quiet', 6881, 0)
+        self.announce('active', 6882, 10)
+        self.assertEqual(self.clients.reap(now + 60), 0)
+        with mock.patch('client_list.time.monotonic', return_value=now + 60):
+            self.announce('active', 6882, 10, None)  # Announce lại đẩy hạn ra thêm peer_ttl
+        self.assertEqual(self.clients.reap(now + 130), 1)
+        self.assertEqual(list(self.clients.peers[INFO_HASH]), ['active'])
+        self.assertEqual(self.clients.get_complete_count(INFO_HASH), 0)
+        self.assertEqual(self.clients.expired, 1)
+
+    def test_removed_peer_is_not_reaped_again(self):
+        now = time.monotonic()
+        self.announce('p1', 6881, 0)
+        self.clients.remove_peer(INFO_HASH, 'p1')
+        self.assertEqual(self.clients.reap(now + 1000), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
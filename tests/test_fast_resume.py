@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import struct
+import hashlib
+import tempfile
+import unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from p2p.fast_resume import FastResume
+from p2p.message import Message, MessageID
+from p2p.piece import Piece
+from p2p.piece_picker import PiecePicker
+from p2p.piece_writer import PieceWriter
+from p2p.request_pipeline import PieceProgress
+
+PIECE_LENGTH = 32768
+INFO_HASH = b'i' * 20
+
+
+class FastResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data = os.urandom(4 * PIECE_LENGTH + 100)
+        self.pieces = [Piece(i // PIECE_LENGTH, len(self.data[i:i + PIECE_LENGTH]), hashlib.sha1(self.data[i:i + PIECE_LENGTH]).digest())
+                       for i in range(0, len(self.data), PIECE_LENGTH)]
+        self.files = [{'path': ['data.bin'], 'length': len(self.data)}]
+        self.resume_dir = os.path.join(self.tmp.name, 'resume')
+        self.writer = self.make_writer()
+        self.writer.prepare_files()
+        self.picker = PiecePicker(self.pieces)
+
+    def make_writer(self):
+        return PieceWriter(os.path.join(self.tmp.name, 'download'), self.files, PIECE_LENGTH)
+
+    def piece_data(self, index):
+        return self.data[index * PIECE_LENGTH:(index + 1) * PIECE_LENGTH]
+
+    def complete(self, index):
+        self.writer.write_piece(index, self.piece_data(index))
+        self.picker.restore({index})
+
+    def load(self, writer=None):
+        return FastResume(INFO_HASH, self.resume_dir).load(writer or self.make_writer(), self.pieces)
+
+    def test_round_trip(self):
+        self.complete(0)
+        self.complete(2)
+        progress = PieceProgress(self.pieces[1])
+        self.picker.progress[1] = progress
+        progress.add_block(Message(message_id=MessageID.MsgPiece, payload=struct.pack('>II', 1, 0) + self.piece_data(1)[:16384]))
+        FastResume(INFO_HASH, self.resume_dir).save(self.writer, self.picker)
+
+        completed, partial = self.load()
+        self.assertEqual(completed, {0, 2})
+        self.assertEqual([(p.piece.index, p.received, p.downloaded) for p in partial], [(1, {0}, 16384)])
+        self.assertEqual(bytes(partial[0].buffer[:16384]), self.piece_data(1)[:16384])
+
+    def test_missing_file_starts_empty(self):
+        self.assertEqual(self.load(), (set(), []))
+
+    def test_writes_after_last_save_only_recheck_recorded_pieces(self):
+        self.complete(0)
+        FastResume(INFO_HASH, self.resume_dir).save(self.writer, self.picker)
+        time.sleep(0.01)
+        self.writer.write_piece(3, self.piece_data(3))  # Ghi sau lần lưu cuối rồi bị tắt đột ngột
+
+        writer = self.make_writer()
+        checked = []
+        verify_piece = writer.verify_piece
+        writer.verify_piece = lambda index, piece_hash: checked.append(index) or verify_piece(index, piece_hash)
+        completed, _ = self.load(writer)
+        self.assertEqual(completed, {0})
+        self.assertEqual(checked, [0])
+
+    def test_size_change_rechecks_every_piece(self):
+        self.complete(0)
+        self.complete(1)
+        FastResume(INFO_HASH, self.resume_dir).save(self.writer, self.picker)
+        os.truncate(self.writer.file_paths[0], PIECE_LENGTH + 10)  # Mảnh 1 bị cắt mất
+        completed, partial = self.load()
+        self.assertEqual(completed, {0})
+        self.assertEqual(partial, [])
+
+    def test_corrupt_resume_file_rechecks(self):
+        self.complete(2)
+        resume = FastResume(INFO_HASH, self.resume_dir)
+        resume.save(self.writer, self.picker)
+        with open(resume.path, 'wb') as f:
+            f.write(b'not bencode')
+        completed, _ = self.load()
+        self.assertEqual(completed, {2})
+
+    def test_timer_saves_until_stopped(self):
+        self.complete(1)
+        resume = FastResume(INFO_HASH, self.resume_dir, save_interval=0.05)
+        resume.start(self.writer, self.picker)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(resume.path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        resume.stop()
+        self.assertIsNone(resume.timer)
+        self.assertEqual(self.load()[0], {1})
+
+
+if __name__ == '__main__':
+    unittest.main()
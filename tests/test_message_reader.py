@@ -0,0 +1,101 @@
+import os
+import sys
+import socket
+import struct
+import unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from p2p.message import Message, MessageID, MAX_BLOCK_SIZE, MAX_PIECE_MESSAGE, MAX_CONTROL_MESSAGE
+from p2p.message_reader import MessageReader
+
+
+class ChunkedConn:
+    """Socket giả: trả dữ liệu theo từng khối cho trước, ném socket.timeout khi gặp None."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, view):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        if chunk is None:
+            raise socket.timeout()
+        count = min(len(chunk), len(view))
+        view[:count] = chunk[:count]
+        if count < len(chunk):
+            self.chunks.insert(0, chunk[count:])
+        return count
+
+
+def piece_message(index, begin, data):
+    return Message(message_id=MessageID.MsgPiece, payload=struct.pack('>II', index, begin) + data).serialize()
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class MessageReaderTest(unittest.TestCase):
+    def test_reads_messages_split_across_recvs(self):
+        data = (Message(message_id=MessageID.MsgHave, payload=struct.pack('>I', 7)).serialize()
+                + piece_message(1, 16384, b'x' * MAX_BLOCK_SIZE)
+                + Message(message_id=MessageID.MsgUnchoke).serialize())
+        reader = MessageReader(ChunkedConn(split(data, 3)), buffer_size=64)
+        have, err = reader.read()
+        self.assertIsNone(err)
+        self.assertEqual(Message.parse_have(have), 7)
+        piece, err = reader.read()
+        self.assertEqual(piece.ID, MessageID.MsgPiece)
+        self.assertEqual(bytes(piece.Payload[8:]), b'x' * MAX_BLOCK_SIZE)
+        unchoke, err = reader.read()
+        self.assertEqual(unchoke.ID, MessageID.MsgUnchoke)
+
+    def test_read_messages_returns_everything_buffered(self):
+        data = b''.join(Message(message_id=MessageID.MsgHave, payload=struct.pack('>I', i)).serialize() for i in range(5))
+        reader = MessageReader(ChunkedConn([data]))
+        messages, err = reader.read_messages()
+        self.assertIsNone(err)
+        self.assertEqual([Message.parse_have(msg) for msg in messages], list(range(5)))
+        self.assertEqual(reader.recv_calls, 1)
+
+    def test_keep_alive(self):
+        reader = MessageReader(ChunkedConn([b'\0\0\0\0']))
+        self.assertEqual(reader.read(), (None, None))
+
+    def test_timeout_keeps_partial_message(self):
+        data = Message(message_id=MessageID.MsgHave, payload=struct.pack('>I', 3)).serialize()
+        reader = MessageReader(ChunkedConn([data[:6], None, data[6:]]))
+        msg, err = reader.read()
+        self.assertIsInstance(err, TimeoutError)
+        msg, err = reader.read()  # Luồng byte không bị lệch sau timeout
+        self.assertIsNone(err)
+        self.assertEqual(Message.parse_have(msg), 3)
+
+    def test_rejects_oversized_piece_before_buffering(self):
+        header = struct.pack('>IB', MAX_PIECE_MESSAGE + 1, MessageID.MsgPiece)
+        reader = MessageReader(ChunkedConn([header]), buffer_size=64)
+        msg, err = reader.read()
+        self.assertIsNone(msg)
+        self.assertIsInstance(err, ValueError)
+        self.assertEqual(len(reader.buffer), 64)  # Buffer không bị mở rộng theo độ dài peer gửi
+
+    def test_rejects_oversized_control_message(self):
+        data = struct.pack('>IB', MAX_CONTROL_MESSAGE + 1, MessageID.MsgHave) + b'\0' * MAX_CONTROL_MESSAGE
+        msg, err = MessageReader(ChunkedConn([data])).read()
+        self.assertIsInstance(err, ValueError)
+
+    def test_read_messages_stops_at_oversized_message(self):
+        good = Message(message_id=MessageID.MsgHave, payload=struct.pack('>I', 1)).serialize()
+        bad = struct.pack('>IB', 40, MessageID.MsgRequest) + b'\0' * 39
+        messages, err = MessageReader(ChunkedConn([good + good + bad])).read_messages()
+        self.assertEqual(len(messages), 2)
+        self.assertIsInstance(err, ValueError)
+
+    def test_closed_connection(self):
+        msg, err = MessageReader(ChunkedConn([b'\0\0'])).read()
+        self.assertIsNone(msg)
+        self.assertIsInstance(err, ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
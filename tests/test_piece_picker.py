@@ -0,0 +1,93 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from p2p.bitfield import Bitfield
+from p2p.piece import Piece
+from p2p.piece_picker import PiecePicker
+
+
+def make_bitfield(count, indexes):
+    bitfield = Bitfield(bytearray((count + 7) // 8))
+    for index in indexes:
+        bitfield.set_piece(index)
+    return bitfield
+
+
+class PiecePickerTest(unittest.TestCase):
+    def setUp(self):
+        self.pieces = [Piece(i, 16384, b'\0' * 20) for i in range(4)]
+        self.picker = PiecePicker(self.pieces, random_first=0)
+
+    def test_picks_rarest_piece(self):
+        everyone = make_bitfield(4, range(4))
+        self.picker.add_peer(everyone)
+        self.picker.add_peer(make_bitfield(4, [0, 1, 3]))
+        self.picker.add_peer(make_bitfield(4, [0, 1, 2]))
+        # Mảnh 2 và 3 chỉ có ở hai peer, mảnh 0 và 1 ở ba peer
+        first = self.picker.pick(everyone, block=False)
+        second = self.picker.pick(everyone, block=False)
+        self.assertEqual({first.piece.index, second.piece.index}, {2, 3})
+
+    def test_only_picks_pieces_the_peer_has(self):
+        peer = make_bitfield(4, [1])
+        self.picker.add_peer(peer)
+        self.assertEqual(self.picker.pick(peer, block=False).piece.index, 1)
+        self.assertIsNone(self.picker.pick(peer, block=False))
+
+    def test_have_updates_availability(self):
+        peer = make_bitfield(4, [0])
+        self.picker.add_peer(peer)
+        self.picker.peer_has(peer, 3)
+        self.picker.peer_has(peer, 3)  # Have trùng lặp không được đếm hai lần
+        self.assertEqual(self.picker.availability, [1, 0, 0, 1])
+        self.picker.remove_peer(peer)
+        self.assertEqual(self.picker.availability, [0, 0, 0, 0])
+
+    def test_endgame_shares_in_flight_pieces(self):
+        slow = make_bitfield(4, range(4))
+        fast = make_bitfield(4, range(4))
+        self.picker.add_peer(slow)
+        self.picker.add_peer(fast)
+        taken = {}
+        for _ in range(4):
+            progress = self.picker.pick(slow, block=False)
+            taken[progress.piece.index] = progress
+        self.assertTrue(self.picker.in_endgame())
+
+        duplicate = self.picker.pick(fast, block=False, exclude={0, 1, 2})
+        self.assertIs(duplicate, taken[3])  # Cùng PieceProgress với peer chậm
+        self.assertEqual(self.picker.in_flight[3], 2)
+
+        # Một peer thôi tải: mảnh vẫn đang được peer kia tải nên không quay lại hàng đợi
+        self.picker.release(duplicate)
+        self.assertEqual(self.picker.in_flight[3], 1)
+        self.assertNotIn(3, self.picker.pending)
+
+    def test_endgame_skips_pieces_already_received(self):
+        peer = make_bitfield(4, range(4))
+        self.picker.add_peer(peer)
+        taken = sorted((self.picker.pick(peer, block=False) for _ in range(4)), key=lambda progress: progress.piece.index)
+        for progress in taken[:3]:
+            self.picker.complete(progress)
+        taken[3].done = True  # Block cuối đã nhận, đang kiểm tra SHA-1
+        self.assertIsNone(self.picker.pick(peer, block=False))
+
+    def test_release_requeues_piece(self):
+        peer = make_bitfield(4, [2])
+        self.picker.add_peer(peer)
+        progress = self.picker.pick(peer, block=False)
+        self.picker.release(progress)
+        self.assertIn(2, self.picker.pending)
+        self.assertIs(self.picker.pick(peer, block=False), progress)  # Dữ liệu đã nhận được giữ lại
+
+    def test_restore_skips_completed_pieces(self):
+        self.picker.restore({0, 1, 2})
+        peer = make_bitfield(4, range(4))
+        self.picker.add_peer(peer)
+        self.assertEqual(self.picker.pick(peer, block=False).piece.index, 3)
+        self.assertFalse(self.picker.is_finished())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from p2p.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('p2p.rate_limiter.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        bucket = TokenBucket()
+        self.assertEqual(bucket.reserve(10 ** 9), 0)
+        self.assertEqual(bucket.consumed, 10 ** 9)
+
+    def test_burst_then_debt(self):
+        bucket = TokenBucket(rate=1000)
+        self.assertEqual(bucket.reserve(1000), 0)  # Burst mặc định bằng lượng của một giây
+        self.assertAlmostEqual(bucket.reserve(500), 0.5)
+        self.assertAlmostEqual(bucket.reserve(500), 1.0)  # Người đến sau chờ sau người trước
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=1000, burst=2000)
+        bucket.reserve(2000)
+        self.clock.now += 1
+        self.assertEqual(bucket.reserve(1000), 0)
+        self.clock.now += 60  # Để lâu cũng chỉ tích luỹ tối đa `burst`
+        self.assertEqual(bucket.reserve(2000), 0)
+        self.assertAlmostEqual(bucket.reserve(1000), 1.0)
+
+    def test_parent_limits_child(self):
+        parent = TokenBucket(rate=1000)
+        child = TokenBucket(parent=parent)
+        self.assertEqual(child.reserve(1000), 0)
+        self.assertAlmostEqual(child.reserve(1000), 1.0)
+        self.assertEqual(parent.consumed, 2000)
+
+    def test_slower_of_child_and_parent_wins(self):
+        parent = TokenBucket(rate=10000)
+        child = TokenBucket(rate=1000, parent=parent)
+        child.reserve(1000)
+        self.assertAlmostEqual(child.reserve(2000), 2.0)
+
+    def test_siblings_share_parent(self):
+        parent = TokenBucket(rate=1000)
+        first, second = TokenBucket(parent=parent), TokenBucket(parent=parent)
+        first.reserve(1000)
+        self.assertAlmostEqual(second.reserve(500), 0.5)
+
+    def test_set_rate_while_running(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.reserve(1000)
+        bucket.set_rate(None)
+        self.assertEqual(bucket.reserve(10 ** 6), 0)
+
+    def test_consume_async_sleeps_for_delay(self):
+        bucket = TokenBucket(rate=1000)
+        bucket.reserve(1000)
+        with mock.patch('p2p.rate_limiter.asyncio.sleep') as sleep:
+            asyncio.run(bucket.consume_async(250))
+        sleep.assert_awaited_once()
+        self.assertAlmostEqual(sleep.call_args[0][0], 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tracker')))
+from timer_wheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(tick=10, slots=8)
+
+    def test_expires_at_first_tick_not_before_deadline(self):
+        self.wheel.schedule('a', 25)
+        self.assertEqual(self.wheel.advance(29), [])
+        self.assertEqual(self.wheel.advance(30), ['a'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancel(self):
+        self.wheel.schedule('a', 15)
+        self.wheel.schedule('b', 15)
+        self.wheel.cancel('a')
+        self.wheel.cancel('missing')
+        self.assertEqual(self.wheel.advance(100), ['b'])
+
+    def test_reschedule_moves_key(self):
+        self.wheel.schedule('a', 15)
+        self.wheel.schedule('a', 45)
+        self.assertEqual(self.wheel.advance(30), [])
+        self.assertEqual(self.wheel.advance(50), ['a'])
+
+    def test_deadline_in_the_past_expires_on_next_tick(self):
+        self.wheel.advance(100)
+        self.wheel.schedule('a', 5)
+        self.assertEqual(self.wheel.advance(109), [])
+        self.assertEqual(self.wheel.advance(110), ['a'])
+
+    def test_deadline_beyond_one_rotation(self):
+        self.wheel.schedule('far', 200)  # Hơn slots * tick = 80 giây
+        self.wheel.schedule('near', 20)
+        self.assertEqual(self.wheel.advance(100), ['near'])
+        self.assertEqual(self.wheel.advance(190), [])
+        self.assertEqual(self.wheel.advance(200), ['far'])
+
+    def test_long_gap_between_advances(self):
+        for i in range(20):
+            self.wheel.schedule(i, 10 * i + 5)
+        self.assertEqual(sorted(self.wheel.advance(1000)), list(range(20)))
+        self.assertEqual(len(self.wheel), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import sys
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+from tracker_routes import TrackerError, handle_request
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+
+LISTEN_BACKLOG = 1024  # Số kết nối chờ accept tối đa trong hàng đợi của kernel
+MAX_CONNECTIONS = 10000  # Số kết nối HTTP mở cùng lúc tối đa, kết nối vượt quá bị đóng ngay
+KEEPALIVE_TIMEOUT = 15  # Thời gian (giây) giữ kết nối keep-alive không có request
+PING_WORKERS = 16  # Số luồng chạy /ping (kết nối ra client nên có thể chặn tới 5 giây)
+MAX_LINE = 8192  # Độ dài tối đa của request line, mỗi header và body
+MAX_HEADERS = 100  # Số header tối đa của một request
+STOP_POLL = 0.5  # Chu kỳ kiểm tra stop_event (giây)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTrackerServer:
+    """
+    Front-end HTTP của tracker chạy trên một event loop asyncio, thay cho một luồng cho mỗi request.
+
+    Kết nối HTTP/1.1 được giữ (keep-alive) và các request gửi liên tiếp không chờ response
+    (pipelining) được xử lý lần lượt, trả lời đúng thứ tự. /announce và /scrape chỉ thao tác
+    ClientList trong bộ nhớ nên chạy ngay trên event loop, không cần lock; /ping phải chờ client
+    nên chạy trong `ping_workers` luồng cố định. Route và ClientList dùng chung với engine thread.
+    Peer không còn announce được xoá bởi một task chạy ClientList.reap trên cùng event loop.
+    """
+
+    def __init__(self, client_list, port, host='', backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, ping_workers=PING_WORKERS):
+        self.client_list = client_list
+        self.port = port
+        self.host = host
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=ping_workers, thread_name_prefix='tracker-ping')
+        self.connections = 0
+        self.requests = 0
+        self.rejected = 0
+        self.writers = set()  # Kết nối đang mở, đóng hết khi dừng server
+
+    def run(self, stop_event):
+        """Chạy server (chặn luồng gọi) cho đến khi `stop_event` được set."""
+        asyncio.run(self.serve(stop_event))
+
+    async def serve(self, stop_event):
+        # Như ThreadingHTTPServer: host rỗng là mọi địa chỉ IPv4, vì danh sách peer compact chỉ chứa IPv4
+        server = await asyncio.start_server(self.handle_connection, self.host or '0.0.0.0', self.port,
+                                            backlog=self.backlog, reuse_address=True, limit=MAX_LINE)
+        logger.info(f"Starting asyncio tracker server on port {self.port}")
+        print(f"Starting asyncio tracker server on port {self.port}")
+        reaper = asyncio.create_task(self.reap_peers())
+        try:
+            while not stop_event.is_set():
+                await asyncio.sleep(STOP_POLL)
+        finally:
+            reaper.cancel()
+            server.close()
+            for writer in list(self.writers):
+                writer.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            logger.info("Tracker server stopped.")
+            print("Tracker server stopped.")
+
+    async def reap_peers(self):
+        while True:
+            await asyncio.sleep(self.client_list.expiry.tick)
+            expired = self.client_list.reap()
+            if expired:
+                logger.info(f"Expired {expired} peers that stopped announcing")
+
+    async def handle_connection(self, reader, writer):
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            writer.close()
+            return
+        self.connections += 1
+        self.writers.add(writer)
+        client_ip = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), timeout=self.keepalive_timeout)
+                except TrackerError as e:
+                    writer.write(self.format_response(e.status, e.message.encode(), False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, keep_alive = request
+                self.requests += 1
+                status, body = await self.dispatch(method, path, client_ip)
+                writer.write(self.format_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.debug(f"Closing tracker connection from {client_ip}: {e!r}")
+        finally:
+            self.connections -= 1
+            self.writers.discard(writer)
+            writer.close()
+
+    async def read_request(self, reader):
+        """Đọc request line và header; trả về (method, path, keep_alive) hoặc None khi client đóng kết nối."""
+        try:
+            line = await reader.readline()
+            if not line:
+                return None
+            parts = line.decode('latin-1').split()
+            if len(parts) != 3:
+                raise TrackerError(400, "Bad request syntax")
+            method, path, version = parts
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise TrackerError(431, "Too many headers")
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip().lower()
+        except ValueError:
+            raise TrackerError(431, "Request header too long")
+        if headers.get('content-length', '0') != '0':
+            length = headers['content-length']
+            if not length.isdigit() or int(length) > MAX_LINE:
+                raise TrackerError(400, "Invalid Content-Length")
+            await reader.readexactly(int(length))  # Tracker không dùng body
+        # HTTP/1.1 mặc định giữ kết nối, HTTP/1.0 chỉ giữ khi client yêu cầu
+        connection = headers.get('connection', '')
+        keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        return method, path, keep_alive
+
+    async def dispatch(self, method, path, client_ip):
+        if method != 'GET':
+            return 501, f"Unsupported method ({method})".encode()
+        try:
+            if path.startswith("/ping"):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, handle_request, self.client_list, path, client_ip)
+            return handle_request(self.client_list, path, client_ip)
+        except TrackerError as e:
+            return e.status, e.message.encode()
+        except Exception as e:
+            # Lỗi không lường trước vẫn được trả lời, không làm rớt kết nối (và các request pipeline sau nó)
+            logger.exception(f"Error handling {path} from {client_ip}: {e}")
+            return 500, b"Internal server error"
+
+    @staticmethod
+    def format_response(status, body, keep_alive):
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: text/plain\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        return head.encode('latin-1') + body
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'expired_peers': self.client_list.expired,
+        }
@@ -1,10 +1,60 @@
+import time
+import random
+import socket
+from timer_wheel import TimerWheel
+
+DEFAULT_NUMWANT = 50  # Số peer trả về cho mỗi announce khi client không gửi numwant
+PEER_TTL = 3600  # Peer không announce lại trong thời gian này (giây, ~2 interval) bị xoá khỏi swarm
+REAP_TICK = 60  # Độ phân giải (giây) của timer wheel hết hạn peer, cũng là chu kỳ chạy reaper
+
+
+def compact_peer(ip, port):
+    """Dạng compact 6 byte của peer: địa chỉ IPv4 rồi port, big-endian."""
+    return socket.inet_aton(ip) + port.to_bytes(2, 'big')
+
+
 class ClientList:
-    def __init__(self):
+    def __init__(self, peer_ttl=PEER_TTL, tick=REAP_TICK):
         self.peers = {}
+        # info_hash -> bytearray nối liền dạng compact của mọi peer trong swarm; peer thứ i nằm ở
+        # [6i, 6i + 6) và compact_ids[info_hash][i] là peer_id của nó ("slot" trong thông tin peer)
+        self.compact = {}
+        self.compact_ids = {}
+        self.complete = {}  # info_hash -> số peer đã đủ dữ liệu (left == 0)
+        self.downloaded = {}  # info_hash -> số lần announce 'completed', giữ cả khi swarm trống
+        self.swarms = {}  # peer_id -> set các info_hash peer đang tham gia
+        self.peer_ttl = peer_ttl
+        # Hạn của từng (info_hash, peer_id); mỗi announce đẩy hạn ra thêm peer_ttl giây
+        self.expiry = TimerWheel(tick, int(peer_ttl // tick) + 2, time.monotonic())
+        self.expired = 0  # Số peer đã bị reap xoá vì không announce lại
 
     def update_peer(self, info_hash, peer_id, ip, port, uploaded, downloaded, left, event):
+        now = time.monotonic()
+        # Tính trước mọi thay đổi: ip/port sai ném lỗi khi trạng thái và bộ đếm còn nguyên
+        compact = compact_peer(ip, port)
         if info_hash not in self.peers:
             self.peers[info_hash] = {}
+            self.compact[info_hash] = bytearray()
+            self.compact_ids[info_hash] = []
+            self.complete[info_hash] = 0
+
+        peer_info = self.peers[info_hash].get(peer_id)
+        # Announce định kỳ không mang event: giữ event trước đó để không đếm lại "completed"
+        event = event or (peer_info["event"] if peer_info is not None else None)
+        # Cập nhật bộ đếm theo chuyển trạng thái của peer, không phải quét lại swarm
+        was_complete = peer_info is not None and peer_info["left"] == 0
+        self.complete[info_hash] += (left == 0) - was_complete
+        if event == "completed" and not (peer_info is not None and peer_info["event"] == "completed"):
+            self.downloaded[info_hash] = self.downloaded.get(info_hash, 0) + 1
+        if peer_info is None:
+            # Peer mới: nối vào cuối buffer của swarm
+            slot = len(self.compact_ids[info_hash])
+            self.compact[info_hash] += compact
+            self.compact_ids[info_hash].append(peer_id)
+            self.swarms.setdefault(peer_id, set()).add(info_hash)
+        else:
+            slot = peer_info["slot"]
+            self.compact[info_hash][slot * 6:slot * 6 + 6] = compact
 
         self.peers[info_hash][peer_id] = {
             "ip": ip,
@@ -12,63 +62,86 @@ class ClientList:
             "uploaded": uploaded,
             "downloaded": downloaded,
             "left": left,
-            "event": event
+            "event": event,
+            "slot": slot,
+            "last_announce": now
         }
+        self.expiry.schedule((info_hash, peer_id), now + self.peer_ttl)
 
     def remove_peer(self, info_hash, peer_id):
         if info_hash in self.peers and peer_id in self.peers[info_hash]:
-            del self.peers[info_hash][peer_id]
+            peer_info = self.peers[info_hash].pop(peer_id)
+            self.expiry.cancel((info_hash, peer_id))
+            slot = peer_info["slot"]
+            self.complete[info_hash] -= peer_info["left"] == 0
+            swarms = self.swarms[peer_id]
+            swarms.discard(info_hash)
+            if not swarms:
+                del self.swarms[peer_id]
+            # Chuyển peer cuối buffer vào chỗ trống để xoá trong O(1)
+            blob, ids = self.compact[info_hash], self.compact_ids[info_hash]
+            last = len(ids) - 1
+            if slot != last:
+                blob[slot * 6:slot * 6 + 6] = blob[last * 6:last * 6 + 6]
+                ids[slot] = ids[last]
+                self.peers[info_hash][ids[slot]]["slot"] = slot
+            del blob[last * 6:]
+            ids.pop()
             if not self.peers[info_hash]:
                 del self.peers[info_hash]
+                del self.compact[info_hash]
+                del self.compact_ids[info_hash]
+                del self.complete[info_hash]
 
-    def remove_peer_from_all(self, peer_id):
-        info_hashes_to_remove = []
-        for info_hash, peer_dict in self.peers.items():
-            if peer_id in peer_dict:
-                del peer_dict[peer_id]
-            if not peer_dict:
-                info_hashes_to_remove.append(info_hash)
+    def reap(self, now=None):
+        """Xoá các peer đã quá peer_ttl giây không announce; chỉ tốn thời gian cho peer hết hạn."""
+        expired = self.expiry.advance(time.monotonic() if now is None else now)
+        for info_hash, peer_id in expired:
+            self.remove_peer(info_hash, peer_id)
+        self.expired += len(expired)
+        return len(expired)
 
-        for info_hash in info_hashes_to_remove:
-            del self.peers[info_hash]
+    def remove_peer_from_all(self, peer_id):
+        # Chỉ duyệt các swarm của peer này, không duyệt mọi torrent của tracker
+        for info_hash in list(self.swarms.get(peer_id, ())):
+            self.remove_peer(info_hash, peer_id)
 
-    def get_peers(self, info_hash, exclude_peer_id=None):
+    def get_peers(self, info_hash, exclude_peer_id=None, numwant=DEFAULT_NUMWANT):
+        """Tối đa `numwant` peer dạng compact, chọn ngẫu nhiên khi swarm lớn hơn, bỏ qua peer của client."""
         if info_hash not in self.peers:
             return []
 
-        peers = []
-        for peer_id, peer_info in self.peers[info_hash].items():
-            if peer_id == exclude_peer_id:
-                continue  # Bỏ qua peer của client
-
-            ip_bytes = bytes(map(int, peer_info["ip"].split('.')))
-            port_bytes = peer_info["port"].to_bytes(2, 'big')
-            peers.append(ip_bytes + port_bytes)
+        blob = self.compact[info_hash]
+        count = len(self.compact_ids[info_hash])
+        exclude = self.peers[info_hash].get(exclude_peer_id)
+        skip = exclude["slot"] if exclude is not None else None
+        numwant = max(0, numwant)
+        if numwant >= count - (skip is not None):
+            if skip is None:
+                return bytes(blob)
+            return bytes(blob[:skip * 6] + blob[skip * 6 + 6:])
 
-        return b''.join(peers)
+        slots = random.sample(range(count), min(count, numwant + 1))
+        slots = [slot for slot in slots if slot != skip][:numwant]
+        return b''.join(blob[slot * 6:slot * 6 + 6] for slot in slots)
 
     def get_complete_count(self, info_hash):
-        if info_hash not in self.peers:
-            return 0
-        return sum(1 for peer in self.peers[info_hash].values() if peer["left"] == 0)
+        return self.complete.get(info_hash, 0)
 
     def get_incomplete_count(self, info_hash):
         if info_hash not in self.peers:
             return 0
-        return len(self.peers[info_hash]) - self.get_complete_count(info_hash)
+        return len(self.peers[info_hash]) - self.complete[info_hash]
 
     def get_scrape_info(self, info_hash):
-        if info_hash not in self.peers:
+        if info_hash not in self.peers and info_hash not in self.downloaded:
             return {}
 
-        complete = self.get_complete_count(info_hash)
-        incomplete = len(self.peers[info_hash]) - complete
-
         return {
             info_hash: {
-                b'complete': complete,
-                b'incomplete': incomplete,
-                b'downloaded': len(self.peers[info_hash])
+                b'complete': self.get_complete_count(info_hash),
+                b'incomplete': self.get_incomplete_count(info_hash),
+                b'downloaded': self.downloaded.get(info_hash, 0)
             }
         }
 
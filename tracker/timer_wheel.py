@@ -0,0 +1,48 @@
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: `slots` ô, mỗi ô gom các key hết hạn trong cùng một khoảng `tick` giây.
+
+    Mỗi key nằm đúng một ô; đặt lại hạn chuyển key sang ô mới và cancel xoá nó trong O(1),
+    nên advance chỉ duyệt các key thật sự đã hết hạn khi mọi hạn nằm trong một vòng quay
+    (`slots * tick` giây). Hạn xa hơn vẫn đúng, nhưng ô của nó bị duyệt qua ở các vòng trước.
+    """
+
+    def __init__(self, tick, slots, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.buckets = [set() for _ in range(slots)]
+        self.tick_of = {}  # key -> số thứ tự tick hết hạn của key
+        self.current = int(now // tick)  # Tick cuối cùng đã được advance xử lý
+
+    def schedule(self, key, deadline):
+        """Đặt (hoặc đặt lại) hạn của `key`; key hết hạn ở tick đầu tiên không sớm hơn `deadline`."""
+        self.cancel(key)
+        tick_no = max(math.ceil(deadline / self.tick), self.current + 1)
+        self.buckets[tick_no % self.slots].add(key)
+        self.tick_of[key] = tick_no
+
+    def cancel(self, key):
+        tick_no = self.tick_of.pop(key, None)
+        if tick_no is not None:
+            self.buckets[tick_no % self.slots].discard(key)
+
+    def advance(self, now):
+        """Trả về các key hết hạn từ lần advance trước tới `now`, và xoá chúng khỏi wheel."""
+        target = int(now // self.tick)
+        expired = []
+        # Lâu không được gọi (quá một vòng) thì mỗi ô chỉ cần quét một lần
+        for tick_no in range(self.current + 1, min(target, self.current + self.slots) + 1):
+            bucket = self.buckets[tick_no % self.slots]
+            due = [key for key in bucket if self.tick_of[key] <= target]
+            for key in due:
+                bucket.discard(key)
+                del self.tick_of[key]
+            expired.extend(due)
+        self.current = max(self.current, target)
+        return expired
+
+    def __len__(self):
+        return len(self.tick_of)
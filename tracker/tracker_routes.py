@@ -0,0 +1,164 @@
+import urllib.parse
+import bencodepy
+import logging
+import socket
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import logging_config
+from client_list import DEFAULT_NUMWANT
+
+TRACKER_INTERVAL = 1800  # Time between tracker updates in seconds
+
+logger = logging.getLogger(__name__)
+
+
+class TrackerError(Exception):
+    """Request không hợp lệ; `status` là mã HTTP trả về cho client."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def decode_info_hash(url_encoded_string):
+    decoded_string = bytearray()
+    i = 0
+    while i < len(url_encoded_string):
+        if url_encoded_string[i] == '%':
+            if i + 2 < len(url_encoded_string):
+                hex_value = url_encoded_string[i + 1:i + 3]
+                try:
+                    decoded_byte = int(hex_value, 16)
+                    decoded_string.append(decoded_byte)
+                except ValueError:
+                    raise ValueError(f"Invalid hex value: {hex_value}")
+                i += 3
+            else:
+                break
+        else:
+            decoded_string.append(ord(url_encoded_string[i]))
+            i += 1
+
+    if len(decoded_string) != 20:
+        raise ValueError(f"Decoded string is not a valid SHA1 hash length: {decoded_string.hex()}")
+
+    return bytes(decoded_string).hex()
+
+
+def parse_info_hash(info_hash):
+    try:
+        return bytes.fromhex(decode_info_hash(info_hash))
+    except Exception as e:
+        logger.error(f"Encoding error: {e}")
+        raise TrackerError(400, "Invalid info_hash encoding")
+
+
+def parse_params(path):
+    """Tách query của request; info_hash được giữ nguyên dạng percent-encoding để tự giải mã ra byte."""
+    query = urllib.parse.urlparse(path).query
+    info_hash = None
+    for param in query.split('&'):
+        if param.startswith('info_hash='):
+            info_hash = param.split('=')[1]
+            break
+    params = urllib.parse.parse_qs(query)
+    if info_hash is not None:
+        params['info_hash'] = [info_hash]
+    return params
+
+
+def handle_request(client_list, path, client_ip):
+    """
+    Xử lý một request GET tới `path`, dùng chung cho engine thread và asyncio.
+    Trả về (mã HTTP, body); ném TrackerError nếu request không hợp lệ.
+    /ping kết nối tới client nên có thể chặn tới 5 giây.
+    """
+    params = parse_params(path)
+    if path.startswith("/announce"):
+        return 200, handle_announce(client_list, params, client_ip)
+    elif path.startswith("/scrape"):
+        return 200, handle_scrape(client_list, params)
+    elif path.startswith("/ping"):
+        return handle_ping(params)
+    raise TrackerError(404, "Unknown request path")
+
+
+def handle_announce(client_list, params, client_ip):
+    info_hash = params.get("info_hash", [None])[0]
+    peer_id = params.get("peer_id", [None])[0]
+    try:
+        port = int(params.get("port", [None])[0]) if params.get("port") else None
+        uploaded = int(params.get("uploaded", [0])[0]) if params.get("uploaded") else None
+        downloaded = int(params.get("downloaded", [0])[0]) if params.get("downloaded") else None
+        left = int(params.get("left", [0])[0]) if params.get("left") else None
+        numwant = int(params.get("numwant", [DEFAULT_NUMWANT])[0])
+    except ValueError:
+        raise TrackerError(400, "Invalid numeric parameter")
+    event = params.get("event", [None])[0]
+
+    if peer_id is None or port is None:
+        raise TrackerError(400, "Missing required parameters")
+    if not 0 <= port <= 65535:
+        raise TrackerError(400, "Invalid port")
+    if info_hash:
+        info_hash = parse_info_hash(info_hash)
+
+    if event != "stopped":
+        # Announce định kỳ (không có event) cũng làm mới peer, nếu không peer bị hết hạn
+        if info_hash:
+            client_list.update_peer(info_hash, peer_id, client_ip, port, uploaded, downloaded, left, event)
+    else:
+        if info_hash:
+            client_list.remove_peer(info_hash, peer_id)
+            logger.info(f"Peer {peer_id} has been removed from {info_hash.hex()} list")
+        else:
+            client_list.remove_peer_from_all(peer_id)
+            logger.info(f"Peer {peer_id} has been removed from all torrents")
+
+    if info_hash:
+        # Lấy danh sách peers và loại bỏ peer của client
+        peers = client_list.get_peers(info_hash, peer_id, numwant)
+        response = {
+            "interval": TRACKER_INTERVAL,
+            "peers": peers,
+            "complete": client_list.get_complete_count(info_hash),
+            "incomplete": client_list.get_incomplete_count(info_hash),
+        }
+    else:
+        response = { "failure reason": "no info_hash parameter suppliede" }
+    return bencodepy.encode(response)
+
+
+def handle_scrape(client_list, params):
+    info_hash = params.get("info_hash", [None])[0]
+    if info_hash is not None:
+        info_hash = parse_info_hash(info_hash)
+
+    scrape_data = client_list.get_scrape_info(info_hash)
+
+    response = {b'files': scrape_data}
+    return bencodepy.encode(response)
+
+
+def handle_ping(params):
+    peer_ip = params.get("peer_ip", [None])[0]
+    try:
+        peer_port = int(params.get("peer_port", [None])[0]) if params.get("peer_port") else None
+    except ValueError:
+        raise TrackerError(400, "Invalid numeric parameter")
+
+    if peer_ip is None or peer_port is None:
+        raise TrackerError(400, "Missing required parameters")
+
+    try:
+        with socket.create_connection((peer_ip, peer_port), timeout=5) as sock:
+            sock.sendall(b'ping')
+            response = sock.recv(1024)
+            if response == b'pong':
+                return 200, b"Client is online"
+            return 500, b"Unexpected response from client"
+    except Exception as e:
+        logger.error(f"Error pinging client: {e}")
+        return 500, b"Client is offline"